@@ -3,14 +3,19 @@
 
 """Annotation 相关"""
 
-import datetime
-
-from typing import Any, List, Optional, Union
+import sys
+from array import array
+from typing import IO, Any, Dict, Iterator, List, Optional, Union
 
 # 解析 XML 时使用的是 defusedxml
 # 这里是为了类型检查
 from xml.etree.ElementTree import Element
 
+# 我觉得在输入确定的环境下用不着这玩意
+# 不过打包到了 PyPI 也不用像以前那样忌惮第三方库了
+# 不用白不用
+import defusedxml.ElementTree  # type: ignore
+
 from Annotations2Sub.Color import Alpha, Color
 from Annotations2Sub.utils import Flags, MakeSureStr, Stderr, _
 
@@ -27,6 +32,13 @@ def Dummy(*args, **kwargs):
     pass
 
 
+class NotAnnotationError(ValueError):
+    """是 XML, 但不是 Annotation 文件
+
+    Annotation 文件里的内容有误(时间, 颜色, 坐标之类的)抛出的是普通的 ValueError
+    """
+
+
 class Annotation:
     """Annotation 结构"""
 
@@ -40,6 +52,27 @@ class Annotation:
     # 本项目对 Annotation 的猜测并不准确
     # 更何况我没有写过 CSS :-)
 
+    # 存档里动辄上百万个 Annotation, 用 __slots__ 省掉每个实例的 __dict__
+    __slots__ = (
+        "id",
+        "type",
+        "style",
+        "text",
+        "timeStart",
+        "timeEnd",
+        "x",
+        "y",
+        "width",
+        "height",
+        "sx",
+        "sy",
+        "bgOpacity",
+        "bgColor",
+        "fgColor",
+        "textSize",
+        "author",
+    )
+
     def __init__(self):
         # 为什么不使用数据类?
         # 因为没必要, 我不指望有人使用本脚本进行二次开发
@@ -58,10 +91,11 @@ class Annotation:
             str,
         ] = "popup"
         self.text: str = ""
-        # 经过上次的时间字符串转换教训, 这次使用了 datetime
-        # 但是其实 Annotation 与 SSA 的时间字符串可以通用
-        self.timeStart: datetime.datetime = datetime.datetime.strptime("0", "%S")
-        self.timeEnd: datetime.datetime = datetime.datetime.strptime("0", "%S")
+        # 经过上次的时间字符串转换教训, 之前使用了 datetime
+        # 但是 strptime 太慢了, 现在用整数毫秒表示时间
+        # 其实 Annotation 与 SSA 的时间字符串可以通用
+        self.timeStart: int = 0
+        self.timeEnd: int = 0
         # Annotation 的定位全部是 "百分比", 还可能是用 CSS 实现的, SSA 能正确显示真是谢天谢地
         self.x: float = 0.0
         self.y: float = 0.0
@@ -90,12 +124,275 @@ class Annotation:
         # self.actionType: Literal["time", "url"] = "time"
         # self.actionUrl: str = ""
         # self.actionUrlTarget: str = ""
-        # self.actionSeconds: datetime.datetime = datetime.datetime.strptime("0", "%S")
+        # self.actionSeconds: int = 0
         # self.highlightId: str = ""
 
 
-def Parse(tree: Element) -> List[Annotation]:
-    """将 XML 树转换为 List[Annotation]"""
+class AnnotationBatch:
+    """按列存放的 Annotation"""
+
+    # Convert 要对每个 Annotation 的坐标做同样的变换
+    # 把坐标抽成一列一列的, 就可以整列一起算
+    # 列用 array 存, 装了 NumPy 的话 Convert 可以直接在上面开一个视图, 不用拷贝
+    # 其他字段还是去 annotations 里拿
+
+    __slots__ = ("annotations", "x", "y", "width", "height", "sx", "sy", "textSize")
+
+    def __init__(self, annotations: List[Annotation]):
+        self.annotations: List[Annotation] = annotations
+        self.x: array = array("d", [each.x for each in annotations])
+        self.y: array = array("d", [each.y for each in annotations])
+        self.width: array = array("d", [each.width for each in annotations])
+        self.height: array = array("d", [each.height for each in annotations])
+        self.sx: array = array("d", [each.sx for each in annotations])
+        self.sy: array = array("d", [each.sy for each in annotations])
+        self.textSize: array = array("d", [each.textSize for each in annotations])
+
+    def __len__(self) -> int:
+        return len(self.annotations)
+
+    def __iter__(self) -> Iterator[Annotation]:
+        return iter(self.annotations)
+
+
+def ParseAnnotationAlpha(alpha: str) -> Alpha:
+    """
+    解析 Annotation 的透明度
+    bgAlpha("0.600000023842") -> Alpha(alpha=102)
+    """
+    if alpha is None:
+        raise Exception("alpha is None")
+    variable1 = float(alpha) * 255
+    return Alpha(alpha=int(variable1))
+
+
+def ParseAnnotationColor(color: str) -> Color:
+    """
+    解析 Annotation 的颜色值
+    bgColor("4210330") -> Color(red=154, green=62, blue=64)
+    """
+    if color is None:
+        raise Exception("color is None")
+    integer = int(color)
+    r = integer & 255
+    g = (integer >> 8) & 255
+    b = integer >> 16
+    return Color(red=r, green=g, blue=b)
+
+
+def ParseTime(timeString: str) -> int:
+    """
+    解析 Annotation 的时间字符串, 返回毫秒
+    ParseTime("0:00:12.5") -> 12500
+    """
+
+    # 之前是拼一个格式字符串交给 datetime.strptime
+    # 每个时间戳都这样来一遍, 是整个转换里最慢的地方
+    # 时间格式是 [H:]M:S[.f], 手写一个就好
+    parts = timeString.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"time data {timeString!r} does not match format")
+    seconds, dot, fraction = parts[-1].partition(".")
+    fields = parts[:-1] + [seconds]
+    if dot:
+        fields.append(fraction)
+    for field in fields:
+        if not (field.isascii() and field.isdigit()):
+            raise ValueError(f"time data {timeString!r} does not match format")
+
+    hours = int(parts[0]) if len(parts) == 3 else 0
+    minutes = int(parts[-2])
+    # 小数部分和 %f 一样, 右边补零, 只保留到毫秒
+    milliseconds = int(fraction[:3].ljust(3, "0")) if dot else 0
+    return ((hours * 60 + minutes) * 60 + int(seconds)) * 1000 + milliseconds
+
+
+def MakeSureElement(element: Any) -> Element:
+    """确保是 Element"""
+    if isinstance(element, Element):
+        return element
+    raise TypeError
+
+
+def Skip(skipped: Optional[Dict[str, int]], reason: str):
+    """记一次跳过的原因"""
+    if skipped != None:
+        skipped[reason] = skipped.get(reason, 0) + 1  # type: ignore
+
+
+def ParseAnnotation(
+    each: Element, skipped: Optional[Dict[str, int]] = None
+) -> Optional[Annotation]:
+    """解析 Annotation, 给了 skipped 的话跳过的原因计在里面"""
+
+    # 致谢: https://github.com/nirbheek/youtube-ass
+    #    & https://github.com/isaackd/annotationlib
+
+    annotation = Annotation()
+
+    annotation_id = MakeSureStr(each.get("id"))
+
+    # 依照
+    # https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L129
+    # 所说
+    # 这里可能有 text, highlight, pause, branding 类型
+    # branding 我不知道是啥
+    # pause 应该不能实现,
+    # 我相信字幕滤镜不会闲的蛋疼实现暂停功能
+    # 而且 annotationlib 也不处理 pause
+    # annotationlib 也不处理空的 type
+    _annotation_type = each.get("type")
+    if _annotation_type is None:
+        Skip(skipped, "no_type")
+        return None
+    # type, style, author 重复得厉害, intern 一下让它们共用一个字符串对象
+    annotation_type = sys.intern(MakeSureStr(_annotation_type))
+    del _annotation_type
+    if annotation_type not in ("text", "highlight", "branding"):
+        Stderr(_("不支持{}类型 ({})").format(annotation_type, annotation_id))
+        Skip(skipped, "unsupported_type")
+        # 我不知道显式的 return None 有什么用
+        # 但是 annotationlib 是这样做的
+        # 我也学学
+        return None
+
+    style = each.get("style")
+    # 根据经验, 没有 style 也就没有内容
+    if style is None:
+        if Flags.verbose:
+            Stderr(_("{} 没有 style, 跳过").format(annotation_id))
+        Skip(skipped, "no_style")
+        return None
+    style = sys.intern(MakeSureStr(style))
+
+    text = ""
+    __text = each.find("TEXT")
+    # 根据经验, 空的 TEXT 只是没有文本, 不是没有内容
+    if __text is None:
+        text = ""
+    if isinstance(__text, Element):
+        _text = __text.text
+        del __text
+        text = MakeSureStr(_text)
+        del _text
+
+    # 类型检查可以避免些低级错误, 提升编码体验, 虽然在 Python 上有些瓦房店化
+    _Segment = each.find("segment").find("movingRegion")  # type: ignore
+    if _Segment is None:  # type: ignore
+        # 学习 annotationlib
+        # https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L117
+        # 跳过没有内容的 Annotation
+        # 之前(f20f9fe fixbugs)学的是 youtube-ass(https://github.com/nirbheek/youtube-ass)
+        # 只是简单地把时间置零
+        if Flags.verbose:
+            Stderr(_("{} 没有 movingRegion, 跳过").format(annotation_id))
+        Skip(skipped, "no_moving_region")
+        return None
+
+    Segment = _Segment.findall("rectRegion")  # type: ignore
+    if len(Segment) == 0:
+        # 在这之前(bdb6559 更新), 这里莫名其妙的包了个括号
+        # 我把整个代码注释一遍原因之一就是为了发现这些问题
+        # 而且这些代码是经验堆积而成, 我希望丰富的注释可以帮助路人理解这些代码怎么运行
+        Segment = _Segment.findall("anchoredRegion")  # type: ignore
+
+    if len(Segment) == 0:
+        if style != "highlightText":
+            # 抄自 https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L121
+            # 不过我现在没见过 highlightText
+            # 我选择相信别人的经验
+            # 我猜 highlightText 一直在屏幕上, 需要手动关闭
+            if Flags.verbose:
+                Stderr(_("{} 没有时间, 跳过").format(annotation_id))
+            Skip(skipped, "no_time")
+            return None
+
+    _Start = _End = "0:00:00.00"
+    if style == "highlightText":
+        _Start = "0:00:00.00"
+        _End = "9:00:00.00"
+
+    t1 = MakeSureStr(Segment[0].get("t"))
+    t2 = MakeSureStr(Segment[1].get("t"))
+    if "never" in (t1, t2):
+        # 跳过不显示的 Annotation
+        if Flags.verbose:
+            Stderr(_("{} 不显示, 跳过").format(annotation_id))
+        Skip(skipped, "never")
+        return None
+
+    _Start = min(t1, t2)
+    _End = max(t1, t2)
+
+    Start = ParseTime(_Start)
+    End = ParseTime(_End)
+
+    del _Start
+    del _End
+
+    x = float(MakeSureStr(Segment[0].get("x")))
+    y = float(MakeSureStr(Segment[0].get("y")))
+
+    annotation.id = annotation_id
+    annotation.type = annotation_type
+    annotation.style = style
+    annotation.text = text
+    annotation.timeStart = Start
+    annotation.timeEnd = End
+    annotation.x = x
+    annotation.y = y
+
+    # 两个 Segment 只有时间差别
+    w = Segment[0].get("w")
+    h = Segment[0].get("h")
+    sx = Segment[0].get("sx")
+    sy = Segment[0].get("sy")
+
+    # 在之前用的是 if x is not None:, 其他人有用 if x:
+    # 我觉得 if x: 用在布尔值上比较好
+    # is not 就算了
+    # 所以用了 if x != None:
+    if w != None:
+        annotation.width = float(MakeSureStr(w))
+    if h != None:
+        annotation.height = float(MakeSureStr(h))
+    if sx != None:
+        annotation.sx = float(MakeSureStr(sx))
+    if sy != None:
+        annotation.sy = float(MakeSureStr(sy))
+
+    Appearance = each.find("appearance")
+
+    # 如果没有 Appearance 下面这些都是有默认值的
+    if Appearance != None:
+        Appearance = MakeSureElement(Appearance)
+        bgAlpha = Appearance.get("bgAlpha")
+        bgColor = Appearance.get("bgColor")
+        fgColor = Appearance.get("fgColor")
+        textSize = Appearance.get("textSize")
+
+        if bgAlpha != None:
+            annotation.bgOpacity = ParseAnnotationAlpha(MakeSureStr(bgAlpha))
+        if bgColor != None:
+            annotation.bgColor = ParseAnnotationColor(MakeSureStr(bgColor))
+        if fgColor != None:
+            annotation.fgColor = ParseAnnotationColor(MakeSureStr(fgColor))
+        if textSize != None:
+            annotation.textSize = float(MakeSureStr(textSize))
+
+    author = each.get("author")
+    if author != None:
+        author = sys.intern(MakeSureStr(author))
+        annotation.author = author
+
+    return annotation
+
+
+def Parse(tree: Element, metrics: Optional[Dict[str, Any]] = None) -> List[Annotation]:
+    """将 XML 树转换为 List[Annotation]
+
+    给了 metrics 的话, 看到的 Annotation 数记在 "annotations", 跳过的原因记在 "skipped"
+    """
 
     # Annotation 文件是一个 XML 文件
     # 详细结构可以看看 src/tests/testCase/annotation.xml.test
@@ -104,211 +401,77 @@ def Parse(tree: Element) -> List[Annotation]:
     # 随着时间推移代码变得越来越糟
     # 幸好当初没傻到直接吐字符串, youtube-ass 就是这么干的
 
-    def ParseAnnotationAlpha(alpha: str) -> Alpha:
-        """
-        解析 Annotation 的透明度
-        bgAlpha("0.600000023842") -> Alpha(alpha=102)
-        """
-        if alpha is None:
-            raise Exception("alpha is None")
-        variable1 = float(alpha) * 255
-        return Alpha(alpha=int(variable1))
-
-    def ParseAnnotationColor(color: str) -> Color:
-        """
-        解析 Annotation 的颜色值
-        bgColor("4210330") -> Color(red=154, green=62, blue=64)
-        """
-        if color is None:
-            raise Exception("color is None")
-        integer = int(color)
-        r = integer & 255
-        g = (integer >> 8) & 255
-        b = integer >> 16
-        return Color(red=r, green=g, blue=b)
-
-    def ParseTime(timeString: str) -> datetime.datetime:
-        colon_count = timeString.count(":")
-        time_format = ""
-        if colon_count == 2:
-            time_format += "%H:"
-        time_format += "%M:%S"
-        if "." in timeString:
-            time_format += ".%f"
-        time = datetime.datetime.strptime(timeString, time_format)
-        return time
-
-    def MakeSureElement(element: Any) -> Element:
-        """确保是 Element"""
-        if isinstance(element, Element):
-            return element
-        raise TypeError
-
-    def ParseAnnotation(each: Element) -> Optional[Annotation]:
-        """解析 Annotation"""
-
-        # 致谢: https://github.com/nirbheek/youtube-ass
-        #    & https://github.com/isaackd/annotationlib
-
-        annotation = Annotation()
-
-        annotation_id = MakeSureStr(each.get("id"))
-
-        # 依照
-        # https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L129
-        # 所说
-        # 这里可能有 text, highlight, pause, branding 类型
-        # branding 我不知道是啥
-        # pause 应该不能实现,
-        # 我相信字幕滤镜不会闲的蛋疼实现暂停功能
-        # 而且 annotationlib 也不处理 pause
-        # annotationlib 也不处理空的 type
-        _annotation_type = each.get("type")
-        if _annotation_type is None:
-            return None
-        annotation_type = MakeSureStr(_annotation_type)
-        del _annotation_type
-        if annotation_type not in ("text", "highlight", "branding"):
-            Stderr(_("不支持{}类型 ({})").format(annotation_type, annotation_id))
-            # 我不知道显式的 return None 有什么用
-            # 但是 annotationlib 是这样做的
-            # 我也学学
-            return None
-
-        style = each.get("style")
-        # 根据经验, 没有 style 也就没有内容
-        if style is None:
-            if Flags.verbose:
-                Stderr(_("{} 没有 style, 跳过").format(annotation_id))
-            return None
-        style = MakeSureStr(style)
-
-        text = ""
-        __text = each.find("TEXT")
-        # 根据经验, 空的 TEXT 只是没有文本, 不是没有内容
-        if __text is None:
-            text = ""
-        if isinstance(__text, Element):
-            _text = __text.text
-            del __text
-            text = MakeSureStr(_text)
-            del _text
-
-        # 类型检查可以避免些低级错误, 提升编码体验, 虽然在 Python 上有些瓦房店化
-        _Segment = each.find("segment").find("movingRegion")  # type: ignore
-        if _Segment is None:  # type: ignore
-            # 学习 annotationlib
-            # https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L117
-            # 跳过没有内容的 Annotation
-            # 之前(f20f9fe fixbugs)学的是 youtube-ass(https://github.com/nirbheek/youtube-ass)
-            # 只是简单地把时间置零
-            if Flags.verbose:
-                Stderr(_("{} 没有 movingRegion, 跳过").format(annotation_id))
-            return None
-
-        Segment = _Segment.findall("rectRegion")  # type: ignore
-        if len(Segment) == 0:
-            # 在这之前(bdb6559 更新), 这里莫名其妙的包了个括号
-            # 我把整个代码注释一遍原因之一就是为了发现这些问题
-            # 而且这些代码是经验堆积而成, 我希望丰富的注释可以帮助路人理解这些代码怎么运行
-            Segment = _Segment.findall("anchoredRegion")  # type: ignore
-
-        if len(Segment) == 0:
-            if style != "highlightText":
-                # 抄自 https://github.com/isaackd/annotationlib/blob/0818bddadade8dd1d13f3006e34a5837a539567f/src/parser/index.js#L121
-                # 不过我现在没见过 highlightText
-                # 我选择相信别人的经验
-                # 我猜 highlightText 一直在屏幕上, 需要手动关闭
-                if Flags.verbose:
-                    Stderr(_("{} 没有时间, 跳过").format(annotation_id))
-                return None
-
-        _Start = _End = "0:00:00.00"
-        if style == "highlightText":
-            _Start = "0:00:00.00"
-            _End = "9:00:00.00"
-
-        t1 = MakeSureStr(Segment[0].get("t"))
-        t2 = MakeSureStr(Segment[1].get("t"))
-        if "never" in (t1, t2):
-            # 跳过不显示的 Annotation
-            if Flags.verbose:
-                Stderr(_("{} 不显示, 跳过").format(annotation_id))
-            return None
-
-        _Start = min(t1, t2)
-        _End = max(t1, t2)
-
-        Start = ParseTime(_Start)
-        End = ParseTime(_End)
-
-        del _Start
-        del _End
-
-        x = float(MakeSureStr(Segment[0].get("x")))
-        y = float(MakeSureStr(Segment[0].get("y")))
-
-        annotation.id = annotation_id
-        annotation.type = annotation_type
-        annotation.style = style
-        annotation.text = text
-        annotation.timeStart = Start
-        annotation.timeEnd = End
-        annotation.x = x
-        annotation.y = y
-
-        # 两个 Segment 只有时间差别
-        w = Segment[0].get("w")
-        h = Segment[0].get("h")
-        sx = Segment[0].get("sx")
-        sy = Segment[0].get("sy")
-
-        # 在之前用的是 if x is not None:, 其他人有用 if x:
-        # 我觉得 if x: 用在布尔值上比较好
-        # is not 就算了
-        # 所以用了 if x != None:
-        if w != None:
-            annotation.width = float(MakeSureStr(w))
-        if h != None:
-            annotation.height = float(MakeSureStr(h))
-        if sx != None:
-            annotation.sx = float(MakeSureStr(sx))
-        if sy != None:
-            annotation.sy = float(MakeSureStr(sy))
-
-        Appearance = each.find("appearance")
-
-        # 如果没有 Appearance 下面这些都是有默认值的
-        if Appearance != None:
-            Appearance = MakeSureElement(Appearance)
-            bgAlpha = Appearance.get("bgAlpha")
-            bgColor = Appearance.get("bgColor")
-            fgColor = Appearance.get("fgColor")
-            textSize = Appearance.get("textSize")
-
-            if bgAlpha != None:
-                annotation.bgOpacity = ParseAnnotationAlpha(MakeSureStr(bgAlpha))
-            if bgColor != None:
-                annotation.bgColor = ParseAnnotationColor(MakeSureStr(bgColor))
-            if fgColor != None:
-                annotation.fgColor = ParseAnnotationColor(MakeSureStr(fgColor))
-            if textSize != None:
-                annotation.textSize = float(MakeSureStr(textSize))
-
-        author = each.get("author")
-        if author != None:
-            author = MakeSureStr(author)
-            annotation.author = author
-
-        return annotation
-
     Dummy([ParseAnnotationAlpha, ParseAnnotationColor, MakeSureElement])
     annotations: List[Annotation] = []
+    skipped = None
+    if metrics != None:
+        skipped = metrics.setdefault("skipped", {})  # type: ignore
     # 下面这行代码先从 youtube-ass 传到之前的 Annotations2Sub, 再从之前的 Annotations2Sub 传到这里
-    for each in tree.find("annotations").findall("annotation"):  # type: ignore
-        annotation = ParseAnnotation(each)
+    elements = tree.find("annotations").findall("annotation")  # type: ignore
+    for each in elements:
+        try:
+            annotation = ParseAnnotation(each, skipped)
+        except (AttributeError, TypeError, IndexError) as e:
+            # 少了 segment, t, x 之类的, 和时间颜色写错一样算内容有误
+            raise ValueError(f"malformed annotation {each.get('id')}") from e
         if annotation != None:
             # 我想这个类型检查真是奇怪, 但是我也不知道该怎么做
             annotations.append(annotation)  # type: ignore
+    if metrics != None:
+        metrics["annotations"] = metrics.get("annotations", 0) + len(elements)  # type: ignore
 
     return annotations
+
+
+def ParseBatch(
+    tree: Element, metrics: Optional[Dict[str, Any]] = None
+) -> AnnotationBatch:
+    """将 XML 树转换为 AnnotationBatch"""
+    return AnnotationBatch(Parse(tree, metrics))
+
+
+def IterParse(
+    source: Union[str, IO[bytes], IO[str]], metrics: Optional[Dict[str, Any]] = None
+) -> Iterator[Annotation]:
+    """流式解析 Annotation 文件, 逐个产出 Annotation
+
+    不是 Annotation 文件时抛出 NotAnnotationError, metrics 和 Parse 的一样
+    """
+
+    # Parse 需要先建好整棵 XML 树, 几 MB 的存档文件内存占用就上去了
+    # 这里用 iterparse 边读边解析, 每解析完一个 <annotation> 就把它从树上摘掉
+    # 跳过规则与 Parse 一致, 都在 ParseAnnotation 里
+    # 和 Parse 一样只看根元素下的第一个 <annotations>
+    # source 可以是文件路径或打开的文件
+    skipped = None
+    if metrics != None:
+        skipped = metrics.setdefault("skipped", {})  # type: ignore
+    count = 0
+    annotations: Optional[Element] = None
+    stack: List[Element] = []
+    for event, element in defusedxml.ElementTree.iterparse(
+        source, events=("start", "end")
+    ):
+        if event == "start":
+            if len(stack) == 1 and annotations == None and element.tag == "annotations":
+                annotations = element
+            stack.append(element)
+            continue
+        stack.pop()
+        if element.tag != "annotation" or len(stack) == 0:
+            continue
+        parent = stack[-1]
+        if parent is not annotations:
+            continue
+        count += 1
+        try:
+            annotation = ParseAnnotation(element, skipped)
+        except (AttributeError, TypeError, IndexError) as e:
+            raise ValueError(f"malformed annotation {element.get('id')}") from e
+        parent.remove(element)
+        if annotation != None:
+            yield annotation  # type: ignore
+    if annotations == None:
+        raise NotAnnotationError("not an annotation file")
+    if metrics != None:
+        metrics["annotations"] = metrics.get("annotations", 0) + count  # type: ignore
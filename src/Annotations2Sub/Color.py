@@ -5,6 +5,8 @@
 
 
 class Color:
+    __slots__ = ("red", "green", "blue")
+
     def __init__(
         self,
         red: int = 0,
@@ -23,6 +25,8 @@ class Color:
 
 
 class Alpha:
+    __slots__ = ("alpha",)
+
     def __init__(
         self,
         alpha: int = 0,
@@ -33,6 +37,8 @@ class Alpha:
 
 
 class Rgba:
+    __slots__ = ("red", "green", "blue", "alpha")
+
     def __init__(self, color: Color = Color(), alpha: Alpha = Alpha()):
         self.red = color.red
         self.green = color.green
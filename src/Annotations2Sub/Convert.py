@@ -4,323 +4,593 @@
 """转换器"""
 
 import copy
-from typing import List
+import functools
+import io
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 # 在重写本项目前, 我写了一些 Go 的代码
 # 依照在 Go 中的经验把一个脚本拆成若干个模块
 # 并上传到 PyPI
 # 当然单文件脚本还是有用的
-from Annotations2Sub.Annotation import Annotation
-from Annotations2Sub.Color import Alpha, Color
-from Annotations2Sub.Sub import Draw, DrawCommand, Event
-from Annotations2Sub.utils import Stderr, _
-
-
-def Convert(
-    annotations: List[Annotation],
+from Annotations2Sub.Annotation import Annotation, AnnotationBatch, IterParse
+from Annotations2Sub.Color import Alpha, Color, Rgba
+from Annotations2Sub.Sub import Event, Style, Sub
+from Annotations2Sub.utils import Stderr, Timer, Warn, _
+
+# NumPy 是可选的, 有就用来整列计算坐标, 没有就一个一个算
+# 导入 NumPy 要 0.1 秒, 比转换一个小文件还久, 所以 Annotation 多的时候才导入
+# False 表示还没导入过, None 表示没有 NumPy
+numpy: Any = False
+NUMPY_THRESHOLD = 1000
+
+
+def ImportNumpy() -> Any:
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module  # type: ignore
+
+            numpy = module
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+# 00 到 FF, 每个 Event 都要格式化颜色和透明度, 查表比 format 快
+HEX = ["{:02X}".format(i) for i in range(256)]
+# SSA 的 Alpha 是透明度, 00 为不透明，FF 为全透明
+ALPHA = ["&H" + HEX[255 - i] + "&" for i in range(256)]
+
+
+def DumpColor(color: Color) -> str:
+    """将 Color 转换为 SSA 的颜色表示"""
+    red, green, blue = color.red, color.green, color.blue
+    if 0 <= red <= 255 and 0 <= green <= 255 and 0 <= blue <= 255:
+        return "&H" + HEX[red] + HEX[green] + HEX[blue] + "&"
+    return "&H{:02X}{:02X}{:02X}&".format(red, green, blue)
+
+
+def StyleColor(color: Color) -> Color:
+    """样式里用的颜色
+
+    DumpColor 按红绿蓝的顺序写, 字幕滤镜按 BBGGRR 读, 样式按 AABBGGRR 写, 要反过来才一样
+    """
+    return Color(color.blue, color.green, color.red)
+
+
+def DumpAlpha(alpha: Alpha) -> str:
+    """将 Alpha 转换为 SSA 的 Alpha 表示"""
+
+    # 据 https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范 所说
+    # SSA 的 Alpha 是透明度, 00 为不透明，FF 为全透明
+    if 0 <= alpha.alpha <= 255:
+        return ALPHA[alpha.alpha]
+    return "&H{:02X}&".format(255 - alpha.alpha)
+
+
+class Geometry:
+    """变换后的坐标, 按列存放"""
+
+    __slots__ = (
+        "x",
+        "y",
+        "textSize",
+        "width",
+        "height",
+        "sx",
+        "sy",
+        "x1",
+        "y1",
+        "x2",
+    )
+
+    def __init__(self):
+        self.x: List[float] = []
+        self.y: List[float] = []
+        self.textSize: List[float] = []
+        self.width: List[float] = []
+        self.height: List[float] = []
+        self.sx: List[float] = []
+        self.sy: List[float] = []
+        # x1, y1, x2 是 speech 样式气泡三角形的两个点, 相对于气泡锚点
+        self.x1: List[float] = []
+        self.y1: List[float] = []
+        self.x2: List[float] = []
+
+
+def TransformGeometry(
+    batch: AnnotationBatch,
     libass: bool = False,
     resolutionX: int = 100,
     resolutionY: int = 100,
-) -> List[Event]:
-    """转换 Annotations"""
-
-    def DumpColor(color: Color) -> str:
-        """将 Color 转换为 SSA 的颜色表示"""
-        return "&H{:02X}{:02X}{:02X}&".format(color.red, color.green, color.blue)
-
-    def DumpAlpha(alpha: Alpha) -> str:
-        """将 Alpha 转换为 SSA 的 Alpha 表示"""
-
-        # 据 https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范 所说
-        # SSA 的 Alpha 是透明度, 00 为不透明，FF 为全透明
-        return "&H{:02X}&".format(255 - alpha.alpha)
-
-    def ConvertAnnotation(each: Annotation) -> List[Event]:
-        """将 Annotation 转换为 List[Event]"""
-
-        # 致谢: https://github.com/nirbheek/youtube-ass &
-        #       https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范
-
-        def Text(event: Event) -> Event:
-            """生成 Annotation 文本的 Event"""
-
-            # Annotation 无非就是文本, 框, 或者是一个点击按钮和动图
-            # 之前我用了一个函数生成标签, 还不如直接拼接
-            tag = ""
-            # 样式复写代码, 样式复写标签, ASS 标签, 特效标签, Aegisub 特效标签, 标签
-            # 带引号的是从 https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范 粘过来的
-            # "\an<位置>"
-            # "<位置> 是一个数字，决定了字幕显示在屏幕上哪个位置。"
-            # 默认 SSA 定位会定在文本中间
-            # 用 \an7 指定在左上角.
-            # "\pos(<x>,<y>)"
-            # "将字幕定位在坐标点 <x>,<y>。"
-            # SSA 和 Annotation 坐标系一致, y 向下(左手取向).
-            # 这里坐标 +1 是为了美观, 与 Annotation 行为不一致
-            tag += rf"\an7\pos({x + 1},{y + 1})"
-            # "\fs<字体尺寸>"
-            # "<字体尺寸> 是一个数字，指定了字体的点的尺寸。"
-            # "注意，这里的字体尺寸并不是字号的大小，\fs20 并不是字体大小（font-size）为 20px，"
-            # "而是指其行高（line-height）为 20px，主要归咎于 VSFilter 使用的 Windows GDI 的字体接口。"
-            # 不明白字体大小和行高有什么区别
-            tag += rf"\fs{str(textSize)}"
-            # "\[<颜色序号>]c[&][H]<BBGGRR>[&]"
-            # "<BBGGRR> 是一个十六进制的 RGB 值，但颜色顺序相反，前导的 0 可以省略。"
-            # "<颜色序号> 可选值为 1、2、3 和 4，分别对应单独设置 PrimaryColour、SecondaryColour、OutlineColor 和 BackColour"
-            # "其中的 & 和 H 按规范应该是要有的，但是如果没有也能正常解析。"
-            # PrimaryColour 填充颜色, SecondaryColour 卡拉OK变色, OutlineColor 边框颜色, BackColour 阴影颜色
-            tag += rf"\c{DumpColor(each.fgColor)}"
-            # "\<颜色序号>a[&][H]<AA>[&]"
-            # "<AA> 是一个十六进制的透明度数值，00 为全见，FF 为全透明。"
-            # "<颜色序号> 含义同上，但这里不能省略。写法举例：\1a&H80&、\2a&H80、\3a80、\4a&H80&。"
-            # "其中的 & 和 H 按规范应该是要有的，但是如果没有也能正常解析。"
-            # Annotation 文本好像没有透明度, 这个很符合直觉
-            tag += r"\2a&HFF&\3a&HFF&\4a&HFF&"
-            # 现在加个括号就成了
-            tag = "{" + tag + "}"
-            # 直接拼接就可以了
-            event.Text = tag + event.Text
-            return event
-
-        def Box(event: Event) -> Event:
-            """生成 Annotation 文本框的 Event"""
-            event.Layer = 0
-
-            # 没什么太大的变化
-            tag = ""
-            tag += rf"\an7\pos({x},{y})"
-            tag += rf"\c{DumpColor(each.bgColor)}"
-            tag += rf"\1a{DumpAlpha(each.bgOpacity)}"
-            tag += r"\2a&HFF&\3a&HFF&\4a&HFF&"
-            tag = "{" + tag + "}"
-
-            # 在之前这里我拼接字符串, 做的还没有全民核酸检测好
-            # 现在画四个点直接闭合一个框
-            d = Draw()
-            d.Add(DrawCommand(0, 0, "m"))
-            d.Add(DrawCommand(width, 0, "l"))
-            d.Add(DrawCommand(width, height, "l"))
-            d.Add(DrawCommand(0, height, "l"))
-            box = d.Dump()
-            # "绘图命令必须被包含在 {\p<等级>} 和 {\p0} 之间。"
-            box_tag = r"{\p1}" + box + r"{\p0}"
-            del box
-
-            event.Text = tag + box_tag
-            return event
-
-        def popup_text(event: Event) -> Event:
-            """生成 popup 样式的文本 Event"""
-
-            # 多加几个字, 便于调试
-            event.Name += "popup_text;"
-
-            return Text(event)
-
-        def popup_box(event: Event) -> Event:
-            """生成 popup 样式的框 Event"""
-            event.Name = event.Name + "popup_box;"
-
-            return Box(event)
-
-        def title(event: Event) -> Event:
-            """生成 title 样式的 Event"""
-
-            # 很明显 title 的字体大小和其他的不一样
-            # 很像是我们熟悉的 "字体大小"
-            # 但好像又不是
-            # / 4 也是试出来的
-            if resolutionX == 100 and resolutionY == 100:
-                nonlocal textSize  # type: ignore
-                textSize = round(textSize / 4, 3)
-
-            event.Name += ";title"
-
-            return Text(event)
-
-        def highlightText_text(event: Event) -> Event:
-            """生成 highlightText 样式的文本 Event"""
-            event.Name += "highlightText_text;"
-
-            return Text(event)
-
-        def highlightText_box(event: Event) -> Event:
-            """生成 highlightText 样式的框 Event"""
-            event.Name = event.Name + "highlightText_box;"
-
-            return Box(event)
-
-        def speech_text(event: Event) -> Event:
-            """生成 speech 样式的文本 Event"""
-            event.Name += "speech_text;"
-
-            return Text(event)
-
-        def speech_box_1(event: Event) -> Event:
-            """生成 speech 样式的框 Event"""
-            event.Name += "speech_box_1;"
-
-            return Box(event)
-
-        def speech_box_2(event: Event) -> Event:
-            """生成 speech 样式的第二个框 Event"""
-            event.Name += "speech_box_2;"
-            event.Layer = 0
-
-            tag = ""
-            tag += rf"\an7\pos({sx},{sy})"
-            tag += rf"\c{DumpColor(each.bgColor)}"
-            tag += rf"\1a{DumpAlpha(each.bgOpacity)}"
-            tag += r"\2a&HFF&" + r"\3a&HFF&" + r"\4a&HFF&"
-            tag = "{" + tag + "}"
-
-            # 开始只是按部就班的画一个气泡框
-            # 之后我想可以拆成一个普通的方框和一个三角形
-            # 这可以直接复用 Box, 气泡锚点定位也可以直接使用 /pos
-            # 绘图变得更简单, 一共三个点
-
-            # 图形定位在气泡锚点上, 图形需要画成一个三角形和 Box 拼接成一个气泡框
-            # 原点是 (0,0), 那么如果锚点在框的下方点就应该往上画, 反之赤然
+) -> Geometry:
+    """整列变换 AnnotationBatch 的坐标"""
+
+    # 这里处理下数据供后面使用
+    # Annotation 的定位是"百分比"
+    # 恰好直接把"分辨率"设置为 100 就可以实现
+    # 但是这其实还是依赖于字幕滤镜的怪癖
+    transform_coefficient_x = resolutionX / 100
+    transform_coefficient_y = resolutionY / 100
+    # 针对 libass 的 hack
+    # 我也不知道 libass 咋回事
+    # 1.776 是试出来的
+    # 而且仅适用于 16:9 分辨率
+    # 不要指望我在 libass 开 issue
+    # 毕竟不知道还有多少脚本依赖于这个怪癖
+    libass_hack = libass and resolutionX == 100 and resolutionY == 100
+
+    geometry = Geometry()
+
+    if len(batch) < NUMPY_THRESHOLD or ImportNumpy() is None:
+
+        def Scale(column, coefficient: float) -> List[float]:
+            # 浮点数太长了, 为了美观, 用 round 截断成三位, 字幕滤镜本身是支持小数的
+            return [round(i * coefficient, 3) for i in column]
+
+        x = Scale(batch.x, transform_coefficient_x)
+        y = Scale(batch.y, transform_coefficient_y)
+        textSize = Scale(batch.textSize, transform_coefficient_y)
+        width = Scale(batch.width, transform_coefficient_x)
+        height = Scale(batch.height, transform_coefficient_y)
+        sx = Scale(batch.sx, transform_coefficient_x)
+        sy = Scale(batch.sy, transform_coefficient_y)
+        if libass_hack:
+            width = Scale(width, 1.776)
+            # sy 是中间变量, 不需要 round
+            sy = [i * 1.776 for i in sy]
 
+        # 图形定位在气泡锚点上, 图形需要画成一个三角形和 Box 拼接成一个气泡框
+        # 原点是 (0,0), 那么如果锚点在框的下方点就应该往上画, 反之赤然
+        for _x, _y, _width, _height, _sx, _sy in zip(x, y, width, height, sx, sy):
             # 以气泡锚点为原点求相对位置
-            x1 = x - sx
-            x2 = x - sx
+            x1 = x2 = _x - _sx
             # 锚点靠那边就往那边画
-            if sx < x + width / 2:
-                x1 = x1 + width * 0.2
-                x2 = x2 + width * 0.4
+            if _sx < _x + _width / 2:
+                x1 = x1 + _width * 0.2
+                x2 = x2 + _width * 0.4
             else:
-                x1 = x1 + width * 0.8
-                x2 = x2 + width * 0.6
-
-            # 以气泡锚点为原点求相对位置
-            y1 = y - sy
+                x1 = x1 + _width * 0.8
+                x2 = x2 + _width * 0.6
+            y1 = _y - _sy
             # 如果锚点在框的下方那么三角的边接的是框的下边, 所以是 y1 + height
-            if sy > y:
-                y1 = y1 + height
-
-            x1 = round(x1, 3)
-            y1 = round(y1, 3)
-            x2 = round(x2, 3)
-
-            d = Draw()
-            # 一共三个点, 怎么画都是个三角形
-            d.Add(DrawCommand(0, 0, "m"))
-            d.Add(DrawCommand(x1, y1, "l"))
-            d.Add(DrawCommand(x2, y1, "l"))
-            box = d.Dump()
-            box_tag = r"{\p1}" + box + r"{\p0}"
-            del box
+            if _sy > _y:
+                y1 = y1 + _height
+            geometry.x1.append(round(x1, 3))
+            geometry.y1.append(round(y1, 3))
+            geometry.x2.append(round(x2, 3))
+
+        geometry.x = x
+        geometry.y = y
+        geometry.textSize = textSize
+        geometry.width = width
+        geometry.height = height
+        geometry.sx = sx
+        geometry.sy = sy
+        return geometry
+
+    def Round(column):
+        """和 round(i, 3) 结果一致的整列 round"""
+        scaled = column * 1000
+        result = numpy.rint(scaled) / 1000
+        # 乘上 1000 会有误差, 恰好在 .5 附近时 rint 和 round 可能不一致
+        # 这种情况很少, 交给 round 处理
+        ties = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6
+        for i in numpy.nonzero(ties)[0]:
+            result[i] = round(float(column[i]), 3)
+        return result
+
+    def Column(column):
+        return numpy.frombuffer(column, dtype=numpy.float64)
+
+    x = Round(Column(batch.x) * transform_coefficient_x)
+    y = Round(Column(batch.y) * transform_coefficient_y)
+    textSize = Round(Column(batch.textSize) * transform_coefficient_y)
+    width = Round(Column(batch.width) * transform_coefficient_x)
+    height = Round(Column(batch.height) * transform_coefficient_y)
+    sx = Round(Column(batch.sx) * transform_coefficient_x)
+    sy = Round(Column(batch.sy) * transform_coefficient_y)
+    if libass_hack:
+        width = Round(width * 1.776)
+        sy = sy * 1.776
+
+    left = sx < x + width / 2
+    x1 = numpy.where(left, (x - sx) + width * 0.2, (x - sx) + width * 0.8)
+    x2 = numpy.where(left, (x - sx) + width * 0.4, (x - sx) + width * 0.6)
+    y1 = numpy.where(sy > y, (y - sy) + height, y - sy)
+
+    # 转回 float, 格式化出来的字符串才和上面一致
+    geometry.x = x.tolist()
+    geometry.y = y.tolist()
+    geometry.textSize = textSize.tolist()
+    geometry.width = width.tolist()
+    geometry.height = height.tolist()
+    geometry.sx = sx.tolist()
+    geometry.sy = sy.tolist()
+    geometry.x1 = Round(x1).tolist()
+    geometry.y1 = Round(y1).tolist()
+    geometry.x2 = Round(x2).tolist()
+    return geometry
+
+
+# 框和气泡的三角形只和宽高, 三个点有关, 同一个视频里的注释大小往往差不多
+# 直接拼出 Draw 画出来的字符串并存起来, 不用每个 Annotation 建一遍 Draw 和 DrawCommand
+# 参数都是 TransformGeometry 里 round 过的, 重复的很多
+def BoxDrawing(width: float, height: float) -> str:
+    """和 Draw 画四个点的框一样的绘图标签"""
+    # "绘图命令必须被包含在 {\p<等级>} 和 {\p0} 之间。"
+    return rf"{{\p1}}m 0 0 l {width} 0 l {width} {height} l 0 {height} {{\p0}}"
+
+
+def TriangleDrawing(x1: float, y1: float, x2: float) -> str:
+    """和 Draw 画三个点的三角形一样的绘图标签"""
+    return rf"{{\p1}}m 0 0 l {x1} {y1} l {x2} {y1} {{\p0}}"
+
+
+# 0.0 和 -0.0 相等, 缓存分不出来, 但是打印出来不一样, 所以有 0 的不查缓存
+# typed 区分 1 和 1.0
+CachedBoxDrawing = functools.lru_cache(maxsize=4096, typed=True)(BoxDrawing)
+CachedTriangleDrawing = functools.lru_cache(maxsize=4096, typed=True)(TriangleDrawing)
+
+
+class Emitter:
+    """生成各种 Event, 每次 Convert 建一个
+
+    选项, 变换好的坐标和拼好的标签片段都放在这里, 不用每个 Annotation 重新定义一遍函数
+    每个方法接收 (Event, Annotation, 下标), 填好 Event 的 Text 和 Layer 再返回
+    """
+
+    # 致谢: https://github.com/nirbheek/youtube-ass &
+    #       https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范
+
+    def __init__(
+        self,
+        geometry: Geometry,
+        libass: bool = False,
+        resolutionX: int = 100,
+        resolutionY: int = 100,
+        styles: Optional[Dict[str, Style]] = None,
+    ):
+        self.geometry = geometry
+        self.libass = libass
+        self.resolutionX = resolutionX
+        self.resolutionY = resolutionY
+        # 一个文件里的颜色, 透明度和字体大小就那么几种, 拼好的标签片段存起来
+        # {(字体大小, 红, 绿, 蓝): 文本标签}, {(红, 绿, 蓝, 透明度): 框标签}
+        self.text_tags: Dict[tuple, str] = {}
+        self.box_tags: Dict[tuple, str] = {}
+        # 给了 styles 的话, 同样的键不拼标签, 而是生成一个样式放进 styles
+        # 和上面一样的键, 值是样式名
+        self.styles = styles
+        self.text_styles: Dict[tuple, str] = {}
+        self.box_styles: Dict[tuple, str] = {}
+
+    def TextTag(self, textSize: float, color: Color) -> str:
+        key = (textSize, color.red, color.green, color.blue)
+        tag = self.text_tags.get(key)
+        if tag == None:
+            tag = rf"\fs{str(textSize)}\c{DumpColor(color)}\2a&HFF&\3a&HFF&\4a&HFF&}}"
+            self.text_tags[key] = tag
+        return tag  # type: ignore
+
+    def BoxTag(self, color: Color, alpha: Alpha) -> str:
+        key = (color.red, color.green, color.blue, alpha.alpha)
+        tag = self.box_tags.get(key)
+        if tag == None:
+            tag = (
+                rf"\c{DumpColor(color)}\1a{DumpAlpha(alpha)}\2a&HFF&\3a&HFF&\4a&HFF&}}"
+            )
+            self.box_tags[key] = tag
+        return tag  # type: ignore
+
+    def SharedStyle(self, kind: str, names: Dict[tuple, str], key: tuple) -> Style:
+        """新建一个样式, 和 \an7 加上 \2a&HFF&\3a&HFF&\4a&HFF& 效果一样"""
+        name = f"{kind}{len(names) + 1}"
+        names[key] = name
+        style = Style()
+        style.Alignment = 7
+        for rgba in (style.SecondaryColour, style.OutlineColour, style.BackColour):
+            rgba.alpha = 255
+        self.styles[name] = style  # type: ignore
+        return style
+
+    def TextStyle(self, textSize: float, color: Color) -> str:
+        """和 TextTag 一样效果的样式名"""
+        key = (textSize, color.red, color.green, color.blue)
+        if key not in self.text_styles:
+            style = self.SharedStyle("Text", self.text_styles, key)
+            style.Fontsize = textSize
+            style.PrimaryColour = Rgba(StyleColor(color), Alpha(0))
+        return self.text_styles[key]
+
+    def BoxStyle(self, color: Color, alpha: Alpha) -> str:
+        """和 BoxTag 一样效果的样式名"""
+        key = (color.red, color.green, color.blue, alpha.alpha)
+        if key not in self.box_styles:
+            style = self.SharedStyle("Box", self.box_styles, key)
+            # 样式里的 Alpha 是透明度, 和 DumpAlpha 一样反过来
+            transparency = min(255, max(0, 255 - alpha.alpha))
+            style.PrimaryColour = Rgba(StyleColor(color), Alpha(transparency))
+        return self.box_styles[key]
+
+    def Text(
+        self, event: Event, each: Annotation, i: int, textSize: Optional[float] = None
+    ) -> Event:
+        """生成 Annotation 文本的 Event"""
+        if textSize == None:
+            textSize = self.geometry.textSize[i]
+
+        # Annotation 无非就是文本, 框, 或者是一个点击按钮和动图
+        # 之前我用了一个函数生成标签, 还不如直接拼接
+        tag = "{"
+        # 样式复写代码, 样式复写标签, ASS 标签, 特效标签, Aegisub 特效标签, 标签
+        # 带引号的是从 https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范 粘过来的
+        # "\an<位置>"
+        # "<位置> 是一个数字，决定了字幕显示在屏幕上哪个位置。"
+        # 默认 SSA 定位会定在文本中间
+        # 用 \an7 指定在左上角.
+        # "\pos(<x>,<y>)"
+        # "将字幕定位在坐标点 <x>,<y>。"
+        # SSA 和 Annotation 坐标系一致, y 向下(左手取向).
+        # 这里坐标 +1 是为了美观, 与 Annotation 行为不一致
+        tag += rf"\an7\pos({self.geometry.x[i] + 1},{self.geometry.y[i] + 1})"
+        # 后面的 \fs, \c, \2a\3a\4a 只和字体大小, 颜色有关, 在 TextTag 里拼好存起来
+        # "\fs<字体尺寸>"
+        # "<字体尺寸> 是一个数字，指定了字体的点的尺寸。"
+        # "注意，这里的字体尺寸并不是字号的大小，\fs20 并不是字体大小（font-size）为 20px，"
+        # "而是指其行高（line-height）为 20px，主要归咎于 VSFilter 使用的 Windows GDI 的字体接口。"
+        # 不明白字体大小和行高有什么区别
+        # "\[<颜色序号>]c[&][H]<BBGGRR>[&]"
+        # "<BBGGRR> 是一个十六进制的 RGB 值，但颜色顺序相反，前导的 0 可以省略。"
+        # "<颜色序号> 可选值为 1、2、3 和 4，分别对应单独设置 PrimaryColour、SecondaryColour、OutlineColor 和 BackColour"
+        # "其中的 & 和 H 按规范应该是要有的，但是如果没有也能正常解析。"
+        # PrimaryColour 填充颜色, SecondaryColour 卡拉OK变色, OutlineColor 边框颜色, BackColour 阴影颜色
+        # "\<颜色序号>a[&][H]<AA>[&]"
+        # "<AA> 是一个十六进制的透明度数值，00 为全见，FF 为全透明。"
+        # "<颜色序号> 含义同上，但这里不能省略。写法举例：\1a&H80&、\2a&H80、\3a80、\4a&H80&。"
+        # "其中的 & 和 H 按规范应该是要有的，但是如果没有也能正常解析。"
+        # Annotation 文本好像没有透明度, 这个很符合直觉
+        # 现在加个括号就成了
+        if self.styles == None:
+            tag += self.TextTag(textSize, each.fgColor)  # type: ignore
+        else:
+            # 只留下位置, \an7 和剩下的交给样式
+            event.Style = self.TextStyle(textSize, each.fgColor)  # type: ignore
+            tag = rf"{{\pos({self.geometry.x[i] + 1},{self.geometry.y[i] + 1})}}"
+        # 直接拼接就可以了
+        event.Text = tag + event.Text
+        return event
+
+    def Title(self, event: Event, each: Annotation, i: int) -> Event:
+        """生成 title 样式的 Event"""
+
+        # 很明显 title 的字体大小和其他的不一样
+        # 很像是我们熟悉的 "字体大小"
+        # 但好像又不是
+        # / 4 也是试出来的
+        textSize = self.geometry.textSize[i]
+        if self.resolutionX == 100 and self.resolutionY == 100:
+            textSize = round(textSize / 4, 3)
+        return self.Text(event, each, i, textSize)
+
+    def Box(self, event: Event, each: Annotation, i: int) -> Event:
+        """生成 Annotation 文本框的 Event"""
+        event.Layer = 0
+        width = self.geometry.width[i]
+        height = self.geometry.height[i]
+
+        # 没什么太大的变化
+        tag = rf"{{\an7\pos({self.geometry.x[i]},{self.geometry.y[i]})"
+        if self.styles == None:
+            tag += self.BoxTag(each.bgColor, each.bgOpacity)
+        else:
+            event.Style = self.BoxStyle(each.bgColor, each.bgOpacity)
+            tag = rf"{{\pos({self.geometry.x[i]},{self.geometry.y[i]})}}"
 
-            event.Text = tag + box_tag
-            return event
+        # 在之前这里我拼接字符串, 做的还没有全民核酸检测好
+        # 后来用 Draw 画四个点直接闭合一个框, 现在连 Draw 也省了, 见 BoxDrawing
+        if width and height:
+            box_tag = CachedBoxDrawing(width, height)
+        else:
+            box_tag = BoxDrawing(width, height)
 
-        def anchored_text(event: Event) -> Event:
-            """生成 anchored 样式的文本 Event"""
-            event.Name += "anchored_text;"
+        event.Text = tag + box_tag
+        return event
 
-            return Text(event)
+    def Triangle(self, event: Event, each: Annotation, i: int) -> Event:
+        """生成 speech 样式的第二个框 Event"""
+        event.Layer = 0
 
-        def anchored_box(event: Event) -> Event:
-            """生成 anchored 样式的框 Event"""
-            event.Name += "anchored_box;"
+        tag = rf"{{\an7\pos({self.geometry.sx[i]},{self.geometry.sy[i]})"
+        if self.styles == None:
+            tag += self.BoxTag(each.bgColor, each.bgOpacity)
+        else:
+            event.Style = self.BoxStyle(each.bgColor, each.bgOpacity)
+            tag = rf"{{\pos({self.geometry.sx[i]},{self.geometry.sy[i]})}}"
+
+        # 开始只是按部就班的画一个气泡框
+        # 之后我想可以拆成一个普通的方框和一个三角形
+        # 这可以直接复用 Box, 气泡锚点定位也可以直接使用 /pos
+        # 绘图变得更简单, 一共三个点
+        # 三角形的点在 TransformGeometry 里整列算好了
+        x1 = self.geometry.x1[i]
+        y1 = self.geometry.y1[i]
+        x2 = self.geometry.x2[i]
+
+        # 一共三个点, 怎么画都是个三角形
+        if x1 and y1 and x2:
+            box_tag = CachedTriangleDrawing(x1, y1, x2)
+        else:
+            box_tag = TriangleDrawing(x1, y1, x2)
+
+        event.Text = tag + box_tag
+        return event
+
+
+# 每种样式依次生成哪些 Event: (加在 Name 后面的字, Emitter 的方法名)
+# Name 多加几个字, 便于调试
+# 新的样式加在这里, 需要新的画法就给 Emitter 加个方法
+STYLES: Dict[str, List[Tuple[str, str]]] = {
+    "popup": [("popup_text;", "Text"), ("popup_box;", "Box")],
+    "title": [(";title", "Title")],
+    # 我还没遇到过 highlightText, 所以实现很可能不对
+    "highlightText": [("highlightText_text;", "Text"), ("highlightText_box;", "Box")],
+    # 上次恶心到我的地方, 这次想到了另一种方法处理掉了
+    "speech": [
+        ("speech_text;", "Text"),
+        ("speech_box_1;", "Box"),
+        ("speech_box_2;", "Triangle"),
+    ],
+    # 我没见过 "anchored" 实现不对
+    "anchored": [("anchored_text;", "Text"), ("anchored_box;", "Box")],
+    "label": [("label_text;", "Text"), ("label_box;", "Box")],
+}
 
-            return Box(event)
 
-        def label_text(event: Event) -> Event:
-            event.Name += "label_text;"
-            return Text(event)
+def Convert(
+    annotations: Union[List[Annotation], AnnotationBatch],
+    libass: bool = False,
+    resolutionX: int = 100,
+    resolutionY: int = 100,
+    metrics: Optional[Dict[str, Any]] = None,
+    styles: Optional[Dict[str, Style]] = None,
+) -> List[Event]:
+    """转换 Annotations
+
+    给了 metrics 的话, 每种样式生成的 Event 数记在 "events", 不支持的样式记在 "skipped"
+    给了 styles 的话, 颜色, 透明度和字体大小放进生成的样式里, Event 只留下位置和绘图
+    """
+
+    if not isinstance(annotations, AnnotationBatch):
+        annotations = AnnotationBatch(annotations)
+    geometry = TransformGeometry(annotations, libass, resolutionX, resolutionY)
+    emitter = Emitter(geometry, libass, resolutionX, resolutionY, styles)
+    # 查一次表就知道要生成哪几个 Event, 不用一个一个比较样式
+    dispatch = {
+        style: [(suffix, getattr(emitter, method)) for suffix, method in parts]
+        for style, parts in STYLES.items()
+    }
+
+    # SSA 用 "\N" 换行
+    escape = {"\n": r"\N"}
+    if libass:
+        # 如果文本里包含大括号, 而且封闭, 会被识别为 "样式复写代码", 大括号内的文字不会显示
+        # 而且仅 libass 支持大括号转义, xy-vsfilter 没有那玩意
+        # 可以说, 本脚本(项目) 依赖于字幕滤镜(xy-vsfilter, libass)的怪癖
+        escape["{"] = r"\{"
+        escape["}"] = r"\}"
+    # 一次 translate 替换所有字符, 不用 replace 好几遍
+    table = str.maketrans(escape)
 
-        def label_box(event: Event) -> Event:
-            event.Name += "label_box;"
-            return Box(event)
+    events = []
+    for i, each in enumerate(annotations):
+        # 一个 Annotations 可能会需要多个 Event 来表达.
+        # each 这个习惯来源于 youtube-ass, 看起来比 i 要好一些
+        parts = dispatch.get(each.style)
+        if parts == None:
+            # 传承于 Annotations2Sub™
+            Stderr(_("不支持 {} 样式 ({})").format(each.style, each.id))
+            if metrics != None:
+                skipped = metrics.setdefault("skipped", {})  # type: ignore
+                skipped["unsupported_style"] = skipped.get("unsupported_style", 0) + 1
+            continue
 
-        events: List[Event] = []
         event = Event()
-
         # 我把 Annotation 抽成单独的结构就是为了这种效果
         # 直接赋值, 不用加上一大坨清洗代码
         event.Start = each.timeStart
         event.End = each.timeEnd
         # author;id;function;alternative
         # Name 在 Aegisub 里是 "说话人"
-        event.Name += each.author + ";"
-        event.Name += each.id + ";"
-
-        text = each.text
-        # SSA 用 "\N" 换行
-        text = text.replace("\n", r"\N")
-        if libass:
-            # 如果文本里包含大括号, 而且封闭, 会被识别为 "样式复写代码", 大括号内的文字不会显示
-            # 而且仅 libass 支持大括号转义, xy-vsfilter 没有那玩意
-            # 可以说, 本脚本(项目) 依赖于字幕滤镜(xy-vsfilter, libass)的怪癖
-            text = text.replace("{", r"\{")
-            text = text.replace("}", r"\}")
-        event.Text = text
-        del text
-
-        # 这里处理下数据供后面使用, 不需要处理都直接使用 each
-        # Annotation 的定位是"百分比"
-        # 恰好直接把"分辨率"设置为 100 就可以实现
-        # 但是这其实还是依赖于字幕滤镜的怪癖
-        transform_coefficient_x = resolutionX / 100
-        transform_coefficient_y = resolutionY / 100
-        # 浮点数太长了, 为了美观, 用 round 截断成三位, 字幕滤镜本身是支持小数的
-        x = round(each.x * transform_coefficient_x, 3)
-        y = round(each.y * transform_coefficient_y, 3)
-        textSize = round(each.textSize * transform_coefficient_y, 3)
-        width = round(each.width * transform_coefficient_x, 3)
-        height = round(each.height * transform_coefficient_y, 3)
-        sx = round(each.sx * transform_coefficient_x, 3)
-        sy = round(each.sy * transform_coefficient_y, 3)
-
-        if libass and resolutionX == 100 and resolutionY == 100:
-            # 针对 libass 的 hack
-            # 我也不知道 libass 咋回事
-            # 1.776 是试出来的
-            # 而且仅适用于 16:9 分辨率
-            # 不要指望我在 libass 开 issue
-            # 毕竟不知道还有多少脚本依赖于这个怪癖
-            width = round(width * 1.776, 3)
-            # sy 是中间变量, 不需要 round
-            sy = sy * 1.776
-
+        event.Name = each.author + ";" + each.id + ";"
+        event.Text = each.text.translate(table)
         # Layer 是"层", 他们说大的会覆盖小的
         # 但是没有这个也可以正常显示, 之前就没有, 现在也就是安心些
         event.Layer = 1
 
-        if each.style == "popup":
-            # 用浅拷贝拷贝一遍再处理看起来简单些, 我不在意性能
-            events.append(popup_text(copy.copy(event)))
-            events.append(popup_box(copy.copy(event)))
-        elif each.style == "title":
-            events.append(title(copy.copy(event)))
-        elif each.style == "highlightText":
-            # 我还没遇到过 highlightText, 所以实现很可能不对
-            events.append(highlightText_text(copy.copy(event)))
-            events.append(highlightText_box(copy.copy(event)))
-        elif each.style == "speech":
-            # 上次恶心到我的地方, 这次想到了另一种方法处理掉了
-            events.append(speech_text(copy.copy(event)))
-            events.append(speech_box_1(copy.copy(event)))
-            events.append(speech_box_2(copy.copy(event)))
-            # 我没见过 "anchored" 实现不对
-        elif each.style == "anchored":
-            events.append(anchored_text(copy.copy(event)))
-            events.append(anchored_box(copy.copy(event)))
-        elif each.style == "label":
-            events.append(label_text(copy.copy(event)))
-            events.append(label_box(copy.copy(event)))
-        else:
-            # 传承于 Annotations2Sub™
-            Stderr(_("不支持 {} 样式 ({})").format(each.style, each.id))
+        for suffix, emit in parts:  # type: ignore
+            # 用浅拷贝拷贝一遍再处理看起来简单些
+            part = copy.copy(event)
+            part.Name += suffix
+            events.append(emit(part, each, i))
 
-        return events
-
-    events = []
-    for each in annotations:
-        # 一个 Annotations 可能会需要多个 Event 来表达.
-        # each 这个习惯来源于 youtube-ass, 看起来比 i 要好一些
-        events.extend(ConvertAnnotation(each))
+        if metrics != None:
+            counts = metrics.setdefault("events", {})  # type: ignore
+            counts[each.style] = counts.get(each.style, 0) + len(parts)  # type: ignore
 
     return events
+
+
+def StringToSub(
+    string: Union[str, bytes],
+    libass: bool = False,
+    resolutionX: int = 100,
+    resolutionY: int = 100,
+    font: str = "Arial",
+    title: str = "Default File",
+    stats: Optional[Dict[str, float]] = None,
+    metrics: Optional[Dict[str, Any]] = None,
+    sharedStyles: bool = False,
+) -> Sub:
+    """将 Annotation 文件的内容转换为 Sub"""
+
+    # 这里是 __init__.py 开头那个流程图
+    # 只解析一次, 不碰文件, 读文件是调用者的事
+    # 不是 XML 会抛出 xml.etree.ElementTree.ParseError
+    # 不是 Annotation 文件会抛出 Annotation.NotAnnotationError
+    # 内容有误, 包括缺了 segment, t, x 之类的, 会抛出 ValueError
+    # 给了 stats 的话, 每一步的耗时记在里面
+    # 给了 metrics 的话, Parse 和 Convert 的计数记在里面
+    # sharedStyles 为 True 时, 重复的样式复写标签放进 [V4+ Styles], 字幕文件小很多
+    # 不建整棵 XML 树, 边解析 XML 边解析 Annotation, 两步的耗时都记在 parse 里
+    source = io.StringIO(string) if isinstance(string, str) else io.BytesIO(string)
+    counts: Dict[str, Any] = metrics if metrics != None else {}  # type: ignore
+    before = counts.get("annotations", 0)
+    with Timer(stats, "parse"):
+        annotations = AnnotationBatch(list(IterParse(source, counts)))
+    del source
+    if counts["annotations"] == before:
+        Warn(_("{} 没有 Annotation").format(title))
+    styles: Optional[Dict[str, Style]] = {} if sharedStyles else None
+    with Timer(stats, "convert"):
+        events = Convert(annotations, libass, resolutionX, resolutionY, metrics, styles)
+    if events == []:
+        Warn(_("{} 没有注释被转换").format(title))
+    # Annotation 是无序的
+    # 按时间重新排列字幕事件, 是为了人类可读
+    with Timer(stats, "sort"):
+        events.sort(key=lambda event: event.Start)
+
+    subtitle = Sub()
+    subtitle.events.extend(events)
+    subtitle.comment += _("此脚本使用 Annotations2Sub 生成") + "\n"
+    subtitle.comment += "https://github.com/USED255/Annotations2Sub"
+    subtitle.info["PlayResX"] = resolutionX  # type: ignore
+    subtitle.info["PlayResY"] = resolutionY  # type: ignore
+    subtitle.info["Title"] = title
+    if styles != None:
+        subtitle.styles.update(styles)  # type: ignore
+    for style in subtitle.styles.values():
+        style.Fontname = font
+    return subtitle
+
+
+def StringToAss(
+    string: Union[str, bytes],
+    libass: bool = False,
+    resolutionX: int = 100,
+    resolutionY: int = 100,
+    font: str = "Arial",
+    title: str = "Default File",
+    sharedStyles: bool = False,
+) -> str:
+    """将 Annotation 文件的内容转换为 ASS 字符串"""
+    return StringToSub(
+        string,
+        libass,
+        resolutionX,
+        resolutionY,
+        font,
+        title,
+        sharedStyles=sharedStyles,
+    ).Dump()
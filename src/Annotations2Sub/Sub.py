@@ -3,8 +3,9 @@
 
 """SSA 相关"""
 
-import datetime
-from typing import Dict, List
+import io
+import time
+from typing import IO, Dict, Iterator, List, Optional
 
 from Annotations2Sub.Color import Alpha, Color, Rgba
 from Annotations2Sub.utils import _
@@ -25,6 +26,31 @@ except ImportError:
 class Style:
     """SSA 样式(Style) 结构"""
 
+    __slots__ = (
+        "Fontname",
+        "Fontsize",
+        "PrimaryColour",
+        "SecondaryColour",
+        "OutlineColour",
+        "BackColour",
+        "Bold",
+        "Italic",
+        "Underline",
+        "StrikeOut",
+        "ScaleX",
+        "ScaleY",
+        "Spacing",
+        "Angle",
+        "BorderStyle",
+        "Outline",
+        "Shadow",
+        "Alignment",
+        "MarginL",
+        "MarginR",
+        "MarginV",
+        "Encoding",
+    )
+
     def __init__(self):
         # 带引号的是从 https://github.com/weizhenye/ASS/wiki/ASS-字幕格式规范 粘过来的
         # Name 不在这里面, 它会这样出现 Dict[Name:str, Style:Style]
@@ -66,6 +92,20 @@ class Style:
 class Event:
     """SSA 事件(Event) 结构"""
 
+    __slots__ = (
+        "Type",
+        "Layer",
+        "Start",
+        "End",
+        "Style",
+        "Name",
+        "MarginL",
+        "MarginR",
+        "MarginV",
+        "Effect",
+        "Text",
+    )
+
     def __init__(self):
         # 有 Dialogue, Comment, Picture, Sound, Movie, Command 事件
         # 但是只用到了 Dialogue
@@ -73,8 +113,9 @@ class Event:
         self.Type: Literal["Dialogue"] = "Dialogue"
         # Aegisub 没有 Marked, 所以我们也没有
         self.Layer: int = 0
-        self.Start: datetime.datetime = datetime.datetime.strptime("0", "%S")
-        self.End: datetime.datetime = datetime.datetime.strptime("0", "%S")
+        # 时间都是整数毫秒
+        self.Start: int = 0
+        self.End: int = 0
         self.Style: str = "Default"
         self.Name: str = ""
         # MarginL, MarginR, MarginV, Effect 在本项目中均没有使用
@@ -84,6 +125,14 @@ class Event:
         self.Effect: str = ""
         self.Text: str = ""
 
+    def __copy__(self) -> "Event":
+        # 有了 __slots__ 之后 copy.copy 要绕 copyreg 一大圈, 反而更慢
+        # Convert 里每个 Annotation 要浅拷贝好几次, 这里直接逐个字段复制
+        event = Event.__new__(Event)
+        for name in Event.__slots__:
+            setattr(event, name, getattr(self, name))
+        return event
+
 
 class Sub:
     """SSA 类"""
@@ -113,26 +162,28 @@ class Sub:
             # 必要的字段
             self.infos: Dict[str, str] = {"ScriptType": "v4.00+"}
 
-        def Dump(self) -> str:
-            """将 Info 结构转换为字符串"""
-
-            # 只是暴力拼接字符串而已
-            string = ""
-            string += "[Script Info]" + "\n"
+        def DumpLines(self) -> Iterator[str]:
+            """将 Info 结构逐行转换为字符串"""
+            yield "[Script Info]\n"
             if self.comment != "":
                 for line in self.comment.split("\n"):
-                    string += f"; {line}\n"
+                    yield f"; {line}\n"
             for k, v in self.infos.items():
-                string += f"{k}: {v}\n"
-            string += "\n"
-            return string
+                yield f"{k}: {v}\n"
+            yield "\n"
+
+        def Dump(self) -> str:
+            """将 Info 结构转换为字符串"""
+
+            # 之前是暴力拼接字符串, 现在交给 DumpLines
+            return "".join(self.DumpLines())
 
     # 这次和之前相比把一个类拆成了结构和一个 Dump 方法
     class Styles:
         def __init__(self):
             self.styles: Dict[str, Style] = {}
 
-        def Dump(self) -> str:
+        def DumpLines(self) -> Iterator[str]:
             def DumpAABBGGRR(rgba: Rgba) -> str:
                 """转换为 SSA 颜色字符串"""
 
@@ -142,86 +193,133 @@ class Sub:
                     rgba.alpha, rgba.blue, rgba.green, rgba.red
                 )
 
-            string = ""
-            string += "[V4+ Styles]" + "\n"
-            string += (
-                "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding"
-                + "\n"
-            )
+            yield "[V4+ Styles]\n"
+            yield "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n"
             for Name, Styles in self.styles.items():
-                string += "Style: "
-                string += Name + ","
-                string += Styles.Fontname + ","
-                string += str(Styles.Fontsize) + ","
-                string += DumpAABBGGRR(Styles.PrimaryColour) + ","
-                string += DumpAABBGGRR(Styles.SecondaryColour) + ","
-                string += DumpAABBGGRR(Styles.OutlineColour) + ","
-                string += DumpAABBGGRR(Styles.BackColour) + ","
-                string += str(Styles.Bold) + ","
-                string += str(Styles.Italic) + ","
-                string += str(Styles.Underline) + ","
-                string += str(Styles.StrikeOut) + ","
-                string += str(Styles.ScaleX) + ","
-                string += str(Styles.ScaleY) + ","
-                string += str(Styles.Spacing) + ","
-                string += str(Styles.Angle) + ","
-                string += str(Styles.BorderStyle) + ","
-                string += str(Styles.Outline) + ","
-                string += str(Styles.Shadow) + ","
-                string += str(Styles.Alignment) + ","
-                string += str(Styles.MarginL) + ","
-                string += str(Styles.MarginR) + ","
-                string += str(Styles.MarginV) + ","
-                string += str(Styles.Encoding) + "\n"
-            string += "\n"
-            return string
+                fields = (
+                    Name,
+                    Styles.Fontname,
+                    str(Styles.Fontsize),
+                    DumpAABBGGRR(Styles.PrimaryColour),
+                    DumpAABBGGRR(Styles.SecondaryColour),
+                    DumpAABBGGRR(Styles.OutlineColour),
+                    DumpAABBGGRR(Styles.BackColour),
+                    str(Styles.Bold),
+                    str(Styles.Italic),
+                    str(Styles.Underline),
+                    str(Styles.StrikeOut),
+                    str(Styles.ScaleX),
+                    str(Styles.ScaleY),
+                    str(Styles.Spacing),
+                    str(Styles.Angle),
+                    str(Styles.BorderStyle),
+                    str(Styles.Outline),
+                    str(Styles.Shadow),
+                    str(Styles.Alignment),
+                    str(Styles.MarginL),
+                    str(Styles.MarginR),
+                    str(Styles.MarginV),
+                    str(Styles.Encoding),
+                )
+                yield "Style: " + ",".join(fields) + "\n"
+            yield "\n"
+
+        def Dump(self) -> str:
+            return "".join(self.DumpLines())
 
     class Events:
         def __init__(self):
             self.events: List[Event] = []
 
-        def Dump(self) -> str:
-            def DumpTime(t: datetime.datetime) -> str:
+        def DumpLines(self) -> Iterator[str]:
+            def DumpTime(t: int) -> str:
                 """转换为 SSA 时间字符串"""
 
                 # "格式为 0:00:00:00（小时:分:秒:毫秒）"
-                return t.strftime("%H:%M:%S.%f")[:-4]
-
-            string = ""
-            string += "[Events]" + "\n"
-            string += (
-                "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"
-                + "\n"
-            )
+                # 其实最后一段是百分之一秒, 多余的直接截断, 和之前用 strftime 时一致
+                seconds, milliseconds = divmod(t, 1000)
+                minutes, seconds = divmod(seconds, 60)
+                hours, minutes = divmod(minutes, 60)
+                return (
+                    f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds // 10:02d}"
+                )
+
+            yield "[Events]\n"
+            yield "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
             for Event in self.events:
-                string += "Dialogue: "
-                string += str(Event.Layer) + ","
-                string += DumpTime(Event.Start) + ","
-                string += DumpTime(Event.End) + ","
-                string += Event.Style + ","
-                string += Event.Name + ","
-                string += str(Event.MarginL) + ","
-                string += str(Event.MarginR) + ","
-                string += str(Event.MarginV) + ","
-                string += Event.Effect + ","
-                string += Event.Text + "\n"
-            string += "\n"
-            return string
+                fields = (
+                    str(Event.Layer),
+                    DumpTime(Event.Start),
+                    DumpTime(Event.End),
+                    Event.Style,
+                    Event.Name,
+                    str(Event.MarginL),
+                    str(Event.MarginR),
+                    str(Event.MarginV),
+                    Event.Effect,
+                    Event.Text,
+                )
+                yield "Dialogue: " + ",".join(fields) + "\n"
+            yield "\n"
 
-    def Dump(self) -> str:
-        """转储为 SSA"""
+        def Dump(self) -> str:
+            return "".join(self.DumpLines())
+
+    def DumpLines(self) -> Iterator[str]:
+        """逐行转储为 SSA"""
         self._info.comment = self.comment
 
-        string = ""
-        string += self._info.Dump()
-        string += self._styles.Dump()
-        string += self._events.Dump()
-        return string
+        yield from self._info.DumpLines()
+        yield from self._styles.DumpLines()
+        yield from self._events.DumpLines()
+
+    def Dump(self) -> str:
+        """转储为 SSA"""
+        return "".join(self.DumpLines())
+
+    def DumpTo(
+        self,
+        file: IO,
+        chunkSize: int = 65536,
+        stats: Optional[Dict[str, float]] = None,
+    ):
+        """转储为 SSA 并写入文件"""
+
+        # 事件多了整个字符串就很大, 攒够 chunkSize 个字符就写一次
+        # file 可以是文本文件, 也可以是二进制文件, 二进制文件用 UTF-8 编码
+        # 给了 stats 的话, 生成和写入的耗时分别记在 "dump" 和 "write" 里
+        binary = isinstance(file, (io.RawIOBase, io.BufferedIOBase)) or (
+            "b" in getattr(file, "mode", "")
+        )
+        start = time.perf_counter()
+        writing = 0.0
+        buffer: List[str] = []
+        size = 0
+        for line in self.DumpLines():
+            buffer.append(line)
+            size += len(line)
+            if size >= chunkSize:
+                chunk = "".join(buffer)
+                write_start = time.perf_counter()
+                file.write(chunk.encode("utf-8") if binary else chunk)
+                writing += time.perf_counter() - write_start
+                buffer = []
+                size = 0
+        chunk = "".join(buffer)
+        write_start = time.perf_counter()
+        file.write(chunk.encode("utf-8") if binary else chunk)
+        writing += time.perf_counter() - write_start
+        if stats != None:
+            total = time.perf_counter() - start
+            stats["dump"] = stats.get("dump", 0.0) + total - writing  # type: ignore
+            stats["write"] = stats.get("write", 0.0) + writing  # type: ignore
 
 
 class DrawCommand:
     """绘图指令结构"""
 
+    __slots__ = ("x", "y", "command")
+
     def __init__(self, x: float = 0, y: float = 0, command: Literal["m", "l"] = "m"):
         self.x: float = x
         self.y: float = y
@@ -248,7 +346,4 @@ class Draw:
         # "所有绘图都应由 m <x> <y> 命令开头"
         # "所有没闭合的图形会被自动地在起点和终点之间添加直线来闭合。"
         # "如果一个对话行中的多个图形有重叠，重叠部分会进行异或运算。"
-        string = ""
-        for draw in self.draws:
-            string = string + f"{draw.command} {draw.x} {draw.y} "
-        return string
+        return "".join(f"{draw.command} {draw.x} {draw.y} " for draw in self.draws)
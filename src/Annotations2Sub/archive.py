@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Internet Archive 的注释存档"""
+
+import mmap
+import os
+import re
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from Annotations2Sub.utils import Err, _
+
+# https://archive.org/details/youtubeannotations
+# 存档按视频 ID 第一个字符分成 youtubeannotations_00 ~ youtubeannotations_64
+# 每个里面再按前两个字符分成 {id[0:2]}.tar
+# tar 里的文件是 {id[0:3]}/{id}.xml
+CHARS_SAFE = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+
+def ArchiveLocation(videoId: str) -> Tuple[str, str, str]:
+    """返回注释在存档里的位置 (item, tar, 文件)"""
+
+    # 移植自 https://github.com/omarroth/invidious/blob/ea0d52c0b85c0207c1766e1dc5d1bd0778485cad/src/invidious.cr#L2835
+    if re.match(r"[a-zA-Z0-9_-]{11}", videoId) is None:
+        raise ValueError("Invalid videoId")
+
+    index = CHARS_SAFE.index(videoId[0]).__str__().rjust(2, "0")
+
+    # IA doesn't handle leading hyphens,
+    # so we use https://archive.org/details/youtubeannotations_64
+    if index == "62":
+        index = "64"
+        videoId.replace("^-", "A")
+
+    return (
+        f"youtubeannotations_{index}",
+        f"{videoId[0:2]}.tar",
+        f"{videoId[0:3]}/{videoId}.xml",
+    )
+
+
+def ParseNumber(field: bytes) -> int:
+    """解析 tar 头里的数字"""
+
+    # 一般是八进制字符串, GNU tar 遇到放不下的大数会用 base-256
+    if len(field) > 0 and field[0] & 0x80:
+        return int.from_bytes(bytes([field[0] & 0x7F]) + field[1:], "big")
+    field = field.split(b"\0", 1)[0].strip()
+    if field == b"":
+        return 0
+    return int(field, 8)
+
+
+def TarMembers(buffer) -> Iterator[Tuple[str, int, int]]:
+    """遍历 tar, 返回每个文件的 (文件名, 数据偏移, 大小)
+
+    tar 损坏时抛出 ValueError
+    """
+
+    # tarfile 会为每个成员建一个 TarInfo, 还要一路 seek 读文件
+    # 这里直接在 mmap 上看 512 字节的头, 只拿需要的东西
+    position = 0
+    long_name: Optional[bytes] = None
+    while position + 512 <= len(buffer):
+        header = buffer[position : position + 512]
+        if header.count(0) == 512:
+            break
+        size = ParseNumber(header[124:136])
+        type_flag = header[156:157]
+        data = position + 512
+        # 截断的 tar, 读出来的会是半个文件
+        if data + size > len(buffer):
+            raise ValueError("truncated tar member")
+        position = data + (size + 511) // 512 * 512
+
+        if type_flag == b"L":
+            # GNU 长文件名, 下一个头的文件名在这里
+            long_name = buffer[data : data + size].split(b"\0", 1)[0]
+            continue
+        if type_flag == b"x":
+            # pax 扩展头, 格式是 "长度 key=value\n"
+            for record in buffer[data : data + size].split(b"\n"):
+                __, __, record = record.partition(b" ")
+                key, __, value = record.partition(b"=")
+                if key == b"path":
+                    long_name = value
+            continue
+        if type_flag not in (b"0", b"\0", b"7"):
+            long_name = None
+            continue
+
+        name = header[0:100].split(b"\0", 1)[0]
+        if header[257:263] == b"ustar\0":
+            prefix = header[345:500].split(b"\0", 1)[0]
+            if prefix != b"":
+                name = prefix + b"/" + name
+        if long_name != None:
+            name = long_name  # type: ignore
+            long_name = None
+        yield name.decode("utf-8", "replace"), data, size
+
+
+def TarPath(archiveDirectory: str, videoId: str) -> Optional[str]:
+    """返回视频 ID 所在的本地 tar 文件"""
+    item, tar, __ = ArchiveLocation(videoId)
+    # 可以按存档的目录结构放, 也可以把 tar 直接放在一个目录里
+    for path in (
+        os.path.join(archiveDirectory, item, tar),
+        os.path.join(archiveDirectory, tar),
+    ):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def ReadTarMember(path: str, member: str) -> Optional[bytes]:
+    """不解压, 通过 mmap 读取 tar 里的一个文件"""
+    if os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for name, offset, size in TarMembers(buffer):
+                if name == member or name.endswith("/" + member):
+                    return buffer[offset : offset + size]
+    return None
+
+
+def BuildIndex(archiveDirectory: str, database: str) -> int:
+    """为本地存档里的所有注释文件建立索引, 返回文件数"""
+
+    # 在几 GB 的 tar 里找一个文件要从头扫到尾
+    # 事先把每个文件在哪个 tar, 偏移多少, 多大记下来, 之后一次 seek 就够了
+    # tar 的路径相对于存档目录, 存档挪个地方索引还能用
+    import sqlite3
+
+    connection = sqlite3.connect(database)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS members ("
+        "videoId TEXT PRIMARY KEY, tar TEXT, offset INTEGER, size INTEGER, checksum INTEGER)"
+    )
+    count = 0
+    for root, directories, files in os.walk(archiveDirectory):
+        directories.sort()
+        for file in sorted(files):
+            if not file.endswith(".tar"):
+                continue
+            path = os.path.join(root, file)
+            if os.path.getsize(path) == 0:
+                continue
+            tar = os.path.relpath(path, archiveDirectory)
+            rows: List[Tuple[str, str, int, int, int]] = []
+            try:
+                with open(path, "rb") as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                        for name, offset, size in TarMembers(buffer):
+                            if not name.endswith(".xml"):
+                                continue
+                            videoId = name.rsplit("/", 1)[-1][:-4]
+                            checksum = zlib.crc32(buffer[offset : offset + size])
+                            rows.append((videoId, tar, offset, size, checksum))
+            except (ValueError, OSError):
+                # 坏掉的 tar 不进索引, 读的时候会再报错
+                Err(_("无法读取 {}").format(path))
+                continue
+            connection.executemany(
+                "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)", rows
+            )
+            connection.commit()
+            count += len(rows)
+    connection.close()
+    return count
+
+
+def OpenIndex(database: str) -> Any:
+    """只读打开索引, 不存在时报错而不是建一个空的"""
+    import sqlite3
+
+    # sqlite 的 URI 里 ? 和 # 有特殊含义
+    path = database.replace("%", "%25").replace("?", "%3f").replace("#", "%23")
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def ReadIndexed(
+    archiveDirectory: str, database: str, videoId: str
+) -> Tuple[bool, Optional[bytes]]:
+    """通过索引读取注释, 返回 (索引里有没有, 内容)
+
+    索引打不开或者没建好时抛出 sqlite3.Error
+    """
+    connection = OpenIndex(database)
+    try:
+        row = connection.execute(
+            "SELECT tar, offset, size, checksum FROM members WHERE videoId = ?",
+            (videoId,),
+        ).fetchone()
+    finally:
+        connection.close()
+    if row == None:
+        return False, None
+
+    tar, offset, size, checksum = row
+    try:
+        with open(os.path.join(archiveDirectory, tar), "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+    except OSError:
+        return True, None
+    # tar 被换过的话索引就不对了
+    if len(data) != size or zlib.crc32(data) != checksum:
+        return True, None
+    return True, data
+
+
+def IndexLookup(
+    database: str, videoIds: Iterable[str]
+) -> Dict[str, Tuple[str, int, int, int]]:
+    """从索引里查出一批视频 ID 的 (tar, 偏移, 大小, 校验)"""
+    import sqlite3
+
+    result: Dict[str, Tuple[str, int, int, int]] = {}
+    try:
+        connection = OpenIndex(database)
+        try:
+            for videoId in videoIds:
+                row = connection.execute(
+                    "SELECT tar, offset, size, checksum FROM members WHERE videoId = ?",
+                    (videoId,),
+                ).fetchone()
+                if row != None:
+                    result[videoId] = row
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        # 当作没有索引, 交给后面逐个下载
+        Err(_("无法读取索引 {}").format(database))
+        return {}
+    return result
+
+
+def CoalesceRanges(
+    members: Iterable[Tuple[str, int, int]],
+    gap: int = 64 * 1024,
+    limit: int = 16 * 1024 * 1024,
+) -> List[Tuple[int, int, List[Tuple[str, int, int]]]]:
+    """把 (视频 ID, 偏移, 大小) 合并成尽量少的区间 (开始, 结束, 区间里的文件)"""
+
+    # 挨得近的文件一次 Range 请求拿回来, 中间多下的一点比多一次往返划算
+    # 单个区间也不能太大, 免得为了两个文件下半个 tar
+    ranges: List[Tuple[int, int, List[Tuple[str, int, int]]]] = []
+    for member in sorted(members, key=lambda member: member[1]):
+        start = member[1]
+        end = start + member[2]
+        if len(ranges) > 0:
+            last_start, last_end, last_members = ranges[-1]
+            if start - last_end <= gap and max(end, last_end) - last_start <= limit:
+                last_members.append(member)
+                ranges[-1] = (last_start, max(end, last_end), last_members)
+                continue
+        ranges.append((start, end, [member]))
+    return ranges
+
+
+def AnnotationsFromLocalArchive(
+    archiveDirectory: str, videoId: str, index: Optional[str] = None
+) -> Optional[bytes]:
+    """从本地的存档读取注释, 找不到返回 None"""
+    if index != None:
+        import sqlite3
+
+        try:
+            indexed, data = ReadIndexed(archiveDirectory, index, videoId)  # type: ignore
+        except sqlite3.Error:
+            # 当作没有索引
+            Err(_("无法读取索引 {}").format(index))
+            indexed, data = True, None
+        # 索引里没有就是没有, 不必再去扫 tar
+        if not indexed or data != None:
+            return data
+        # 索引过时了, 退回去扫 tar
+
+    path = TarPath(archiveDirectory, videoId)
+    if path == None:
+        return None
+    __, __, member = ArchiveLocation(videoId)
+    try:
+        return ReadTarMember(path, member)  # type: ignore
+    except (ValueError, OSError):
+        # 只算这一个视频 ID 失败
+        Err(_("无法读取 {}").format(path))
+        return None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""下载缓存"""
+
+import hashlib
+import os
+import threading
+from typing import List, Optional, Tuple
+
+
+class Cache:
+    """按视频 ID 存放下载过的注释文件"""
+
+    # 同一个视频换个 -x -y -l 再转一遍, 没必要再去 Internet Archive 下一遍
+    # 每个文件旁边放一个 .sha256, 读的时候对不上就当没有
+    # 用文件的修改时间记录最近一次使用, 超过大小上限就从最久没用的删起
+
+    def __init__(self, directory: str, maxSize: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        # 第一次写入时才扫描目录
+        self.size: Optional[int] = None
+
+    def Path(self, videoId: str) -> str:
+        """返回缓存文件的路径"""
+
+        # 视频 ID 区分大小写, 而 Windows 和 macOS 的文件名不区分
+        # 所以文件名用视频 ID 的十六进制
+        name = videoId.encode("utf-8").hex()
+        return os.path.join(self.directory, name[0:2], name + ".xml")
+
+    def Get(self, videoId: str) -> Optional[bytes]:
+        """读取缓存, 没有或者损坏返回 None"""
+        path = self.Path(videoId)
+        data, corrupted = self.Read(path)
+        if corrupted:
+            with self.lock:
+                # 等锁的时候 Put 可能刚换上了新的, 拿到锁再看一遍, 还是坏的才删
+                data, corrupted = self.Read(path)
+                if corrupted:
+                    removed = self.Remove(path)
+                    if self.size != None:
+                        self.size -= removed  # type: ignore
+        if data == None:
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def Read(self, path: str) -> Tuple[Optional[bytes], bool]:
+        """读取缓存文件并校验, 返回 (内容, 是否损坏)"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path + ".sha256", "r", encoding="utf-8") as f:
+                checksum = f.read().strip()
+        except OSError:
+            return None, False
+        if hashlib.sha256(data).hexdigest() != checksum:
+            return None, True
+        return data, False
+
+    def Put(self, videoId: str, data: bytes):
+        """写入缓存"""
+        if len(data) > self.maxSize:
+            return
+        path = self.Path(videoId)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 先写到临时文件再替换, 免得别的进程读到写了一半的文件
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary + ".sha256", "w", encoding="utf-8") as f:
+            f.write(hashlib.sha256(data).hexdigest())
+        with open(temporary, "wb") as f:
+            f.write(data)
+
+        with self.lock:
+            if self.size == None:
+                self.size = sum(entry[2] for entry in self.Entries())
+            self.size -= self.Remove(path)
+            # 先换数据再换 .sha256, 中途读到的新数据和旧校验对不上, 只会当作没有
+            os.replace(temporary, path)
+            os.replace(temporary + ".sha256", path + ".sha256")
+            self.size += len(data)
+            if self.size > self.maxSize:
+                self.Evict()
+
+    def Entries(self) -> List[Tuple[float, str, int]]:
+        """返回所有缓存文件的 (修改时间, 路径, 大小)"""
+        entries: List[Tuple[float, str, int]] = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith(".xml"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def Evict(self):
+        """删除最久没用的缓存, 直到不超过大小上限"""
+        entries = self.Entries()
+        entries.sort()
+        size = sum(entry[2] for entry in entries)
+        for entry in entries:
+            if size <= self.maxSize:
+                break
+            size -= self.Remove(entry[1])
+        self.size = size
+
+    def Remove(self, path: str) -> int:
+        """删除一个缓存文件, 返回删掉的大小"""
+        size = 0
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+        try:
+            os.remove(path + ".sha256")
+        except OSError:
+            pass
+        return size
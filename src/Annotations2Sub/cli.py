@@ -2,111 +2,542 @@
 # -*- coding: utf-8 -*-
 
 
-import _thread
+# 这个模块每次运行都要导入, 只有用到才需要的模块(网络, JSON, XML, 进程池...)都在用到的地方再导入
+# 转换一个小文件时, 启动的时间比转换还长
 import argparse
-import json
+import contextlib
+import io
+import itertools
 import os
 import re
 import sys
 import traceback
-import urllib.request
-from urllib.error import URLError
-from xml.etree.ElementTree import ParseError
-
-# 我觉得在输入确定的环境下用不着这玩意
-# 不过打包到了 PyPI 也不用像以前那样忌惮第三方库了
-# 不用白不用
-import defusedxml.ElementTree  # type: ignore
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from Annotations2Sub import version
-from Annotations2Sub.Annotation import Parse
-from Annotations2Sub.Convert import Convert
-from Annotations2Sub.Sub import Sub
+from Annotations2Sub.archive import (
+    AnnotationsFromLocalArchive,
+    ArchiveLocation,
+    BuildIndex,
+    CoalesceRanges,
+    IndexLookup,
+)
 from Annotations2Sub.utils import (
     Flags,
     MakeSureStr,
     Stderr,
+    Timer,
     YellowText,
     _,
+    GetBytes,
     GetUrl,
     Err,
     Warn,
 )
 
+if TYPE_CHECKING:
+    from Annotations2Sub.cache import Cache
+    from Annotations2Sub.invidious import Instances
+
 
 def Dummy(*args, **kwargs):
     """用于 MonkeyPatch"""
     pass
 
 
-def run(argv=None):
-    """跑起来🐎🐎🐎"""
+def CheckUrl(url: str = "https://google.com/", timeout: float = 3.0) -> bool:
+    import urllib.request
+    from urllib.error import URLError
+
+    try:
+        urllib.request.urlopen(url=url, timeout=timeout)
+    except URLError:
+        return False
+    return True
+
+
+def MediaFromInvidious(
+    videoId: str, instanceDomain: str = "", instances: Optional["Instances"] = None
+) -> tuple:
+    """返回视频流和音频流网址"""
+    import json
+
+    from Annotations2Sub.invidious import GetInstances, Probe
+
+    if instances == None:
+        instances = GetInstances()
+    if instanceDomain != "":
+        domains = [instanceDomain]
+    if instanceDomain == "":
+        domains = instances.Rank(instances.Domains(GetUrl))  # type: ignore
+
+    def Request(domain: str) -> Tuple[str, str]:
+        url = f"https://{domain}/api/v1/videos/{videoId}"
+        Stderr(_("获取 {}").format(url))
+        data = json.loads(GetUrl(url))
+        videos = []
+        audios = []
+        for i in data.get("adaptiveFormats"):
+            if re.match("video", i.get("type")) != None:
+                videos.append(i)
+            if re.match("audio", i.get("type")) != None:
+                audios.append(i)
+        videos.sort(key=lambda x: int(x.get("bitrate")), reverse=True)
+        audios.sort(key=lambda x: int(x.get("bitrate")), reverse=True)
+        video = MakeSureStr(videos[0]["url"])
+        audio = MakeSureStr(audios[0]["url"])
+        return video, audio
+
+    __, media = Probe(domains, Request, instances)
+    return media
+
+
+ARCHIVE_URL = "https://archive.org"
 
-    def CheckUrl(url: str = "https://google.com/", timeout: float = 3.0) -> bool:
+
+def AnnotationsFromArchive(videoId: str) -> str:
+    # 移植自 https://github.com/omarroth/invidious/blob/ea0d52c0b85c0207c1766e1dc5d1bd0778485cad/src/invidious.cr#L2835
+    # 向 https://archive.org/details/youtubeannotations 致敬
+    # 如果你对你的数据在意, 就不要把它们托付给他人
+    # Rain Shimotsuki 不仅是个打歌词的, 他更是一位创作者
+    # 自己作品消失, 我相信没人愿意看到
+    """返回注释在互联网档案馆的网址"""
+    file = ArchiveLocation(videoId)[2]
+
+    return f"{ArchiveTarUrl(videoId)}/{file}"
+
+
+def ArchiveTarUrl(videoId: str) -> str:
+    """返回注释所在的 tar 在互联网档案馆的网址"""
+    item, tar, __ = ArchiveLocation(videoId)
+    return f"{ARCHIVE_URL}/download/{item}/{tar}"
+
+
+def ArchiveTask(Task: str, args: argparse.Namespace) -> Tuple[str, str]:
+    """返回队列里的一项对应的视频 ID 和注释文件路径"""
+    video_id = MakeSureStr(Task)
+    if video_id.startswith("\\"):
+        video_id = video_id.replace("\\", "", 1)
+
+    annotation_file = f"{video_id}.xml"
+    if args.download_annotation_only and args.output:
+        annotation_file = args.output
+    if args.output_directory != None:
+        annotation_file = os.path.join(args.output_directory, annotation_file)
+    return video_id, annotation_file
+
+
+def ShardQueue(
+    queue: List[str], args: argparse.Namespace, jobs: int = 1
+) -> List[List[int]]:
+    """按存档的 tar 分片给队列分组, 返回每组在队列里的下标"""
+
+    # 同一个 tar 里的文件交给同一个线程, 一条连接挨个下, 有索引的话还能合并成 Range 请求
+    # 分片比线程少的时候把大的分片对半拆开, 别让线程闲着
+    shards: Dict[Tuple[str, str], List[int]] = {}
+    for i, Task in enumerate(queue):
+        video_id, __ = ArchiveTask(Task, args)
         try:
-            urllib.request.urlopen(url=url, timeout=timeout)
+            item, tar, __ = ArchiveLocation(video_id)
+        except ValueError:
+            item, tar = "", ""
+        shards.setdefault((item, tar), []).append(i)
+
+    groups = list(shards.values())
+    while len(groups) < jobs:
+        groups.sort(key=len)
+        if len(groups[-1]) <= 1:
+            break
+        largest = groups.pop()
+        half = len(largest) // 2
+        groups += [largest[:half], largest[half:]]
+    return groups
+
+
+def FetchShard(videoIds: List[str], index: str) -> Dict[str, bytes]:
+    """用 Range 请求从同一个 tar 里取回多个注释文件"""
+    import zlib
+    from urllib.error import URLError
+
+    located = IndexLookup(index, videoIds)
+    if len(located) == 0:
+        return {}
+    tar = ArchiveLocation(videoIds[0])[1]
+    url = ArchiveTarUrl(videoIds[0])
+
+    members = []
+    for video_id, (path, offset, size, __) in located.items():
+        # 索引里的 tar 要和存档里的对得上
+        if os.path.basename(path) == tar:
+            members.append((video_id, offset, size))
+
+    result: Dict[str, bytes] = {}
+    for start, end, group in CoalesceRanges(members):
+        Stderr(_("下载 {} ({} 个文件)").format(url, len(group)))
+
+        # 服务器不支持 Range 的话会返回整个 tar, 在 archive.org 上有好几 GB
+        # 只接受正好是这一段的 206, 别的不读响应体
+        def Accept(status: int, headers: Any) -> bool:
+            content_range = headers.get("Content-Range") or ""
+            return status == 206 and content_range.startswith(
+                f"bytes {start}-{end - 1}/"
+            )
+
+        try:
+            data = GetBytes(url, {"Range": f"bytes={start}-{end - 1}"}, accept=Accept)
         except URLError:
-            return False
-        return True
-
-    def MediaFromInvidious(videoId: str, instanceDomain: str = "") -> tuple:
-        """返回视频流和音频流网址"""
-        instances = []
-        if instanceDomain != "":
-            instances.append([instanceDomain])
-        if instanceDomain == "":
-            instances = json.loads(GetUrl("https://api.invidious.io/instances.json"))
-        for instance in instances:
+            # 取不到的交给后面逐个下载
+            if Flags.verbose:
+                Stderr(traceback.format_exc())
+            continue
+        for video_id, offset, size in group:
+            chunk = data[offset - start : offset - start + size]
+            if len(chunk) == size and zlib.crc32(chunk) == located[video_id][3]:
+                result[video_id] = chunk
+    return result
+
+
+def DownloadShard(
+    Tasks: List[str], args: argparse.Namespace, cache: Optional["Cache"] = None
+) -> List[Optional[int]]:
+    """下载同一个 tar 分片里的一组任务"""
+    prefetched: Optional[Dict[str, bytes]] = None
+    # 有索引但没有本地存档时, 知道偏移就可以直接向 tar 要一段
+    if args.archive_index != None and args.archive_dir == None:
+        video_ids = []
+        for Task in Tasks:
+            video_id, annotation_file = ArchiveTask(Task, args)
+            if re.match(r"[a-zA-Z0-9_-]{11}", video_id) is None:
+                continue
+            if args.no_overwrite_files and os.path.exists(annotation_file):
+                continue
+            if cache != None and os.path.exists(cache.Path(video_id)):  # type: ignore
+                continue
+            video_ids.append(video_id)
+        if len(video_ids) > 0:
             try:
-                if not instance[1]["api"]:  # type: ignore
-                    continue
-            except IndexError:
-                pass
-            domain = instance[0]
-            url = f"https://{domain}/api/v1/videos/{videoId}"
-            Stderr(_("获取 {}").format(url))
+                prefetched = FetchShard(video_ids, args.archive_index)
+            except Exception:
+                # 合并下载失败的话逐个下载
+                Err(_("下载 {} 时出错").format(", ".join(video_ids)))
+                Stderr(traceback.format_exc())
+    return [DownloadTaskSafely(Task, args, cache, prefetched) for Task in Tasks]
+
+
+def DownloadTask(
+    Task: str,
+    args: argparse.Namespace,
+    cache: Optional["Cache"] = None,
+    prefetched: Optional[Dict[str, bytes]] = None,
+) -> Optional[int]:
+    """下载队列里的一项, 返回退出码, 还需要转换的返回 None"""
+    from urllib.error import URLError
+
+    video_id, annotation_file = ArchiveTask(Task, args)
+    if re.match(r"[a-zA-Z0-9_-]{11}", video_id) is None:
+        Err(_("{} 不是一个有效的视频 ID").format(video_id))
+        return 1
+
+    is_skip_download = False
+    if args.no_overwrite_files and os.path.exists(annotation_file):
+        Stderr(YellowText(_("文件已存在, 跳过下载 ({})").format(video_id)))
+        is_skip_download = True
+    if not is_skip_download:
+        url = AnnotationsFromArchive(video_id)
+        # 先看看本地存档和缓存里有没有
+        data = None
+        if args.archive_dir != None:
+            data = AnnotationsFromLocalArchive(
+                args.archive_dir, video_id, args.archive_index
+            )
+            if data == None:
+                Err(_("本地存档中没有 {}").format(video_id))
+                return 1
+            Stderr(_("从本地存档读取 ({})").format(video_id))
+            string = data.decode("utf-8")  # type: ignore
+        elif cache != None:
+            data = cache.Get(video_id)  # type: ignore
+            if data != None:
+                Stderr(_("使用缓存 ({})").format(video_id))
+                string = data.decode("utf-8")  # type: ignore
+        if data == None and prefetched != None and video_id in prefetched:  # type: ignore
+            data = prefetched[video_id]  # type: ignore
+            string = data.decode("utf-8")  # type: ignore
+            if cache != None:
+                cache.Put(video_id, data)  # type: ignore
+        if data == None:
+            Stderr(_("下载 {}").format(url))
             try:
-                data = json.loads(GetUrl(url))
-            except (json.JSONDecodeError, URLError):
-                continue
-            videos = []
-            audios = []
-            for i in data.get("adaptiveFormats"):
-                if re.match("video", i.get("type")) != None:
-                    videos.append(i)
-                if re.match("audio", i.get("type")) != None:
-                    audios.append(i)
-            videos.sort(key=lambda x: int(x.get("bitrate")), reverse=True)
-            audios.sort(key=lambda x: int(x.get("bitrate")), reverse=True)
-            video = MakeSureStr(videos[0]["url"])
-            audio = MakeSureStr(audios[0]["url"])
-            return video, audio
-        raise Exception
-
-    def AnnotationsFromArchive(videoId: str) -> str:
-        # 移植自 https://github.com/omarroth/invidious/blob/ea0d52c0b85c0207c1766e1dc5d1bd0778485cad/src/invidious.cr#L2835
-        # 向 https://archive.org/details/youtubeannotations 致敬
-        # 如果你对你的数据在意, 就不要把它们托付给他人
-        # Rain Shimotsuki 不仅是个打歌词的, 他更是一位创作者
-        # 自己作品消失, 我相信没人愿意看到
-        """返回注释在互联网档案馆的网址"""
-        ARCHIVE_URL = "https://archive.org"
-        CHARS_SAFE = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-
-        if re.match(r"[a-zA-Z0-9_-]{11}", videoId) is None:
-            raise ValueError("Invalid videoId")
-
-        index = CHARS_SAFE.index(videoId[0]).__str__().rjust(2, "0")
-
-        # IA doesn't handle leading hyphens,
-        # so we use https://archive.org/details/youtubeannotations_64
-        if index == "62":
-            index = "64"
-            videoId.replace("^-", "A")
-
-        file = f"{videoId[0:3]}/{videoId}.xml"
-
-        return f"{ARCHIVE_URL}/download/youtubeannotations_{index}/{videoId[0:2]}.tar/{file}"
+                string = GetUrl(url)
+            except URLError:
+                Err(_("下载 {} 失败").format(url))
+                if Flags.verbose:
+                    Stderr(traceback.format_exc())
+                return 1
+            if cache != None:
+                cache.Put(video_id, string.encode("utf-8"))  # type: ignore
+        if args.output_to_stdout:
+            print(string, file=sys.stdout)
+            return 0
+        with open(annotation_file, "w", encoding="utf-8") as f:
+            f.write(string)
+
+    if args.download_annotation_only:
+        return 0
+    return None
+
+
+def DownloadTaskSafely(
+    Task: str,
+    args: argparse.Namespace,
+    cache: Optional["Cache"] = None,
+    prefetched: Optional[Dict[str, bytes]] = None,
+) -> Optional[int]:
+    """下载队列里的一项, 出了意外也只算这一项失败"""
+    try:
+        return DownloadTask(Task, args, cache, prefetched)
+    except Exception:
+        # 和 ProcessTaskSafely 一样, 一个出错不应该把整批下载带走
+        Err(_("下载 {} 时出错").format(Task))
+        Stderr(traceback.format_exc())
+        return 1
+
+
+def AnnotationFile(Task: str, args: argparse.Namespace) -> str:
+    """返回队列里的一项对应的注释文件"""
+    if args.download_for_archive:
+        return ArchiveTask(Task, args)[1]
+    return Task
+
+
+def SubtitleFile(annotation_file: str, args: argparse.Namespace) -> str:
+    """返回注释文件转换后的保存路径"""
+    if args.output != None:
+        return args.output
+    subtitle_file = annotation_file + ".ass"
+    if args.output_directory != None:
+        file_name = os.path.basename(annotation_file)
+        file_name = file_name + ".ass"
+        subtitle_file = os.path.join(args.output_directory, file_name)
+    return subtitle_file
+
+
+def ProcessTask(
+    Task: str,
+    args: argparse.Namespace,
+    stats: Optional[Dict[str, float]] = None,
+    metrics: Optional[Dict[str, Any]] = None,
+) -> int:
+    """处理队列里的一项, 返回退出码
+
+    给了 stats 的话每一步的耗时记在里面, 给了 metrics 的话各种计数记在里面
+    """
+    from xml.etree.ElementTree import ParseError
+
+    from Annotations2Sub.Annotation import NotAnnotationError
+    from Annotations2Sub.Convert import StringToSub
+
+    enable_embrace_libass = args.embrace_libass
+    transform_resolution_x = args.transform_resolution_x
+    transform_resolution_y = args.transform_resolution_y
+    font = args.font
+    enable_download_for_archive = args.download_for_archive
+    enable_preview_video = args.preview_video
+    enable_generate_video = args.generate_video
+    invidious_instances = args.invidious_instances
+    enable_no_overwrite_files = args.no_overwrite_files
+    enable_no_keep_intermediate_files = args.no_keep_intermediate_files
+    output_to_stdout = args.output_to_stdout
+
+    video_id = MakeSureStr(Task)
+    annotation_file = AnnotationFile(Task, args)
+
+    # 下载已经在 DownloadTask 里做完了
+    if enable_download_for_archive:
+        video_id, __ = ArchiveTask(Task, args)
+
+    if os.path.isfile(annotation_file) is False:
+        Err(_("{} 不是一个文件").format(annotation_file))
+        return 1
+
+    with Timer(stats, "read"):
+        with open(annotation_file, "rb") as fb:
+            annotations_string = fb.read()
+
+    if metrics != None:
+        metrics["bytes_in"] = len(annotations_string)  # type: ignore
+
+    if annotations_string == b"":
+        Warn(_("{} 可能没有 Annotation").format(video_id))
+        return 1
+
+    subtitle_file = SubtitleFile(annotation_file, args)
+
+    try:
+        subtitle = StringToSub(
+            annotations_string,
+            enable_embrace_libass,
+            transform_resolution_x,
+            transform_resolution_y,
+            font,
+            os.path.basename(annotation_file),
+            stats,
+            metrics,
+            args.shared_styles,
+        )
+    except ParseError:
+        Err(_("{} 不是一个有效的 XML 文件").format(annotation_file))
+        if Flags.verbose:
+            Stderr(traceback.format_exc())
+        return 1
+    except NotAnnotationError:
+        Err(_("{} 不是 Annotation 文件").format(annotation_file))
+        return 1
+    except ValueError:
+        Err(_("{} 里的 Annotation 有误").format(annotation_file))
+        if Flags.verbose:
+            Stderr(traceback.format_exc())
+        return 1
+    del annotations_string
+    # 不再先拼出整个字符串, 直接一块一块写进文件
+    if output_to_stdout:
+        subtitle.DumpTo(sys.stdout, stats=stats)
+        print(file=sys.stdout)
+        return 0
+    is_no_save = False
+    if enable_no_overwrite_files:
+        if os.path.exists(subtitle_file):
+            Stderr(YellowText(_("文件已存在, 跳过输出 ({})").format(subtitle_file)))
+            is_no_save = True
+    if enable_no_keep_intermediate_files:
+        os.remove(annotation_file)
+        Stderr(_("删除 {}").format(annotation_file))
+    if not is_no_save:
+        with open(subtitle_file, "w", encoding="utf-8") as f:
+            subtitle.DumpTo(f, stats=stats)
+        if metrics != None:
+            metrics["bytes_out"] = os.path.getsize(subtitle_file)  # type: ignore
+        Stderr(_("保存于: {}").format(subtitle_file))
+
+    def function1():
+        if Flags.verbose:
+            Stderr(cmd)
+        exit_code = os.system(cmd)
+        if Flags.verbose:
+            if exit_code != 0:
+                Stderr(YellowText("exit with {}".format(exit_code)))
+        if enable_no_keep_intermediate_files:
+            os.remove(subtitle_file)
+            Stderr(_("删除 {}").format(subtitle_file))
+
+    video = audio = ""
+    if enable_preview_video or enable_generate_video:
+        from Annotations2Sub.invidious import GetInstances
+
+        instances_file = None
+        if args.cache_dir != None:
+            instances_file = os.path.join(args.cache_dir, "invidious.json")
+        video, audio = MediaFromInvidious(
+            video_id, invidious_instances, GetInstances(instances_file)
+        )
+
+    if enable_preview_video:
+        cmd = rf'mpv "{video}" --audio-file="{audio}" --sub-file="{subtitle_file}"'
+        function1()
+
+    if enable_generate_video:
+        cmd = rf'ffmpeg -i "{video}" -i "{audio}" -vf "ass={subtitle_file}" {subtitle_file}.mp4'
+        function1()
+
+    return 0
+
+
+def ProcessTaskSafely(
+    Task: str,
+    args: argparse.Namespace,
+    timing: bool = False,
+    measuring: bool = False,
+) -> Tuple[int, Optional[Dict[str, float]], Optional[Dict[str, Any]]]:
+    """处理队列里的一项, 出了意外也只算这一项失败, 返回退出码, 耗时和计数"""
+    stats: Optional[Dict[str, float]] = {} if timing else None
+    metrics: Optional[Dict[str, Any]] = None
+    if measuring:
+        metrics = {"file": Task}
+    try:
+        with Timer(stats, "total"), Timer(metrics, "elapsed"):
+            code = ProcessTask(Task, args, stats, metrics)
+    except Exception:
+        # 一个文件出错不应该把整个队列带走, 不管是不是在进程池里
+        Err(_("处理 {} 时出错").format(Task))
+        Stderr(traceback.format_exc())
+        code = 1
+    return code, stats, metrics
+
+
+def ProcessTaskInWorker(
+    Task: str,
+    args: argparse.Namespace,
+    verbose: bool,
+    timing: bool = False,
+    measuring: bool = False,
+) -> Tuple[int, str, Optional[Dict[str, float]], Optional[Dict[str, Any]]]:
+    """在子进程里处理队列里的一项, 返回退出码, 标准错误的内容, 耗时和计数"""
+    Flags.verbose = verbose
+    messages = io.StringIO()
+    with contextlib.redirect_stderr(messages):
+        code, stats, metrics = ProcessTaskSafely(Task, args, timing, measuring)
+    return code, messages.getvalue(), stats, metrics
+
+
+def OpenMetrics(target: str) -> IO[str]:
+    """打开 --metrics 指定的文件, fd:N 表示已经打开的文件描述符"""
+    if target == "-":
+        return sys.stdout
+    if target.startswith("fd:"):
+        return os.fdopen(int(target[3:]), "w", encoding="utf-8", closefd=False)
+    # 追加, 多次运行的记录攒在一起
+    return open(target, "a", encoding="utf-8")
+
+
+# ProcessTask 里依次经过的步骤
+STAGES = ["read", "parse", "convert", "sort", "dump", "write", "total"]
+
+
+def ReportStats(records: List[Tuple[str, Dict[str, float]]], args: argparse.Namespace):
+    """打印或保存每个文件和合计的耗时"""
+    import json
+
+    total: Dict[str, float] = {}
+    for __, stats in records:
+        for stage, seconds in stats.items():
+            total[stage] = total.get(stage, 0.0) + seconds
+
+    def Line(name: str, stats: Dict[str, float]) -> str:
+        stages = [
+            f"{stage} {stats[stage] * 1000:.1f}ms" for stage in STAGES if stage in stats
+        ]
+        return f"{name}: " + ", ".join(stages)
+
+    if args.stats:
+        for Task, stats in records:
+            Stderr(Line(Task, stats))
+        Stderr(Line(_("合计 ({} 个文件)").format(len(records)), total))
+
+    if args.stats_json != None:
+        data: Dict[str, Any] = {
+            "files": [{"file": Task, "stages": stats} for Task, stats in records],
+            "total": total,
+        }
+        if args.stats_json == "-":
+            json.dump(data, sys.stdout)
+            print(file=sys.stdout)
+        else:
+            with open(args.stats_json, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+
+
+def run(argv=None):
+    """跑起来🐎🐎🐎"""
 
     Dummy([CheckUrl, AnnotationsFromArchive, MediaFromInvidious])  # type: ignore
 
@@ -114,7 +545,7 @@ def run(argv=None):
     parser = argparse.ArgumentParser(description=_("下载和转换 Youtube 注释"))
     parser.add_argument(
         "queue",
-        nargs="+",
+        nargs="*",
         type=str,
         metavar=_("文件 或 videoId"),
         help=_("多个需要转换的文件的文件路径或视频ID"),
@@ -153,6 +584,13 @@ def run(argv=None):
         metavar=_("Microsoft YaHei"),
         help=_("指定字体"),
     )
+    parser.add_argument(
+        "--shared-styles",
+        action="store_true",
+        help=_(
+            "把颜色, 透明度和字体大小放进样式, 事件里只留下位置和绘图, 字幕文件更小"
+        ),
+    )
     parser.add_argument(
         "-d",
         "--download-for-archive",
@@ -193,7 +631,10 @@ def run(argv=None):
 
     # 指从 Internet Archive 下载的注释文件
     parser.add_argument(
-        "-N", "--no-keep-intermediate-files", action="store_true", help=_("不保留中间文件")
+        "-N",
+        "--no-keep-intermediate-files",
+        action="store_true",
+        help=_("不保留中间文件"),
     )
 
     parser.add_argument(
@@ -204,7 +645,110 @@ def run(argv=None):
         help=_("指定转换后文件的输出目录"),
     )
     parser.add_argument(
-        "-o", "--output", type=str, metavar=_("文件"), help=_('保存到此文件, 如果为 "-" 则输出到标准输出')
+        "-o",
+        "--output",
+        type=str,
+        metavar=_("文件"),
+        help=_('保存到此文件, 如果为 "-" 则输出到标准输出'),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        metavar="1",
+        help=_("同时转换的进程数, 0 为 CPU 核心数"),
+    )
+    parser.add_argument(
+        "--download-jobs",
+        default=4,
+        type=int,
+        metavar="4",
+        help=_("同时下载的数量"),
+    )
+    parser.add_argument(
+        "--archive-dir",
+        type=str,
+        metavar=_("目录"),
+        help=_("从本地的 youtubeannotations 存档(tar 文件)读取注释, 不联网"),
+    )
+    parser.add_argument(
+        "--archive-index",
+        type=str,
+        metavar=_("文件"),
+        help=_(
+            "存档的索引(SQLite), 读取本地存档时不用扫描 tar 文件, 下载时用 Range 请求"
+        ),
+    )
+    parser.add_argument(
+        "--build-archive-index",
+        action="store_true",
+        help=_("为 --archive-dir 建立 --archive-index 索引"),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        metavar=_("目录"),
+        help=_("下载的注释文件缓存在此目录, 下次直接使用"),
+    )
+    parser.add_argument(
+        "--cache-size",
+        default=1024,
+        type=int,
+        metavar="1024",
+        help=_("缓存大小上限(MB), 超过后删除最久没用的文件"),
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        metavar=_("文件"),
+        help=_("记录输入文件的哈希和转换选项, 两者都没变的文件跳过转换"),
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        metavar=_("地址"),
+        help=_(
+            "作为 HTTP 服务运行, 地址可以是 端口, 主机:端口 或 unix:路径, -j 指定转换进程数"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        type=str,
+        metavar=_("目录"),
+        help=_("监视目录, 转换新来的和改过的注释文件, 直到 Ctrl+C"),
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        default=1.0,
+        type=float,
+        metavar="1.0",
+        help=_("文件多少秒没有变化才转换"),
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=_("转换完后显示每个文件各个步骤的耗时"),
+    )
+    parser.add_argument(
+        "--stats-json",
+        type=str,
+        metavar=_("文件"),
+        help=_("把各个步骤的耗时以 JSON 格式保存到文件, - 为标准输出"),
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        metavar=_("文件"),
+        help=_(
+            "每转换一个文件就向文件追加一行 JSON 统计, - 为标准输出, fd:N 为文件描述符"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar=_("文件"),
+        help=_("用 cProfile 分析运行过程, 结果保存到文件"),
     )
     parser.add_argument(
         "-v",
@@ -225,18 +769,22 @@ def run(argv=None):
     args = parser.parse_args(argv)
 
     queue = args.queue
+    if (
+        len(queue) == 0
+        and not args.build_archive_index
+        and args.serve == None
+        and args.watch == None
+    ):
+        parser.error(_("需要至少一个文件或视频ID"))
 
     enable_embrace_libass = args.embrace_libass
     transform_resolution_x = args.transform_resolution_x
     transform_resolution_y = args.transform_resolution_y
-    font = args.font
     enable_download_for_archive = args.download_for_archive
     enable_download_annotation_only = args.download_annotation_only
     enable_preview_video = args.preview_video
     enable_generate_video = args.generate_video
     invidious_instances = args.invidious_instances
-    enable_no_overwrite_files = args.no_overwrite_files
-    enable_no_keep_intermediate_files = args.no_keep_intermediate_files
     output_directory = args.output_directory
     output = args.output
     enable_verbose = args.verbose
@@ -246,6 +794,22 @@ def run(argv=None):
     if enable_verbose:
         Flags.verbose = True
 
+    if args.build_archive_index:
+        if args.archive_dir == None or args.archive_index == None:
+            Err(_("--build-archive-index 需要 --archive-dir 和 --archive-index"))
+            return 1
+        count = BuildIndex(args.archive_dir, args.archive_index)
+        Stderr(_("已为 {} 个注释文件建立索引").format(count))
+        if len(queue) == 0:
+            return 0
+    elif args.archive_index != None and not os.path.isfile(args.archive_index):
+        Err(
+            _("索引 {} 不存在, 请先用 --build-archive-index 建立").format(
+                args.archive_index
+            )
+        )
+        return 1
+
     if output != None:
         if output_directory != None:
             Err(_("--output 不能与 --output--directory 选项同时使用"))
@@ -261,6 +825,14 @@ def run(argv=None):
             Err(_("转换后文件输出目录应该指定一个文件夹"))
             return 1
 
+    if args.watch != None:
+        if output != None or enable_download_for_archive:
+            Err(_("--watch 不能与 --output, --download-for-archive 同时使用"))
+            return 1
+        if os.path.isdir(args.watch) is False:
+            Err(_("--watch 应该指定一个文件夹"))
+            return 1
+
     if enable_preview_video or enable_generate_video:
         enable_download_for_archive = True
         enable_embrace_libass = True
@@ -279,7 +851,9 @@ def run(argv=None):
     if enable_download_annotation_only:
         enable_download_for_archive = True
 
-    if enable_download_for_archive:
+    if enable_download_for_archive and args.archive_dir == None:
+        import _thread
+
         # 省的网不好不知道
         def CheckNetwork():
             if CheckUrl() is False:
@@ -287,142 +861,225 @@ def run(argv=None):
 
         _thread.start_new_thread(CheckNetwork, ())
 
-    for Task in queue:
-        video_id = MakeSureStr(Task)
-        annotation_file = Task
+    # 处理过的选项交给 ProcessTask
+    args.embrace_libass = enable_embrace_libass
+    args.download_for_archive = enable_download_for_archive
+    args.invidious_instances = invidious_instances
+    args.output_to_stdout = output_to_stdout
 
-        if enable_download_for_archive:
-            if video_id.startswith("\\"):
-                video_id = video_id.replace("\\", "", 1)
-            if re.match(r"[a-zA-Z0-9_-]{11}", video_id) is None:
-                Err(_("{} 不是一个有效的视频 ID").format(video_id))
-                exit_code = 1
-                continue
+    if args.serve != None:
+        return RunServer(args)
+    if args.watch != None:
+        return RunWatch(args)
 
-            annotation_file = f"{video_id}.xml"
-            if enable_download_annotation_only and output:
-                annotation_file = output
-            if output_directory != None:
-                annotation_file = os.path.join(output_directory, annotation_file)
-
-            is_skip_download = False
-            if enable_no_overwrite_files and os.path.exists(annotation_file):
-                if os.path.exists(annotation_file):
-                    Stderr(YellowText(_("文件已存在, 跳过下载 ({})").format(video_id)))
-                    is_skip_download = True
-            if not is_skip_download:
-                url = AnnotationsFromArchive(video_id)
-                Stderr(_("下载 {}").format(url))
-                string = GetUrl(url)
-                if output_to_stdout:
-                    print(string, file=sys.stdout)
-                    continue
-                with open(annotation_file, "w", encoding="utf-8") as f:
-                    f.write(string)
+    profiler = None
+    if args.profile != None:
+        # 子进程里的调用统计不到, 分析时只用一个进程转换
+        args.jobs = 1
+        import cProfile
 
-            if enable_download_annotation_only:
-                continue
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        exit_code = RunQueue(queue, args)
+    finally:
+        if profiler != None:
+            profiler.disable()  # type: ignore
+            profiler.dump_stats(args.profile)  # type: ignore
+            Stderr(_("性能分析结果保存于: {}").format(args.profile))
+    return exit_code
 
-        if os.path.isfile(annotation_file) is False:
-            Err(_("{} 不是一个文件").format(annotation_file))
-            exit_code = 1
-            continue
 
-        with open(annotation_file, "r", encoding="utf-8") as f:
-            annotations_string = f.read()
+def RunQueue(queue: List[str], args: argparse.Namespace) -> int:
+    """下载并转换队列, 返回退出码"""
 
-        if annotations_string == "":
-            Warn(_("{} 可能没有 Annotation").format(video_id))
-            exit_code = 1
-            continue
+    # 只转换本地的一个文件时, 线程池, 进程池, JSON, 缓存都用不上
+    exit_code = 0
+    if args.download_for_archive:
+        import concurrent.futures
 
-        try:
-            tree = defusedxml.ElementTree.parse(annotation_file)
-        except ParseError:
-            Err(_("{} 不是一个有效的 XML 文件").format(annotation_file))
-            if Flags.verbose:
-                Stderr(traceback.format_exc())
-            exit_code = 1
-            continue
+        from Annotations2Sub.cache import Cache
 
-        if tree.find("annotations") == None:
-            Err(_("{} 不是 Annotation 文件").format(annotation_file))
-            exit_code = 1
-            continue
+        cache = None
+        if args.cache_dir != None:
+            cache = Cache(args.cache_dir, args.cache_size * 1024 * 1024)
+        # 下载是等网络, 用线程一起下, 每个线程各自复用连接
+        # 用 Range 请求时一个分片只要一两次请求, 就不拆了
+        range_request = args.archive_index != None and args.archive_dir == None
+        shards = ShardQueue(queue, args, 1 if range_request else args.download_jobs)
+        codes: List[Optional[int]] = [None] * len(queue)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.download_jobs)
+        ) as thread_executor:
+            results = thread_executor.map(
+                lambda shard: DownloadShard([queue[i] for i in shard], args, cache),
+                shards,
+            )
+            for shard, shard_codes in zip(shards, results):
+                for i, code in zip(shard, shard_codes):
+                    codes[i] = code
+        remaining = []
+        for Task, code in zip(queue, codes):
+            if code == None:
+                remaining.append(Task)
+            elif code != 0:
+                exit_code = 1
+        queue = remaining
 
-        if len(tree.find("annotations").findall("annotation")) == 0:
-            Warn(_("{} 没有 Annotation").format(annotation_file))
+    # 内容和选项都没变的文件不用再转换
+    manifest = None
+    manifest_records: Dict[str, Dict[str, Any]] = {}
+    if args.manifest != None and not args.output_to_stdout:
+        from Annotations2Sub.manifest import Manifest, OptionsHash
 
-        subtitle_file = annotation_file + ".ass"
-        if output_directory != None:
-            file_name = os.path.basename(annotation_file)
-            file_name = file_name + ".ass"
-            subtitle_file = os.path.join(output_directory, file_name)
-        if output != None:
-            subtitle_file = output
-
-        # 这里是 __init__.py 开头那个流程图
-        with open(annotation_file, "r", encoding="utf-8") as f:
-            string = f.read()
-        tree = defusedxml.ElementTree.fromstring(string)
-        annotations = Parse(tree)
-        events = Convert(
-            annotations,
-            enable_embrace_libass,
-            transform_resolution_x,
-            transform_resolution_y,
+        manifest = Manifest(args.manifest)
+        options = OptionsHash(
+            args.embrace_libass,
+            args.transform_resolution_x,
+            args.transform_resolution_y,
+            args.font,
+            args.shared_styles,
         )
-        if events == []:
-            Warn(_("{} 没有注释被转换").format(annotation_file))
-        # Annotation 是无序的
-        # 按时间重新排列字幕事件, 是为了人类可读
-        events.sort(key=lambda event: event.Start)
-        subtitle = Sub()
-        subtitle.events.extend(events)
-        subtitle.comment += _("此脚本使用 Annotations2Sub 生成") + "\n"
-        subtitle.comment += "https://github.com/USED255/Annotations2Sub"
-        subtitle.info["PlayResX"] = transform_resolution_x  # type: ignore
-        subtitle.info["PlayResY"] = transform_resolution_y  # type: ignore
-        subtitle.info["Title"] = os.path.basename(annotation_file)
-        subtitle.styles["Default"].Fontname = font
-        subtitle_string = subtitle.Dump()
-        if output_to_stdout:
-            print(subtitle_string, file=sys.stdout)
-            continue
-        is_no_save = False
-        if enable_no_overwrite_files:
-            if os.path.exists(subtitle_file):
-                Stderr(YellowText(_("文件已存在, 跳过输出 ({})").format(subtitle_file)))
-                is_no_save = True
-        if enable_no_keep_intermediate_files:
-            os.remove(annotation_file)
-            Stderr(_("删除 {}").format(annotation_file))
-        if not is_no_save:
-            with open(subtitle_file, "w", encoding="utf-8") as f:
-                f.write(subtitle_string)
-            Stderr(_("保存于: {}").format(subtitle_file))
-
-        def function1():
-            if Flags.verbose:
-                Stderr(cmd)
-            exit_code = os.system(cmd)
-            if Flags.verbose:
-                if exit_code != 0:
-                    Stderr(YellowText("exit with {}".format(exit_code)))
-            if enable_no_keep_intermediate_files:
-                os.remove(subtitle_file)
-                Stderr(_("删除 {}").format(subtitle_file))
+        changed = []
+        for Task in queue:
+            annotation_file = AnnotationFile(Task, args)
+            record = manifest.Check(
+                annotation_file, SubtitleFile(annotation_file, args), options
+            )
+            if record == None:
+                Stderr(YellowText(_("没有变化, 跳过转换 ({})").format(annotation_file)))
+                continue
+            manifest_records[Task] = record  # type: ignore
+            changed.append(Task)
+        queue = changed
+
+    # 只在需要时计时和计数, 平时 stats 和 metrics 都是 None
+    timing = args.stats or args.stats_json != None
+    # 清单要靠 metrics 里有没有 bytes_out 知道输出文件写了没有
+    measuring = args.metrics != None or manifest != None
+    records: List[Tuple[str, Dict[str, float]]] = []
+    metrics_file = None
+    if args.metrics != None:
+        metrics_file = OpenMetrics(args.metrics)
+
+    def Collect(
+        Task: str,
+        code: int,
+        stats: Optional[Dict[str, float]],
+        metrics: Optional[Dict[str, Any]],
+    ):
+        if stats != None:
+            records.append((Task, stats))  # type: ignore
+        # --no-overwrite-files 跳过的没有写出文件, 输出可能是旧的, 不能记
+        if manifest != None and code == 0 and "bytes_out" in metrics:  # type: ignore
+            manifest.Record(AnnotationFile(Task, args), manifest_records[Task])  # type: ignore
+        if metrics_file != None:
+            import json
 
-        video = audio = ""
-        if enable_preview_video or enable_generate_video:
-            video, audio = MediaFromInvidious(video_id, invidious_instances)
+            metrics["code"] = code  # type: ignore
+            # 一行一个文件, 写完就 flush, 监控那边可以边转换边读
+            metrics_file.write(json.dumps(metrics, ensure_ascii=False) + "\n")  # type: ignore
+            metrics_file.flush()  # type: ignore
 
-        if enable_preview_video:
-            cmd = rf'mpv "{video}" --audio-file="{audio}" --sub-file="{subtitle_file}"'
-            function1()
+    jobs = args.jobs
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(queue))
 
-        if enable_generate_video:
-            cmd = rf'ffmpeg -i "{video}" -i "{audio}" -vf "ass={subtitle_file}" {subtitle_file}.mp4'
-            function1()
+    try:
+        if jobs <= 1:
+            for Task in queue:
+                code, stats, metrics = ProcessTaskSafely(Task, args, timing, measuring)
+                if code != 0:
+                    exit_code = 1
+                Collect(Task, code, stats, metrics)
+        else:
+            # 每个文件都是独立的, 分给多个进程一起转换
+            # 子进程的输出先攒着, 按队列顺序打印, 免得混在一起
+            import concurrent.futures
 
+            chunksize = max(1, len(queue) // (jobs * 16))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                outputs = executor.map(
+                    ProcessTaskInWorker,
+                    queue,
+                    itertools.repeat(args),
+                    itertools.repeat(Flags.verbose),
+                    itertools.repeat(timing),
+                    itertools.repeat(measuring),
+                    chunksize=chunksize,
+                )
+                for Task, (code, messages, stats, metrics) in zip(queue, outputs):
+                    sys.stderr.write(messages)
+                    if code != 0:
+                        exit_code = 1
+                    Collect(Task, code, stats, metrics)
+    finally:
+        if metrics_file != None and metrics_file not in (sys.stdout, sys.stderr):
+            metrics_file.close()  # type: ignore
+        # 中途退出的话已经转换完的也记下来
+        if manifest != None:
+            manifest.Save()  # type: ignore
+
+    if timing:
+        ReportStats(records, args)
     return exit_code
+
+
+def RunServer(args: argparse.Namespace) -> int:
+    """--serve, 一直运行到 Ctrl+C"""
+    from Annotations2Sub.cache import Cache
+    from Annotations2Sub.server import Serve
+
+    cache = None
+    if args.cache_dir != None:
+        cache = Cache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    def Fetch(video_id: str) -> Optional[bytes]:
+        # 和 DownloadTask 一样: 本地存档, 缓存, 最后才去下载
+        # 下载失败抛出 HTTPError 或 URLError
+        if args.archive_dir != None:
+            return AnnotationsFromLocalArchive(
+                args.archive_dir, video_id, args.archive_index
+            )
+        if cache != None:
+            data = cache.Get(video_id)  # type: ignore
+            if data != None:
+                return data
+        data = GetBytes(AnnotationsFromArchive(video_id))
+        if cache != None:
+            cache.Put(video_id, data)  # type: ignore
+        return data
+
+    jobs = args.jobs
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return Serve(args.serve, Fetch, jobs, Flags.verbose)
+
+
+def RunWatch(args: argparse.Namespace) -> int:
+    """--watch, 一直运行到 Ctrl+C"""
+    from Annotations2Sub.watch import Watch, Watcher
+
+    watcher = Watcher(args.watch, args.watch_debounce)
+    # 启动前已经转换过的文件不再转换, 没转换或者改过的照常转换
+    for path, signature in watcher.Files().items():
+        subtitle_file = SubtitleFile(path, args)
+        if os.path.exists(subtitle_file):
+            if os.stat(subtitle_file).st_mtime_ns >= signature[0]:
+                watcher.seen[path] = signature
+
+    def Convert(files: List[str]):
+        # 一批出了意外也要接着监视
+        try:
+            RunQueue(files, args)
+        except Exception:
+            Err(_("处理 {} 时出错").format(", ".join(files)))
+            Stderr(traceback.format_exc())
+
+    Stderr(_("监视 {}").format(args.watch))
+    try:
+        Watch(watcher, Convert)
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Invidious 实例的选择"""
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+INSTANCES_URL = "https://api.invidious.io/instances.json"
+
+
+class Instances:
+    """Invidious 实例列表, 以及每个实例的响应时间和失败次数"""
+
+    # 以前每个视频都要重新下一遍实例列表, 再一个一个试, 碰上挂掉的实例要等到超时
+    # 现在列表缓存一段时间, 按以往的表现给实例排序, 同时问排在前面的几个, 谁先答上来用谁
+    # 给了文件的话成绩会存下来, 下次运行接着用
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 24 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.time = 0.0
+        self.domains: List[str] = []
+        # {域名: [平均响应时间, 连续失败次数]}
+        self.scores: Dict[str, List[float]] = {}
+        self.Load()
+
+    def Load(self):
+        if self.path == None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:  # type: ignore
+                data = json.load(f)
+            self.time = float(data["time"])
+            self.domains = [str(domain) for domain in data["domains"]]
+            self.scores = {
+                str(domain): [float(score[0]), float(score[1])]
+                for domain, score in data["scores"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            pass
+
+    def Save(self):
+        if self.path == None:
+            return
+        with self.lock:
+            data = {"time": self.time, "domains": self.domains, "scores": self.scores}
+        directory = os.path.dirname(self.path)  # type: ignore
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temporary, self.path)  # type: ignore
+        except OSError:
+            pass
+
+    def Domains(self, get: Callable[[str], str]) -> List[str]:
+        """返回可用的实例, 列表过期了才重新下载"""
+        if len(self.domains) > 0 and time.time() - self.time < self.ttl:
+            return self.domains
+        domains = []
+        for instance in json.loads(get(INSTANCES_URL)):
+            if len(instance) > 1:
+                if not instance[1].get("api"):
+                    continue
+                # onion 和 i2p 的实例用 https 访问不了
+                if instance[1].get("type", "https") != "https":
+                    continue
+            domains.append(instance[0])
+        with self.lock:
+            self.domains = domains
+            self.time = time.time()
+        self.Save()
+        return domains
+
+    def Score(self, domain: str) -> float:
+        """越小越好, 没问过的实例按 1 秒算"""
+        latency, failures = self.scores.get(domain, [1.0, 0.0])
+        return latency + failures * 10
+
+    def Rank(self, domains: List[str]) -> List[str]:
+        # sorted 是稳定的, 成绩一样时保持原来的顺序
+        return sorted(domains, key=self.Score)
+
+    def Report(self, domain: str, latency: Optional[float]):
+        """记录一次请求, latency 为 None 表示失败"""
+        with self.lock:
+            score = self.scores.setdefault(domain, [1.0, 0.0])
+            if latency == None:
+                score[1] += 1
+            else:
+                # 指数移动平均, 偶尔慢一次不至于被打入冷宫
+                score[0] = score[0] * 0.7 + latency * 0.3  # type: ignore
+                score[1] = 0
+
+
+def Probe(
+    domains: List[str],
+    request: Callable[[str], Any],
+    instances: Optional[Instances] = None,
+    width: int = 3,
+) -> Tuple[str, Any]:
+    """同时向前几个实例发请求, 返回第一个成功的 (域名, 结果)"""
+
+    from urllib.error import URLError
+
+    # request 抛出这些异常算是这个实例不行, 换下一个
+    # 其他异常照常抛出
+    errors = (URLError, ValueError, KeyError, IndexError, TypeError)
+    results: "queue.Queue[Tuple[str, Any, Optional[BaseException], float]]"
+    results = queue.Queue()
+
+    def Worker(domain: str):
+        start = time.perf_counter()
+        try:
+            result = request(domain)
+        except BaseException as e:
+            results.put((domain, None, e, time.perf_counter() - start))
+            return
+        results.put((domain, result, None, time.perf_counter() - start))
+
+    pending = list(domains)
+    running = 0
+    try:
+        while len(pending) > 0 or running > 0:
+            while len(pending) > 0 and running < width:
+                # 慢的实例不等了, 用守护线程, 不会拖住退出
+                threading.Thread(
+                    target=Worker, args=(pending.pop(0),), daemon=True
+                ).start()
+                running += 1
+            domain, result, error, latency = results.get()
+            running -= 1
+            if error == None:
+                if instances != None:
+                    instances.Report(domain, latency)  # type: ignore
+                return domain, result
+            if instances != None:
+                instances.Report(domain, None)  # type: ignore
+            if not isinstance(error, errors):
+                raise error  # type: ignore
+    finally:
+        if instances != None:
+            instances.Save()  # type: ignore
+    raise LookupError("No Invidious instance available")
+
+
+instances_by_path: Dict[Optional[str], Instances] = {}
+
+
+def GetInstances(path: Optional[str] = None) -> Instances:
+    """同一个文件在一个进程里只读一次"""
+    if path not in instances_by_path:
+        instances_by_path[path] = Instances(path)
+    return instances_by_path[path]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""增量转换的清单"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from Annotations2Sub import version
+
+# --no-overwrite-files 只看输出文件在不在, 输入改了也不会重新转换
+# 清单记下每个输入文件内容的哈希和转换选项, 两者都没变并且输出还在时才跳过
+# 修改时间和大小没变的文件不用再读一遍算哈希, 和 git 的 index 一个道理
+
+
+def OptionsHash(
+    libass: bool,
+    resolutionX: int,
+    resolutionY: int,
+    font: str,
+    sharedStyles: bool = False,
+) -> str:
+    """影响转换结果的选项, 升级后也要重新转换"""
+    options = [libass, resolutionX, resolutionY, font, sharedStyles, version]
+    return hashlib.sha256(json.dumps(options).encode("utf-8")).hexdigest()
+
+
+def FileHash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """{输入文件: 哈希, 选项, 输出文件, 修改时间, 大小}"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.Load()
+
+    def Load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = dict(data["files"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # 没有或者坏了就当全都要转换
+            self.files = {}
+
+    def Save(self):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def Check(self, file: str, output: str, options: str) -> Optional[Dict[str, Any]]:
+        """没变化返回 None, 否则返回转换成功后交给 Record 的记录"""
+        file = os.path.abspath(file)
+        output = os.path.abspath(output)
+        try:
+            # 先 stat 再读, 读的时候文件又变了的话下次 stat 对不上, 会重新检查
+            stat = os.stat(file)
+            entry = self.files.get(file)
+            same = (
+                entry != None
+                and entry["options"] == options  # type: ignore
+                and entry["output"] == output  # type: ignore
+                and os.path.exists(output)
+            )
+            if same and (entry["mtime"], entry["size"]) == (  # type: ignore
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                return None
+            digest = FileHash(file)
+        except OSError:
+            # 交给转换时报错
+            return {}
+        record = {
+            "sha256": digest,
+            "options": options,
+            "output": output,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+        if same and entry["sha256"] == digest:  # type: ignore
+            # 只是碰了一下修改时间
+            self.files[file] = record
+            return None
+        return record
+
+    def Record(self, file: str, record: Dict[str, Any]):
+        """输出文件确实写出来了才调用"""
+        if len(record) > 0:
+            self.files[os.path.abspath(file)] = record
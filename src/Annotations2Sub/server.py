@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""常驻的转换服务"""
+
+import http.server
+import os
+import re
+import socketserver
+import stat
+import traceback
+import urllib.parse
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.error import HTTPError, URLError
+
+from Annotations2Sub.utils import Err, Stderr, _
+
+# 每转换一个文件就启动一次 Python, 解释器, 导入和翻译都要重新来一遍
+# 这里让转换器一直开着, 通过 HTTP 接收请求:
+#   POST /convert          请求体是 Annotation 文件, 返回 ASS
+#   GET  /convert?video=ID 按视频 ID 取得 Annotation 文件再转换
+# 选项放在查询字符串里: libass, x, y, font, title
+# 地址可以是 "端口", "主机:端口" 或者 "unix:路径"
+
+
+def ConvertString(
+    data: bytes, libass: bool, resolutionX: int, resolutionY: int, font: str, title: str
+) -> Tuple[int, bytes]:
+    """转换一个 Annotation 文件, 返回 (HTTP 状态码, 内容), 可以在子进程里运行"""
+    from xml.etree.ElementTree import ParseError
+
+    from Annotations2Sub.Annotation import NotAnnotationError
+    from Annotations2Sub.Convert import StringToAss
+
+    try:
+        string = StringToAss(data, libass, resolutionX, resolutionY, font, title)
+    except ParseError:
+        return 400, b"invalid XML\n"
+    except NotAnnotationError:
+        return 400, b"not an annotation file\n"
+    except ValueError:
+        return 400, b"malformed annotation content\n"
+    return 200, string.encode("utf-8")
+
+
+def ParseOptions(query: Dict[str, Any]) -> Tuple[bool, int, int, str, str]:
+    """从查询字符串里取出转换选项, 不对的抛出 ValueError"""
+
+    def Get(name: str, default: str) -> str:
+        return query.get(name, [default])[-1]
+
+    libass = Get("libass", "0").lower() in ("1", "true", "yes")
+    resolutionX = int(Get("x", "100"))
+    resolutionY = int(Get("y", "100"))
+    if resolutionX <= 0 or resolutionY <= 0:
+        raise ValueError("resolution must be positive")
+    return (
+        libass,
+        resolutionX,
+        resolutionY,
+        Get("font", _("Microsoft YaHei")),
+        Get("title", ""),
+    )
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Any
+
+    def address_string(self) -> str:
+        # Unix socket 没有客户端地址
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return "unix"
+
+    def log_message(self, format: str, *args):
+        if self.server.verbose:
+            Stderr(format % args)
+
+    def Reply(self, status: int, body: bytes, contentType="text/plain; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def Fail(self, message: str):
+        """意外的错误也要给客户端一个回复, 而不是直接断开"""
+        if self.server.verbose:
+            Stderr(traceback.format_exc())
+        self.Reply(500, f"{message}\n".encode("utf-8"))
+
+    def Handle(self, data: Optional[bytes], query: Dict[str, Any], title: str):
+        try:
+            libass, resolutionX, resolutionY, font, given_title = ParseOptions(query)
+        except ValueError as e:
+            self.Reply(400, f"{e}\n".encode("utf-8"))
+            return
+        if given_title != "":
+            title = given_title
+
+        if data == None:
+            video_id = query.get("video", [""])[-1]
+            if re.match(r"[a-zA-Z0-9_-]{11}$", video_id) is None:
+                self.Reply(400, b"invalid video ID\n")
+                return
+            title = title or f"{video_id}.xml"
+            try:
+                data = self.server.fetch(video_id)
+            except HTTPError as e:
+                self.Reply(404 if e.code == 404 else 502, f"{e}\n".encode("utf-8"))
+                return
+            except URLError as e:
+                self.Reply(502, f"{e}\n".encode("utf-8"))
+                return
+            except Exception:
+                # 索引坏了, 缓存或存档读不了...
+                self.Fail("fetching annotations failed")
+                return
+            if data == None:
+                self.Reply(404, b"annotations not found\n")
+                return
+
+        try:
+            status, body = self.server.Convert(
+                data, libass, resolutionX, resolutionY, font, title or "Default File"
+            )
+        except Exception:
+            # 比如进程池里的进程被杀掉了
+            self.Fail("conversion failed")
+            return
+        contentType = "text/x-ssa; charset=utf-8"
+        if status != 200:
+            contentType = "text/plain; charset=utf-8"
+        self.Reply(status, body, contentType)
+
+    def do_GET(self):
+        path, __, query = self.path.partition("?")
+        if path != "/convert":
+            self.Reply(404, b"not found\n")
+            return
+        self.Handle(None, urllib.parse.parse_qs(query), "")
+
+    def do_POST(self):
+        path, __, query = self.path.partition("?")
+        if path != "/convert":
+            self.Reply(404, b"not found\n")
+            return
+        length = self.headers.get("Content-Length")
+        if length == None or not length.isdigit():
+            self.Reply(411, b"Content-Length required\n")
+            return
+        if int(length) > self.server.max_body:
+            # 不读进内存, 读不完的请求体也没法接着用这条连接
+            self.close_connection = True
+            self.Reply(413, b"request body too large\n")
+            return
+        data = self.rfile.read(int(length))
+        self.Handle(data, urllib.parse.parse_qs(query), "")
+
+
+class Server:
+    """服务器的公共部分"""
+
+    # 解析 XML 和转换是纯计算, 多线程受 GIL 限制
+    # jobs > 1 时交给进程池, 处理请求的线程只管收发
+    # POST 的请求体要整个读进内存, 最大的 Annotation 文件也就几 MB
+    max_body = 64 * 1024 * 1024
+
+    def Setup(self, fetch: Callable[[str], Optional[bytes]], jobs: int, verbose: bool):
+        self.fetch = fetch
+        self.verbose = verbose
+        self.executor = None
+        if jobs > 1:
+            import concurrent.futures
+
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+    def Convert(self, *args) -> Tuple[int, bytes]:
+        if self.executor == None:
+            return ConvertString(*args)
+        return self.executor.submit(ConvertString, *args).result()  # type: ignore
+
+    def Close(self):
+        self.server_close()  # type: ignore
+        if self.executor != None:
+            self.executor.shutdown()  # type: ignore
+
+
+class TCPServer(Server, http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+# Windows 上没有 Unix socket
+if hasattr(socketserver, "UnixStreamServer"):
+
+    class UnixServer(
+        Server, socketserver.ThreadingMixIn, socketserver.UnixStreamServer  # type: ignore
+    ):
+        daemon_threads = True
+
+
+def MakeServer(
+    address: str,
+    fetch: Callable[[str], Optional[bytes]],
+    jobs: int = 1,
+    verbose: bool = False,
+):
+    """按地址创建服务器, 还没开始处理请求"""
+    server: Any
+    if address.startswith("unix:"):
+        if not hasattr(socketserver, "UnixStreamServer"):
+            raise ValueError("Unix sockets are not supported on this platform")
+        path = address[len("unix:") :]
+        # 上次没删掉的 socket 文件, 别的文件不动
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        server = UnixServer(path, Handler)
+    else:
+        host, __, port = address.rpartition(":")
+        server = TCPServer((host or "127.0.0.1", int(port)), Handler)
+    server.Setup(fetch, jobs, verbose)
+    return server
+
+
+def Serve(
+    address: str,
+    fetch: Callable[[str], Optional[bytes]],
+    jobs: int = 1,
+    verbose: bool = False,
+) -> int:
+    """一直运行到 Ctrl+C"""
+    try:
+        server = MakeServer(address, fetch, jobs, verbose)
+    except (OSError, ValueError) as e:
+        Err(_("无法监听 {}: {}").format(address, e))
+        return 1
+    unix = address.startswith("unix:")
+    if unix:
+        Stderr(_("监听于 {}").format(address))
+    else:
+        host, port = server.server_address[:2]
+        Stderr(_("监听于 http://{}:{}/convert").format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.Close()
+        if unix:
+            try:
+                os.remove(address[len("unix:") :])
+            except OSError:
+                pass
+    return 0
@@ -3,12 +3,12 @@
 
 """工具类"""
 
-import gettext
-import locale
+import contextlib
 import os
 import sys
-import urllib.request
-from typing import Any
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 
 class flags:
@@ -21,6 +21,9 @@ Flags = flags()
 
 def internationalization():
     """On n'habite pas un pays, on habite une langue. Une patrie, c'est cela et rien d'autre."""
+    import gettext
+    import locale
+
     try:
         # 配合 __main__.py
         locales = os.path.join(os.path.split(os.path.realpath(__file__))[0], "locales")
@@ -72,9 +75,144 @@ def MakeSureStr(string: Any) -> str:
     raise TypeError
 
 
+@contextlib.contextmanager
+def Timer(stats: Optional[Dict[str, float]], stage: str) -> Iterator[None]:
+    """把这一段的耗时(秒)累加到 stats[stage], stats 为 None 时什么也不做"""
+    if stats == None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[stage] = stats.get(stage, 0.0) + time.perf_counter() - start  # type: ignore
+
+
+class connections(threading.local):
+    """每个线程各自的 HTTP 连接, 按 (scheme, host) 复用"""
+
+    def __init__(self):
+        # 值是 http.client.HTTPConnection
+        self.connections: Dict[Tuple[str, str], Any] = {}
+
+
+Connections = connections()
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+def GetBytes(
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 30.0,
+    redirects: int = 5,
+    accept: Optional[Callable[[int, Any], bool]] = None,
+) -> bytes:
+    """下载 url, 同一线程对同一主机复用 keep-alive 连接
+
+    给了 accept 的话, 读响应体之前先用 (状态码, 响应头) 问一下, 不接受就抛出 URLError
+    """
+
+    # 之前每次都用 urllib.request.urlopen 新建一个连接
+    # 下几千个文件时大部分时间都花在握手上了
+    # 出错时和 urlopen 一样抛出 HTTPError 或 URLError
+    import http.client
+    import urllib.parse
+    import urllib.request
+    from urllib.error import HTTPError, URLError
+
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https"):
+        raise URLError(f"unknown url type: {parsed.scheme}")
+    key = (parsed.scheme, parsed.netloc)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    request_headers = {"User-Agent": "Annotations2Sub", "Accept-Encoding": "identity"}
+    if headers != None:
+        request_headers.update(headers)
+
+    # 设置了代理的话还是交给 urllib, 它会处理代理
+    if parsed.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(
+        parsed.hostname or ""
+    ):
+        request = urllib.request.Request(url, headers=request_headers)
+        with urllib.request.urlopen(request, timeout=timeout) as r:
+            if accept != None and not accept(r.status, r.headers):  # type: ignore
+                raise URLError(f"unexpected response {r.status}")
+            return r.read()
+
+    rejected = False
+    for retry in (True, False):
+        reused = key in Connections.connections
+        if reused:
+            connection = Connections.connections[key]
+        elif parsed.scheme == "https":
+            connection = http.client.HTTPSConnection(parsed.netloc, timeout=timeout)
+        else:
+            connection = http.client.HTTPConnection(parsed.netloc, timeout=timeout)
+        Connections.connections[key] = connection
+        try:
+            connection.request("GET", path, headers=request_headers)
+            response = connection.getresponse()
+            # 重定向和错误照常处理, 只问最终的响应
+            rejected = (
+                accept != None
+                and response.status not in REDIRECTS
+                and response.status < 400
+                and not accept(response.status, response.headers)  # type: ignore
+            )
+            if not rejected:
+                data = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            del Connections.connections[key]
+            # 复用的连接可能已经被服务器关掉了, 换个新连接再试一次
+            if reused and retry:
+                continue
+            raise URLError(e)
+        break
+
+    # 没读完的响应体还在连接里, 这条连接不能再用了
+    if rejected or response.will_close:
+        connection.close()
+        del Connections.connections[key]
+    if rejected:
+        raise URLError(f"unexpected response {response.status}")
+
+    if response.status in REDIRECTS:
+        location = response.getheader("Location")
+        if location == None or redirects <= 0:
+            raise HTTPError(
+                url, response.status, response.reason, response.headers, None
+            )
+        location = urllib.parse.urljoin(url, location)
+        return GetBytes(location, headers, timeout, redirects - 1, accept)
+    if response.status >= 400:
+        raise HTTPError(url, response.status, response.reason, response.headers, None)
+    return data
+
+
 def GetUrl(url: str) -> str:
-    with urllib.request.urlopen(url) as r:
-        return r.read().decode("utf-8")
+    return GetBytes(url).decode("utf-8")
+
+
+translate: Optional[Callable[[str], str]] = None
+
+
+def Untranslated(message: str) -> str:
+    """翻译文件加载好之前先用原文"""
+    return message
+
 
+def _(message: str) -> str:
+    """翻译, 第一次用到时才加载翻译文件"""
 
-_ = internationalization()
+    # 以前导入 utils 时就加载翻译文件, 只是 import 一下也要去找文件
+    global translate
+    if translate == None:
+        # 加载失败时 Err 也要用到 _, 先用原文顶上
+        translate = Untranslated
+        translate = internationalization()
+    return translate(message)  # type: ignore
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""监视目录, 转换新来的和改过的注释文件"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 不依赖 inotify 之类的平台接口, 定时扫一遍目录, 比较修改时间和大小
+# 文件可能还没写完, 要连续 debounce 秒没有变化才交出去
+# 一次拷进来一大批时, 等这一批都稳定下来一起转换, 可以用上进程池
+
+Signature = Tuple[int, int]
+
+
+class Watcher:
+    """记住目录里每个文件的 (修改时间, 大小), Poll 返回变化后稳定下来的文件"""
+
+    def __init__(self, directory: str, debounce: float = 1.0, suffix: str = ".xml"):
+        self.directory = directory
+        self.debounce = debounce
+        self.suffix = suffix
+        # 已经交出去的文件
+        self.seen: Dict[str, Signature] = {}
+        # 变了但还没稳定下来的文件, 以及最后一次变化的时间
+        self.pending: Dict[str, Tuple[Signature, float]] = {}
+
+    def Files(self) -> Dict[str, Signature]:
+        files: Dict[str, Signature] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # 扫描时被删掉了
+                    continue
+                files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def Poll(self, now: Optional[float] = None) -> List[str]:
+        if now == None:
+            now = time.monotonic()
+        files = self.Files()
+        ready = []
+        for path, signature in files.items():
+            if self.seen.get(path) == signature:
+                self.pending.pop(path, None)
+                continue
+            if path in self.pending and self.pending[path][0] == signature:
+                if now - self.pending[path][1] >= self.debounce:  # type: ignore
+                    ready.append(path)
+                continue
+            self.pending[path] = (signature, now)  # type: ignore
+        for path in ready:
+            self.seen[path] = files[path]
+            del self.pending[path]
+        # 删掉的文件再出现时算新文件
+        for path in list(self.seen):
+            if path not in files:
+                del self.seen[path]
+        for path in list(self.pending):
+            if path not in files:
+                del self.pending[path]
+        return sorted(ready)
+
+
+def Watch(
+    watcher: Watcher,
+    callback: Callable[[List[str]], None],
+    interval: float = 0.5,
+    stop: Optional[threading.Event] = None,
+):
+    """一直扫描, 有文件就交给 callback, 直到 stop 被设置"""
+    if stop == None:
+        stop = threading.Event()
+    while not stop.is_set():  # type: ignore
+        ready = watcher.Poll()
+        if len(ready) > 0:
+            callback(ready)
+        stop.wait(interval)  # type: ignore
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""性能测试
+
+在 src 目录下运行:
+
+    python -m tests.benchmark
+
+分别测量 Parse, Convert, Sub.Dump 在不同大小的输入上每秒处理多少个 Annotation, 以及内存峰值
+Format 比较颜色标签每次 format 和查表两种做法
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+from xml.etree.ElementTree import Element
+
+import defusedxml.ElementTree  # type: ignore
+
+from Annotations2Sub.Annotation import Annotation, Parse
+from Annotations2Sub.Convert import Convert, DumpAlpha, DumpColor
+from Annotations2Sub.Sub import Sub
+from Annotations2Sub.utils import Flags
+from tests.corpus import Generate
+
+base_path = os.path.dirname(__file__)
+baseline_path = os.path.join(base_path, "testCase", "Baseline")
+baselines = ["29-q7YnyUmY", "e8kKeUuytqA", "annotation"]
+
+STYLES = ["popup", "title", "highlightText", "speech", "anchored", "label"]
+
+# (名字, libass, resolutionX, resolutionY)
+OPTIONS = [
+    ("default", False, 100, 100),
+    ("libass", True, 100, 100),
+    ("libass-1080p", True, 1920, 1080),
+]
+
+
+def Samples() -> Dict[str, List[Element]]:
+    """按样式收集测试用例里的 annotation 元素"""
+    samples: Dict[str, List[Element]] = {style: [] for style in STYLES}
+    for baseline in baselines:
+        with open(os.path.join(baseline_path, f"{baseline}.xml.test"), "rb") as f:
+            tree = defusedxml.ElementTree.fromstring(f.read())
+        for each in tree.find("annotations").findall("annotation"):  # type: ignore
+            style = each.get("style")
+            if style in samples:
+                samples[style].append(each)  # type: ignore
+    return samples
+
+
+def MakeTree(samples: List[Element], count: int) -> Element:
+    """把样例重复到 count 个, 每个换一个 id"""
+    document = Element("document")
+    annotations = Element("annotations")
+    document.append(annotations)
+    for i in range(count):
+        each = copy.deepcopy(samples[i % len(samples)])
+        each.set("id", f"annotation_{i}")
+        annotations.append(each)
+    return document
+
+
+def Measure(function: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """返回最快一次的耗时, 以及内存峰值"""
+    best = float("inf")
+    for __ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    # tracemalloc 会拖慢速度, 单独跑一次量内存
+    gc.collect()
+    tracemalloc.start()
+    function()
+    __, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def FormatTags(annotations: List[Annotation], tables: bool):
+    """每个 Annotation 拼一次文本和框的颜色标签
+
+    tables 为 False 时和以前一样每次都 format, 为 True 时和 Convert 一样查表并把片段存起来
+    """
+    memo: Dict[tuple, str] = {}
+    for each in annotations:
+        fg, bg, alpha = each.fgColor, each.bgColor, each.bgOpacity
+        if not tables:
+            rf"\fs{str(each.textSize)}\c&H{fg.red:02X}{fg.green:02X}{fg.blue:02X}&"
+            rf"\c&H{bg.red:02X}{bg.green:02X}{bg.blue:02X}&\1a&H{255 - alpha.alpha:02X}&"
+            continue
+        key = (each.textSize, fg.red, fg.green, fg.blue)
+        if key not in memo:
+            memo[key] = rf"\fs{str(each.textSize)}\c{DumpColor(fg)}"
+        key = (bg.red, bg.green, bg.blue, alpha.alpha)
+        if key not in memo:
+            memo[key] = rf"\c{DumpColor(bg)}\1a{DumpAlpha(alpha)}"
+
+
+def Benchmark(
+    sizes: List[int], repeat: int, synthetic: bool = False
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+
+    def Record(stage: str, style: str, option: str, count: int, seconds, peak):
+        result = {
+            "stage": stage,
+            "style": style,
+            "options": option,
+            "annotations": count,
+            "seconds": seconds,
+            "annotations_per_second": count / seconds if seconds > 0 else 0.0,
+            "peak_memory": peak,
+        }
+        results.append(result)
+        Report(result)
+
+    samples = Samples()
+    for count in sizes:
+        for style in STYLES:
+            if len(samples[style]) == 0:
+                continue
+            if synthetic:
+                tree = defusedxml.ElementTree.fromstring(
+                    Generate(count, {style: 1.0}, seed=count)
+                )
+            else:
+                tree = MakeTree(samples[style], count)
+
+            seconds, peak = Measure(lambda: Parse(tree), repeat)
+            Record("Parse", style, "-", count, seconds, peak)
+
+            annotations = Parse(tree)
+            for option, libass, resolutionX, resolutionY in OPTIONS:
+                seconds, peak = Measure(
+                    lambda: Convert(annotations, libass, resolutionX, resolutionY),
+                    repeat,
+                )
+                Record("Convert", style, option, count, seconds, peak)
+
+            subtitle = Sub()
+            subtitle.events.extend(Convert(annotations))
+            seconds, peak = Measure(subtitle.Dump, repeat)
+            Record("Sub.Dump", style, "-", count, seconds, peak)
+
+        # 颜色标签的格式化, 随机生成的颜色比测试用例里的多, 对查表不利
+        annotations = Parse(
+            defusedxml.ElementTree.fromstring(Generate(count, seed=count))
+        )
+        for option, tables in (("str.format", False), ("table", True)):
+            seconds, peak = Measure(lambda: FormatTags(annotations, tables), repeat)
+            Record("Format", "-", option, count, seconds, peak)
+    return results
+
+
+def Report(result: Dict[str, Any]):
+    print(
+        "{stage:<10} {style:<14} {options:<13} {annotations:>8} "
+        "{seconds:>10.4f}s {annotations_per_second:>12.0f}/s "
+        "{peak:>10.1f}KiB".format(peak=result["peak_memory"] / 1024, **result),
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotations2Sub 性能测试")
+    parser.add_argument(
+        "--sizes",
+        default="100,1000,10000",
+        help="每种样式的 Annotation 数量, 用逗号分隔",
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="每项跑几次取最快的")
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="用 tests/corpus.py 生成的输入, 而不是重复测试用例里的注释",
+    )
+    # tests/__init__.py 会切换到 testCase/garbage, 相对路径是相对于那里的
+    parser.add_argument("--json", metavar="FILE", help="把结果另存为 JSON")
+    args = parser.parse_args(argv)
+
+    # tests/__init__.py 为了测试打开了 verbose, 这里不需要
+    Flags.verbose = False
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(
+        f"{'stage':<10} {'style':<14} {'options':<13} {'count':>8} "
+        f"{'time':>11} {'throughput':>14} {'peak':>13}"
+    )
+    results = Benchmark(sizes, max(1, args.repeat), args.synthetic)
+    if args.json != None:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
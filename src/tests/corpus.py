@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""生成用于压力测试的 Annotation 文件
+
+在 src 目录下运行:
+
+    python -m tests.corpus --count 50000 --styles speech=3,highlightText=1 -o /tmp/50000.xml
+
+同样的参数和 --seed 生成的文件一字不差
+"""
+
+import argparse
+import random
+import sys
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+STYLES = ["popup", "title", "highlightText", "speech", "anchored", "label"]
+TYPES = ["text", "highlight", "branding"]
+
+# Parse 会跳过但不会出错的几种坏元素
+MALFORMED = [
+    "no-type",
+    "unsupported-type",
+    "no-style",
+    "no-moving-region",
+    "no-region",
+    "never",
+]
+
+CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789    {}<>&\"'\n中文注释"
+
+
+def ParseWeights(string: str, names: List[str]) -> Dict[str, float]:
+    """解析 "popup=2,speech=1" 这样的权重"""
+    weights: Dict[str, float] = {}
+    for item in string.split(","):
+        name, __, weight = item.partition("=")
+        if name not in names:
+            raise ValueError(f"unknown name: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def FormatTime(seconds: float) -> str:
+    """和 YouTube 一样的 H:MM:SS.f"""
+    tenths = int(round(seconds * 10))
+    s, f = divmod(tenths, 10)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}.{f}"
+
+
+def Generate(
+    count: int = 1000,
+    styles: Optional[Dict[str, float]] = None,
+    types: Optional[Dict[str, float]] = None,
+    duration: float = 600.0,
+    distribution: str = "uniform",
+    textLength: int = 40,
+    malformed: float = 0.0,
+    seed: int = 255,
+) -> bytes:
+    """生成一个 Annotation 文件
+
+    styles, types 是权重, distribution 是 "uniform" 或者 "burst"(集中在少数几个时间点),
+    textLength 是平均文本长度, malformed 是坏元素的比例
+    """
+    r = random.Random(seed)
+    if styles == None:
+        styles = {style: 1.0 for style in STYLES}
+    if types == None:
+        types = {"text": 1.0}
+    style_names = list(styles)  # type: ignore
+    style_weights = [styles[name] for name in style_names]  # type: ignore
+    type_names = list(types)  # type: ignore
+    type_weights = [types[name] for name in type_names]  # type: ignore
+    bursts = [r.uniform(0, duration) for __ in range(max(1, count // 500))]
+
+    lines = ['<?xml version="1.0" encoding="UTF-8" ?><document><annotations>']
+    for i in range(count):
+        style = r.choices(style_names, style_weights)[0]
+        annotation_type = r.choices(type_names, type_weights)[0]
+        broken = r.random() < malformed
+        kind = r.choice(MALFORMED) if broken else ""
+        # highlightText 没有时间时 Parse 会认为它一直显示, 还是得有 rectRegion
+        if kind == "no-region" and style == "highlightText":
+            kind = "no-moving-region"
+
+        if distribution == "burst":
+            start = min(duration, max(0.0, r.gauss(r.choice(bursts), 2.0)))
+        else:
+            start = r.uniform(0, duration)
+        end = start + r.uniform(0.5, 30.0)
+        t1, t2 = FormatTime(start), FormatTime(end)
+        if kind == "never":
+            t2 = "never"
+
+        x = r.uniform(0, 100)
+        y = r.uniform(0, 100)
+        w = r.uniform(1, 100 - x) if x < 99 else 1.0
+        h = r.uniform(1, 100 - y) if y < 99 else 1.0
+        region = f'x="{x:.3f}" y="{y:.3f}" w="{w:.3f}" h="{h:.3f}"'
+        if style == "speech":
+            # 气泡的尖角可以离框很远
+            sx = r.uniform(-50, 150)
+            sy = r.uniform(-50, 150)
+            region += f' sx="{sx:.3f}" sy="{sy:.3f}"'
+
+        attributes = f'id="annotation_{i}" author="author{r.randrange(100)}"'
+        if kind == "no-type":
+            pass
+        elif kind == "unsupported-type":
+            attributes += ' type="pause"'
+        else:
+            attributes += f' type="{annotation_type}"'
+        if kind != "no-style":
+            attributes += f' style="{style}"'
+
+        length = max(0, int(r.expovariate(1 / textLength))) if textLength > 0 else 0
+        text = "".join(r.choice(CHARS) for __ in range(length))
+
+        lines.append(f"<annotation {attributes}>")
+        if text != "":
+            lines.append(f"<TEXT>{escape(text)}</TEXT>")
+        lines.append("<segment>")
+        if kind != "no-moving-region":
+            region_type = "anchored" if style in ("speech", "anchored") else "rect"
+            lines.append(f'<movingRegion type="{region_type}">')
+            if kind != "no-region":
+                name = f"{region_type}Region"
+                lines.append(f"<{name} {region} t={quoteattr(t1)}/>")
+                lines.append(f"<{name} {region} t={quoteattr(t2)}/>")
+            lines.append("</movingRegion>")
+        lines.append("</segment>")
+        lines.append(
+            f'<appearance bgAlpha="{r.random():.3f}" bgColor="{r.randrange(1 << 24)}" '
+            f'fgColor="{r.randrange(1 << 24)}" textSize="{r.uniform(1, 10):.3f}"/>'
+        )
+        lines.append("</annotation>")
+    lines.append("</annotations></document>")
+    return "\n".join(lines).encode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成用于压力测试的 Annotation 文件")
+    parser.add_argument("--count", default=1000, type=int, help="Annotation 数量")
+    parser.add_argument(
+        "--styles", help="样式和权重, 比如 popup=2,speech=1, 默认所有样式一样多"
+    )
+    parser.add_argument(
+        "--types", default="text", help="类型和权重, 比如 text=9,branding=1"
+    )
+    parser.add_argument("--duration", default=600.0, type=float, help="视频长度(秒)")
+    parser.add_argument(
+        "--distribution",
+        default="uniform",
+        choices=["uniform", "burst"],
+        help="时间分布, burst 会让注释集中在少数几个时间点",
+    )
+    parser.add_argument("--text-length", default=40, type=int, help="平均文本长度")
+    parser.add_argument("--malformed", default=0.0, type=float, help="坏元素的比例")
+    parser.add_argument("--seed", default=255, type=int, help="随机数种子")
+    parser.add_argument("-o", "--output", default="-", help="输出文件, 默认为标准输出")
+    args = parser.parse_args(argv)
+
+    data = Generate(
+        args.count,
+        None if args.styles == None else ParseWeights(args.styles, STYLES),
+        ParseWeights(args.types, TYPES),
+        args.duration,
+        args.distribution,
+        args.text_length,
+        args.malformed,
+        args.seed,
+    )
+    if args.output == "-":
+        sys.stdout.buffer.write(data)
+    else:
+        with open(args.output, "wb") as f:
+            f.write(data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-
+import io
+import os
+import xml.etree.ElementTree
 from xml.etree.ElementTree import Element
 
 import pytest
 
 from Annotations2Sub import Annotation
 
+baseline_path = os.path.join(os.path.dirname(__file__), "testCase", "Baseline")
+
 
 def test_ParseAnnotationAlpha():
     def f(x):
@@ -46,3 +50,51 @@ def test_MakeSureElement():
     with pytest.raises(TypeError):
         Annotation.Parse(Element(""))  # type: ignore
     m.undo()
+
+
+def test_IterParse():
+    for name in ("29-q7YnyUmY.xml.test", "e8kKeUuytqA.xml.test", "annotation.xml.test"):
+        path = os.path.join(baseline_path, name)
+        tree = xml.etree.ElementTree.parse(path).getroot()
+        expected = [(i.id, i.timeStart, i.text) for i in Annotation.Parse(tree)]
+        with open(path, "rb") as f:
+            actual = [(i.id, i.timeStart, i.text) for i in Annotation.IterParse(f)]
+        assert actual == expected
+        assert [i.id for i in Annotation.IterParse(path)] == [i[0] for i in expected]
+
+        # 跳过的原因和 Parse 记的一样
+        expected_metrics: dict = {}
+        Annotation.Parse(tree, expected_metrics)
+        metrics: dict = {}
+        list(Annotation.IterParse(path, metrics))
+        assert metrics == expected_metrics
+
+    for document in (b"<document/>", b"<document><a><annotations/></a></document>"):
+        with pytest.raises(Annotation.NotAnnotationError):
+            list(Annotation.IterParse(io.BytesIO(document)))
+
+
+def test_ParseTime():
+    assert Annotation.ParseTime("0:00:12.5") == 12500
+    assert Annotation.ParseTime("1:02.25") == 62250
+    assert Annotation.ParseTime("1:00:00.123456") == 3600123
+    assert Annotation.ParseTime("0:03") == 3000
+    for i in ("", "12.5", "never", "0:0a:00.0", "0:00:-1.0", "1:2:3:4"):
+        with pytest.raises(ValueError):
+            Annotation.ParseTime(i)
+
+
+def test_ParseMetrics():
+    path = os.path.join(baseline_path, "annotation.xml.test")
+    tree = xml.etree.ElementTree.parse(path).getroot()
+    metrics: dict = {}
+    annotations = Annotation.Parse(tree, metrics)
+    assert metrics["annotations"] == 18
+    assert len(annotations) == 18 - 6
+    assert metrics["skipped"] == {
+        "never": 2,
+        "unsupported_type": 1,
+        "no_style": 1,
+        "no_moving_region": 1,
+        "no_time": 1,
+    }
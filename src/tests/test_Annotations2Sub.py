@@ -3,12 +3,17 @@
 
 import os
 import xml.etree.ElementTree
+from xml.etree.ElementTree import ParseError
 
-from Annotations2Sub.Annotation import Parse
-from Annotations2Sub.Convert import Convert
+import defusedxml.ElementTree  # type: ignore
+import pytest
+
+from Annotations2Sub.Annotation import NotAnnotationError, Parse
+from Annotations2Sub.Convert import Convert, StringToAss
 from Annotations2Sub.Sub import Sub
 
 filePath = os.path.join(os.path.dirname(__file__), "testCase", "annotation.xml.test")
+baselinePath = os.path.join(os.path.dirname(__file__), "testCase", "Baseline")
 
 
 def test_Annotations2Sub():
@@ -22,3 +27,51 @@ def test_Annotations2Sub():
     subtitle.info["PlayResX"] = "100"
     subtitle.info["PlayResY"] = "100"
     subtitle.Dump()
+
+
+def test_StringToAss():
+    with open(os.path.join(baselinePath, "annotation.xml.test"), "rb") as f:
+        string = f.read()
+    with open(os.path.join(baselinePath, "annotation.ass.test"), encoding="utf-8") as f:
+        expected = f.read()
+    for i in (string, string.decode("utf-8")):
+        ass = StringToAss(i, font="Microsoft YaHei", title="annotation.xml.test")
+        assert ass == expected
+
+    # 边读边解析, 不建整棵 XML 树
+    m = pytest.MonkeyPatch()
+    m.setattr(defusedxml.ElementTree, "fromstring", None)
+    assert (
+        StringToAss(string, font="Microsoft YaHei", title="annotation.xml.test")
+        == expected
+    )
+    m.undo()
+
+    with pytest.raises(ParseError):
+        StringToAss(b"annotation")
+    with pytest.raises(NotAnnotationError):
+        StringToAss(b"<document></document>")
+    # 是 Annotation 文件, 只是内容有误
+    broken = string.replace(b'x="', b'x="abc', 1)
+    with pytest.raises(ValueError) as e:
+        StringToAss(broken)
+    assert not isinstance(e.value, NotAnnotationError)
+    # 缺了必需的元素或属性也是内容有误
+    for broken in MalformedAnnotations(string):
+        with pytest.raises(ValueError) as e:
+            StringToAss(broken)
+        assert not isinstance(e.value, NotAnnotationError)
+
+
+def MalformedAnnotations(string: bytes) -> list:
+    """缺了 segment, t, x 和没有区域的 highlightText"""
+    return [
+        string.replace(b"<segment>", b"<segment2>", 1).replace(
+            b"</segment>", b"</segment2>", 1
+        ),
+        string.replace(b' t="', b' t2="', 1),
+        string.replace(b' x="', b' x2="', 1),
+        b'<document><annotations><annotation id="1" type="highlight" '
+        b'style="highlightText"><segment><movingRegion type="rect"/>'
+        b"</segment></annotation></annotations></document>",
+    ]
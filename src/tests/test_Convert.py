@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from Annotations2Sub import Convert
+from Annotations2Sub.Annotation import Annotation, AnnotationBatch
+
+
+def RandomBatch() -> AnnotationBatch:
+    r = random.Random(255)
+    annotations = []
+    for __ in range(2000):
+        annotation = Annotation()
+        annotation.x = round(r.uniform(0, 100), r.randint(0, 6))
+        annotation.y = round(r.uniform(0, 100), r.randint(0, 6))
+        annotation.width = r.choice([2.675, 0.0005, 1.0005, r.uniform(0, 100)])
+        annotation.height = r.uniform(0, 100)
+        annotation.sx = r.uniform(0, 100)
+        annotation.sy = r.uniform(0, 100)
+        annotation.textSize = r.uniform(0, 10)
+        annotations.append(annotation)
+    return AnnotationBatch(annotations)
+
+
+@pytest.mark.parametrize(
+    "options", [(False, 100, 100), (True, 100, 100), (True, 1920, 1080)]
+)
+def test_TransformGeometry(options):
+    pytest.importorskip("numpy")
+    batch = RandomBatch()
+
+    vectorized = Convert.TransformGeometry(batch, *options)
+    m = pytest.MonkeyPatch()
+    m.setattr(Convert, "numpy", None)
+    expected = Convert.TransformGeometry(batch, *options)
+    m.undo()
+
+    for name in Convert.Geometry.__slots__:
+        assert getattr(vectorized, name) == getattr(expected, name), name
+        assert all(type(i) is float for i in getattr(vectorized, name))
+
+
+def test_DumpColorAlpha():
+    from Annotations2Sub.Color import Alpha, Color
+
+    for i in range(256):
+        color = Color(i, 255 - i, i // 2)
+        assert Convert.DumpColor(color) == "&H{:02X}{:02X}{:02X}&".format(
+            i, 255 - i, i // 2
+        )
+        assert Convert.DumpAlpha(Alpha(i)) == "&H{:02X}&".format(255 - i)
+    # 超出范围的不查表
+    assert Convert.DumpAlpha(Alpha(-1)) == "&H100&"
+    # 负数不能拿去查表, 否则会从末尾取
+    assert Convert.DumpColor(Color(255, 255, -1)) == "&HFFFF-1&"
+    from Annotations2Sub.Annotation import ParseAnnotationColor
+
+    assert Convert.DumpColor(ParseAnnotationColor("-1")) == "&HFFFF-1&"
+
+
+def test_ConvertStyles():
+    annotation = Annotation()
+    annotation.style = "bubble"
+    annotation.id = "1"
+    annotation.text = "{a}\nb"
+
+    # 没注册的样式跳过
+    metrics: dict = {}
+    assert Convert.Convert([annotation], metrics=metrics) == []
+    assert metrics["skipped"]["unsupported_style"] == 1
+
+    m = pytest.MonkeyPatch()
+    m.setitem(
+        Convert.STYLES, "bubble", [("bubble_text;", "Text"), ("bubble_box;", "Box")]
+    )
+    events = Convert.Convert([annotation], True, metrics=metrics)
+    m.undo()
+    assert [event.Name for event in events] == [";1;bubble_text;", ";1;bubble_box;"]
+    assert [event.Layer for event in events] == [1, 0]
+    assert events[0].Text.endswith(r"\{a\}\Nb")
+    assert metrics["events"] == {"bubble": 2}
+
+
+def test_Drawing():
+    from Annotations2Sub.Sub import Draw, DrawCommand
+
+    for width, height in [(1.5, 2.0), (0.0, 3.25), (-0.0, 1.0), (2, 2.0)]:
+        d = Draw()
+        d.Add(DrawCommand(0, 0, "m"))
+        d.Add(DrawCommand(width, 0, "l"))
+        d.Add(DrawCommand(width, height, "l"))
+        d.Add(DrawCommand(0, height, "l"))
+        expected = r"{\p1}" + d.Dump() + r"{\p0}"
+        assert Convert.BoxDrawing(width, height) == expected
+        assert Convert.CachedBoxDrawing(width, height) == expected
+
+        d = Draw()
+        d.Add(DrawCommand(0, 0, "m"))
+        d.Add(DrawCommand(width, height, "l"))
+        d.Add(DrawCommand(height, height, "l"))
+        expected = r"{\p1}" + d.Dump() + r"{\p0}"
+        assert Convert.TriangleDrawing(width, height, height) == expected
+
+    # 缓存里的 0.0 不能拿来当 -0.0 用
+    annotations = []
+    for width in (0.0, -0.0):
+        annotation = Annotation()
+        annotation.width = width
+        annotations.append(annotation)
+    events = Convert.Convert(annotations)
+    assert "l 0.0 0 " in events[1].Text
+    assert "l -0.0 0 " in events[3].Text
+
+
+def test_SharedStyles():
+    import os
+
+    from Annotations2Sub.Convert import StringToSub
+
+    path = os.path.join(
+        os.path.dirname(__file__), "testCase", "Baseline", "annotation.xml.test"
+    )
+    with open(path, "rb") as f:
+        data = f.read()
+    inline = StringToSub(data, font="Font")
+    shared = StringToSub(data, font="Font", sharedStyles=True)
+    assert len(inline.events) == len(shared.events)
+    assert len(shared.styles) > 1
+    assert {style.Fontname for style in shared.styles.values()} == {"Font"}
+
+    for a, b in zip(inline.events, shared.events):
+        assert (a.Start, a.End, a.Layer, a.Name) == (b.Start, b.End, b.Layer, b.Name)
+        assert b.Style in shared.styles
+        style = shared.styles[b.Style]
+        assert style.Alignment == 7
+        assert style.OutlineColour.alpha == 255
+        # 只剩下位置和绘图
+        tag, __, text = b.Text.partition("}")
+        assert tag.startswith(r"{\pos(") and "\\" not in tag[2:]
+        assert a.Text.endswith(text)
+        assert rf"\an7\{tag[2:]}" in a.Text
+        if "fs" in a.Text:
+            assert rf"\fs{style.Fontsize}\c" in a.Text
+        else:
+            transparency = "{:02X}".format(style.PrimaryColour.alpha)
+            assert rf"\1a&H{transparency}&" in a.Text
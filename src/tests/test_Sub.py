@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 
 
+import copy
+import io
+
 import pytest
 
-from Annotations2Sub.Sub import Draw, DrawCommand
+from Annotations2Sub.Sub import Draw, DrawCommand, Event, Sub
 
 
 def test_DrawDump():
@@ -15,3 +18,40 @@ def test_DrawDump():
     with pytest.raises(TypeError):
         draw = Draw()
         draw.Add(1)  # type: ignore
+
+
+def test_EventsDump():
+    event = Event()
+    event.Start = 12500
+    event.End = 3600123
+    subtitle = Sub()
+    subtitle.events.append(event)
+    assert "Dialogue: 0,00:00:12.50,01:00:00.12,Default," in subtitle.Dump()
+
+
+def test_EventCopy():
+    event = Event()
+    event.Name = "a;"
+    event.Start = 1
+    event2 = copy.copy(event)
+    assert event2 is not event
+    assert (event2.Name, event2.Start, event2.Text) == ("a;", 1, "")
+    assert not hasattr(event, "__dict__")
+
+
+def test_DumpTo():
+    subtitle = Sub()
+    for i in range(100):
+        event = Event()
+        event.Start = i
+        event.Text = "文本" * i
+        subtitle.events.append(event)
+    string = subtitle.Dump()
+
+    text = io.StringIO()
+    subtitle.DumpTo(text, chunkSize=100)
+    assert text.getvalue() == string
+
+    binary = io.BytesIO()
+    subtitle.DumpTo(binary)
+    assert binary.getvalue() == string.encode("utf-8")
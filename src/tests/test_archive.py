@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sqlite3
+import tarfile
+
+import pytest
+
+from Annotations2Sub.archive import (
+    AnnotationsFromLocalArchive,
+    ArchiveLocation,
+    BuildIndex,
+    CoalesceRanges,
+    IndexLookup,
+    ReadIndexed,
+    ReadTarMember,
+    TarMembers,
+)
+
+baseline_path = os.path.join(os.path.dirname(__file__), "testCase", "Baseline")
+baseline1_file = os.path.join(baseline_path, "29-q7YnyUmY.xml.test")
+
+
+def MakeTar(path: str, members: dict, format=tarfile.GNU_FORMAT):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path, "w", format=format) as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_ArchiveLocation():
+    assert ArchiveLocation("29-q7YnyUmY") == (
+        "youtubeannotations_54",
+        "29.tar",
+        "29-/29-q7YnyUmY.xml",
+    )
+    assert ArchiveLocation("-9-q7YnyUmY")[0] == "youtubeannotations_64"
+    with pytest.raises(ValueError):
+        ArchiveLocation("")
+
+
+@pytest.mark.parametrize(
+    "format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT, tarfile.USTAR_FORMAT]
+)
+def test_TarMembers(tmp_path, format):
+    long_name = "a" * 120 + "/" + "b" * 80 + ".xml"
+    members = {
+        "29-/29-q7YnyUmY.xml": b"1",
+        "29-/29-q7YnyUm1.xml": b"2" * 1000,
+        "29-/29-q7YnyUm2.xml": b"",
+    }
+    if format != tarfile.USTAR_FORMAT:
+        members[long_name] = b"3"
+    path = str(tmp_path / "29.tar")
+    MakeTar(path, members, format)
+
+    with open(path, "rb") as f:
+        buffer = f.read()
+    names = {}
+    for name, offset, size in TarMembers(buffer):
+        names[name] = buffer[offset : offset + size]
+    assert names == members
+    assert ReadTarMember(path, "29-/29-q7YnyUm1.xml") == b"2" * 1000
+    assert ReadTarMember(path, "29-/29-q7YnyUm3.xml") == None
+
+
+def test_TarMembersCorrupt(tmp_path):
+    path = str(tmp_path / "29.tar")
+    with open(path, "wb") as f:
+        f.write(bytes(range(256)) * 8)
+    with pytest.raises(ValueError):
+        ReadTarMember(path, "29-/29-q7YnyUmY.xml")
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUmY") == None
+
+    # 截断的文件不能读出半个
+    MakeTar(path, {"29-/29-q7YnyUmY.xml": b"1" * 1000})
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[: 512 + 600])
+    with pytest.raises(ValueError):
+        ReadTarMember(path, "29-/29-q7YnyUmY.xml")
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUmY") == None
+    assert BuildIndex(str(tmp_path), str(tmp_path / "index.sqlite")) == 0
+
+
+def test_AnnotationsFromLocalArchive(tmp_path):
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+    MakeTar(
+        str(tmp_path / "youtubeannotations_54" / "29.tar"),
+        {"29/29-/29-q7YnyUmY.xml": data},
+    )
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUmY") == data
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUm1") == None
+    assert AnnotationsFromLocalArchive(str(tmp_path), "e8kKeUuytqA") == None
+
+
+def test_BuildIndex(tmp_path):
+    archive = tmp_path / "archive"
+    index = str(tmp_path / "index.sqlite")
+    MakeTar(
+        str(archive / "youtubeannotations_54" / "29.tar"),
+        {"29-/29-q7YnyUmY.xml": b"1" * 600, "29-/29-q7YnyUm1.xml": b"2"},
+    )
+    MakeTar(str(archive / "e8.tar"), {"e8k/e8kKeUuytqA.xml": b"3"})
+    assert BuildIndex(str(archive), index) == 3
+    # 重复建立不会重复记录
+    assert BuildIndex(str(archive), index) == 3
+
+    assert ReadIndexed(str(archive), index, "29-q7YnyUmY") == (True, b"1" * 600)
+    assert ReadIndexed(str(archive), index, "e8kKeUuytqA") == (True, b"3")
+    assert ReadIndexed(str(archive), index, "29-q7YnyUm2") == (False, None)
+    assert AnnotationsFromLocalArchive(str(archive), "29-q7YnyUm1", index) == b"2"
+
+    # tar 被换了, 校验不过就回去扫 tar
+    MakeTar(
+        str(archive / "youtubeannotations_54" / "29.tar"),
+        {"29-/29-q7YnyUm1.xml": b"4", "29-/29-q7YnyUmY.xml": b"5"},
+    )
+    assert ReadIndexed(str(archive), index, "29-q7YnyUmY") == (True, None)
+    assert AnnotationsFromLocalArchive(str(archive), "29-q7YnyUmY", index) == b"5"
+
+
+def test_CoalesceRanges():
+    members = [("c", 5000, 10), ("a", 0, 100), ("b", 600, 100)]
+    assert CoalesceRanges(members, gap=1024) == [
+        (0, 700, [("a", 0, 100), ("b", 600, 100)]),
+        (5000, 5010, [("c", 5000, 10)]),
+    ]
+    assert len(CoalesceRanges(members, gap=1024 * 1024)) == 1
+    assert len(CoalesceRanges(members, gap=1024 * 1024, limit=1000)) == 2
+    assert CoalesceRanges([]) == []
+
+
+def test_IndexLookup(tmp_path):
+    MakeTar(str(tmp_path / "29.tar"), {"29-/29-q7YnyUmY.xml": b"1"})
+    index = str(tmp_path / "index.sqlite")
+    BuildIndex(str(tmp_path), index)
+    located = IndexLookup(index, ["29-q7YnyUmY", "29-q7YnyUm1"])
+    assert list(located) == ["29-q7YnyUmY"]
+    assert located["29-q7YnyUmY"][0] == "29.tar"
+    assert located["29-q7YnyUmY"][2] == 1
+
+
+def test_IndexMissing(tmp_path):
+    MakeTar(str(tmp_path / "29.tar"), {"29-/29-q7YnyUmY.xml": b"1"})
+    # 没有索引时不会建一个空的出来, 当作没有索引
+    index = str(tmp_path / "missing.sqlite")
+    with pytest.raises(sqlite3.Error):
+        ReadIndexed(str(tmp_path), index, "29-q7YnyUmY")
+    assert IndexLookup(index, ["29-q7YnyUmY"]) == {}
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUmY", index) == b"1"
+    assert not os.path.exists(index)
+
+    # 有文件但是没建过索引
+    index = str(tmp_path / "empty.sqlite")
+    sqlite3.connect(index).close()
+    assert IndexLookup(index, ["29-q7YnyUmY"]) == {}
+    assert AnnotationsFromLocalArchive(str(tmp_path), "29-q7YnyUmY", index) == b"1"
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+from Annotations2Sub.utils import Flags
+from tests import benchmark
+
+
+def test_benchmark(tmp_path):
+    path = str(tmp_path / "benchmark.json")
+    try:
+        assert benchmark.main(["--sizes", "3", "--repeat", "1", "--json", path]) == 0
+    finally:
+        Flags.verbose = True
+    with open(path, encoding="utf-8") as f:
+        results = json.load(f)
+    stages = {result["stage"] for result in results}
+    assert stages == {"Parse", "Convert", "Sub.Dump", "Format"}
+    assert len(results) == len(benchmark.STYLES) * (2 + len(benchmark.OPTIONS)) + 2
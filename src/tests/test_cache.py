@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+from Annotations2Sub.cache import Cache
+
+
+def test_Cache(tmp_path):
+    cache = Cache(str(tmp_path))
+    assert cache.Get("29-q7YnyUmY") == None
+    cache.Put("29-q7YnyUmY", b"1")
+    cache.Put("29-Q7YNYUMY", b"2")
+    assert cache.Get("29-q7YnyUmY") == b"1"
+    assert cache.Get("29-Q7YNYUMY") == b"2"
+
+    # 内容和校验和对不上就当没有
+    with open(cache.Path("29-q7YnyUmY"), "wb") as f:
+        f.write(b"3")
+    assert cache.Get("29-q7YnyUmY") == None
+    assert not os.path.exists(cache.Path("29-q7YnyUmY"))
+    assert cache.size == 1
+
+
+def test_CacheRace(tmp_path):
+    """校验不过时, 拿到锁之前别的线程刚好写好了新的, 不能删"""
+    cache = Cache(str(tmp_path))
+    cache.Put("29-q7YnyUmY", b"1")
+    path = cache.Path("29-q7YnyUmY")
+    with open(path, "wb") as f:
+        f.write(b"2")
+    lock = cache.lock
+
+    class PutBeforeLock:
+        def __enter__(self):
+            # 模拟另一个线程的 Put 刚刚做完
+            with open(path, "wb") as f:
+                f.write(b"3")
+            with open(path + ".sha256", "w", encoding="utf-8") as f:
+                f.write(hashlib.sha256(b"3").hexdigest())
+            return lock.__enter__()
+
+        def __exit__(self, *args):
+            return lock.__exit__(*args)
+
+    cache.lock = PutBeforeLock()  # type: ignore
+    assert cache.Get("29-q7YnyUmY") == b"3"
+    assert os.path.exists(path)
+    assert cache.size == 1
+
+
+def test_CacheEvict(tmp_path):
+    cache = Cache(str(tmp_path), 25)
+    for i, videoId in enumerate(["aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc"]):
+        cache.Put(videoId, b"0123456789")
+        os.utime(cache.Path(videoId), (i, i))
+    assert cache.size == 30 - 10
+
+    # 新打开的缓存也要算上已有的文件
+    cache = Cache(str(tmp_path), 25)
+    os.utime(cache.Path("bbbbbbbbbbb"), (10, 10))
+    cache.Put("ddddddddddd", b"0123456789")
+    assert cache.Get("aaaaaaaaaaa") == None
+    assert cache.Get("bbbbbbbbbbb") == b"0123456789"
+    assert cache.Get("ccccccccccc") == None
+    assert cache.Get("ddddddddddd") == b"0123456789"
+
+    cache.Put("eeeeeeeeeee", b"0" * 26)
+    assert cache.Get("eeeeeeeeeee") == None
@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import http.server
+import io
+import json
 import os
+import pstats
+import subprocess
+import sys
+import tarfile
+import threading
 import urllib.request
 from urllib.error import URLError
 
@@ -102,8 +110,8 @@ def test_cli3():
         code = run(argv)
         assert code == 0
 
-    with pytest.raises(Exception):
-        run(f"-g {baseline1_video_id} -i 1".split(" "))
+    # 处理一项时出的意外只算这一项失败
+    assert run(f"-g {baseline1_video_id} -i 1".split(" ")) == 1
 
     with pytest.raises(Exception):
         mock("")
@@ -154,3 +162,547 @@ def test_cli6():
         run()
 
     m.undo()
+
+
+def test_cli_jobs():
+    baselines = ["29-q7YnyUmY", "e8kKeUuytqA", "annotation"]
+    queue = [os.path.join(baseline_path, f"{i}.xml.test") for i in baselines]
+    assert run(queue + ["-j", "2", "-O", "."]) == 0
+    for i in baselines:
+        with open(os.path.join(baseline_path, f"{i}.ass.test"), encoding="utf-8") as f:
+            expected = f.read()
+        with open(f"{i}.xml.test.ass", encoding="utf-8") as f:
+            assert f.read() == expected
+
+    assert run([baseline1_file, empty_xml, "-j", "0", "-O", "."]) == 1
+
+
+def test_cli_malformed(tmp_path, capsys):
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+    with open(tmp_path / "1.xml", "wb") as f:
+        f.write(data.replace(b'x="', b'x="abc', 1))
+    with open(tmp_path / "2.xml", "wb") as f:
+        f.write(b"<document></document>")
+    capsys.readouterr()
+    assert run([str(tmp_path / "1.xml"), "-O", str(tmp_path)]) == 1
+    assert "Annotation 有误" in capsys.readouterr().err
+    assert run([str(tmp_path / "2.xml"), "-O", str(tmp_path)]) == 1
+    assert "不是 Annotation 文件" in capsys.readouterr().err
+    with open(tmp_path / "3.xml", "wb") as f:
+        f.write(data.replace(b' t="', b' t2="', 1))
+    assert run([str(tmp_path / "3.xml"), "-O", str(tmp_path)]) == 1
+    assert "Annotation 有误" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cli_jobs_error(tmp_path, jobs):
+    """一个文件出意外不影响后面的文件, 不管几个进程"""
+    output = tmp_path / "output"
+    output.mkdir()
+    queue = []
+    for name in ("a.xml", "b.xml"):
+        with open(baseline1_file, "rb") as f, open(tmp_path / name, "wb") as g:
+            g.write(f.read())
+        queue.append(str(tmp_path / name))
+    # 输出的位置是个文件夹, 写不进去
+    (output / "a.xml.ass").mkdir()
+    assert run(queue + ["-j", jobs, "-O", str(output)]) == 1
+    assert os.path.getsize(output / "b.xml.ass") > 0
+
+
+def test_cli_download():
+    with open(baseline1_file, encoding="utf-8") as f:
+        baseline1_string = f.read()
+
+    def mock(url: str):
+        if url.endswith("/e8kKeUuytqA.xml"):
+            raise URLError("")
+        return baseline1_string
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "GetUrl", mock)
+    m.setattr(cli, "CheckUrl", lambda: True)
+    queue = ["29-q7YnyUmY", "e8kKeUuytqA", "29-q7YnyUm1", "29-q7YnyUm2"]
+    assert run(["-D", "--download-jobs", "3", "-O", "."] + queue) == 1
+    for i in ("29-q7YnyUmY", "29-q7YnyUm1", "29-q7YnyUm2"):
+        with open(f"{i}.xml", encoding="utf-8") as f:
+            assert f.read() == baseline1_string
+    assert not os.path.exists("e8kKeUuytqA.xml")
+    m.undo()
+
+
+def test_cli_download_error(tmp_path):
+    """下载时出了意外也只算这一项失败"""
+
+    def mock(url: str):
+        if url.endswith("/e8kKeUuytqA.xml"):
+            b"\xff".decode("utf-8")
+        return url.rpartition("/")[2]
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "GetUrl", mock)
+    m.setattr(cli, "CheckUrl", lambda: True)
+    queue = ["29-q7YnyUmY", "e8kKeUuytqA", "29-q7YnyUm1"]
+    for jobs in ("1", "3"):
+        argv = ["-D", "--download-jobs", jobs, "-O", str(tmp_path)]
+        assert run(argv + queue) == 1
+        for i in ("29-q7YnyUmY", "29-q7YnyUm1"):
+            with open(tmp_path / f"{i}.xml", encoding="utf-8") as f:
+                assert f.read() == f"{i}.xml"
+        assert not os.path.exists(tmp_path / "e8kKeUuytqA.xml")
+    m.undo()
+
+
+def test_cli_cache(tmp_path):
+    with open(baseline1_file, encoding="utf-8") as f:
+        baseline1_string = f.read()
+    urls = []
+
+    def mock(url: str):
+        urls.append(url)
+        return baseline1_string
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "GetUrl", mock)
+    m.setattr(cli, "CheckUrl", lambda: True)
+    argv = ["-d", "--cache-dir", str(tmp_path), "-O", ".", baseline1_video_id]
+    assert run(argv) == 0
+    assert run(argv + ["-l"]) == 0
+    assert len(urls) == 1
+    m.undo()
+
+
+def test_cli_archive(tmp_path):
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+    os.makedirs(tmp_path / "youtubeannotations_54")
+    with tarfile.open(tmp_path / "youtubeannotations_54" / "29.tar", "w") as tar:
+        info = tarfile.TarInfo("29-/29-q7YnyUmY.xml")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "GetUrl", None)
+    argv = ["-d", "--archive-dir", str(tmp_path), "-O", str(tmp_path)]
+    assert run(argv + [baseline1_video_id]) == 0
+    with open(tmp_path / "29-q7YnyUmY.xml", "rb") as f:
+        assert f.read() == data
+    assert run(argv + [baseline2_video_id]) == 1
+
+    # 坏掉的 tar 只算这几个视频 ID 失败
+    with open(tmp_path / "youtubeannotations_54" / "29.tar", "wb") as f:
+        f.write(bytes(range(256)) * 8)
+    assert run(argv + [baseline1_video_id, baseline2_video_id]) == 1
+    m.undo()
+
+
+def test_cli_archive_index(tmp_path):
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+    archive = tmp_path / "archive"
+    os.makedirs(archive)
+    with tarfile.open(archive / "29.tar", "w") as tar:
+        info = tarfile.TarInfo("29-/29-q7YnyUmY.xml")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    index = str(tmp_path / "index.sqlite")
+
+    assert run(["--build-archive-index", "--archive-dir", str(archive)]) == 1
+    argv = ["--archive-dir", str(archive), "--archive-index", index]
+    assert run(argv + ["--build-archive-index"]) == 0
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "GetUrl", None)
+    argv += ["-d", "-O", str(tmp_path)]
+    assert run(argv + [baseline1_video_id]) == 0
+    with open(tmp_path / "29-q7YnyUmY.xml", "rb") as f:
+        assert f.read() == data
+    assert run(argv + [baseline2_video_id]) == 1
+
+    # 索引不存在时直接报错, 也不会留下一个空的索引
+    missing = str(tmp_path / "missing.sqlite")
+    argv = ["-d", "--archive-dir", str(archive), "--archive-index", missing]
+    assert run(argv + ["-O", str(tmp_path), baseline1_video_id]) == 1
+    assert not os.path.exists(missing)
+
+    # 没建过的索引当作没有索引, 去扫 tar
+    empty = tmp_path / "empty.sqlite"
+    empty.touch()
+    argv = ["-d", "--archive-dir", str(archive), "--archive-index", str(empty)]
+    os.remove(tmp_path / "29-q7YnyUmY.xml")
+    assert run(argv + ["-O", str(tmp_path), baseline1_video_id]) == 0
+    with open(tmp_path / "29-q7YnyUmY.xml", "rb") as f:
+        assert f.read() == data
+    m.undo()
+
+
+def test_cli_shard(tmp_path):
+    queue = ["29-q7YnyUmY", "29-q7YnyUm1", "29-q7YnyUm2", "e8kKeUuytqA"]
+    archive = tmp_path / "archive"
+    os.makedirs(archive / "youtubeannotations_54")
+    with tarfile.open(archive / "youtubeannotations_54" / "29.tar", "w") as tar:
+        for video_id in queue[:3]:
+            data = video_id.encode("utf-8")
+            info = tarfile.TarInfo(f"29-/{video_id}.xml")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    with open(archive / "youtubeannotations_54" / "29.tar", "rb") as f:
+        tar_data = f.read()
+    index = str(tmp_path / "index.sqlite")
+    assert (
+        run(
+            [
+                "--build-archive-index",
+                "--archive-dir",
+                str(archive),
+                "--archive-index",
+                index,
+            ]
+        )
+        == 0
+    )
+
+    ranges = []
+    # 为 False 时假装不支持 Range, 返回整个 tar
+    honour_range = [True]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/download/youtubeannotations_54/29.tar":
+                self.send_error(404)
+                return
+            start, end = self.headers["Range"][len("bytes=") :].split("-")
+            ranges.append((int(start), int(end)))
+            if not honour_range[0]:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(tar_data)))
+                self.end_headers()
+                self.wfile.write(tar_data)
+                return
+            body = tar_data[int(start) : int(end) + 1]
+            self.send_response(206)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(tar_data)}")
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    m = pytest.MonkeyPatch()
+    m.setattr(cli, "ARCHIVE_URL", base)
+    m.setattr(cli, "GetUrl", lambda url: "e8kKeUuytqA")
+    m.setattr(cli, "CheckUrl", lambda: True)
+    argv = ["-D", "--archive-index", index, "-O", str(tmp_path)]
+    assert run(argv + queue) == 0
+    # 同一个 tar 里的三个文件只用了一次 Range 请求
+    assert len(ranges) == 1
+    for video_id in queue:
+        with open(tmp_path / f"{video_id}.xml", encoding="utf-8") as f:
+            assert f.read() == video_id
+
+    # 不支持 Range 的服务器, 不读整个 tar, 逐个下载
+    honour_range[0] = False
+    m.setattr(cli, "GetUrl", lambda url: url.rpartition("/")[2])
+    output = tmp_path / "output"
+    output.mkdir()
+    argv = ["-D", "--archive-index", index, "-O", str(output)]
+    assert run(argv + queue[:3]) == 0
+    assert len(ranges) == 2
+    for video_id in queue[:3]:
+        with open(output / f"{video_id}.xml", encoding="utf-8") as f:
+            assert f.read() == f"{video_id}.xml"
+    m.undo()
+    server.shutdown()
+    server.server_close()
+
+
+def test_cli_stats(tmp_path, capsys):
+    queue = [baseline1_file, baseline2_file]
+    path = str(tmp_path / "stats.json")
+    for jobs in ("1", "2"):
+        assert (
+            run(queue + ["-O", ".", "-j", jobs, "--stats", "--stats-json", path]) == 0
+        )
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        assert [each["file"] for each in data["files"]] == queue
+        for each in data["files"]:
+            assert set(each["stages"]) == set(cli.STAGES)
+        assert data["total"]["total"] >= data["files"][0]["stages"]["total"]
+    assert "convert" in capsys.readouterr().err
+
+
+def test_cli_profile(tmp_path):
+    path = str(tmp_path / "profile")
+    assert run([baseline1_file, "-O", ".", "-j", "2", "--profile", path]) == 0
+    stats = pstats.Stats(path)
+    assert any(function[2] == "Convert" for function in stats.stats)  # type: ignore
+
+
+def test_cli_metrics(tmp_path):
+    queue = [os.path.join(baseline_path, "annotation.xml.test"), empty_xml]
+    path = str(tmp_path / "metrics.jsonl")
+    for jobs in ("1", "2"):
+        assert run(queue + ["-O", ".", "-j", jobs, "--metrics", path]) == 1
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 4
+    assert lines[0] == dict(lines[2], elapsed=lines[0]["elapsed"])
+    metrics = lines[0]
+    assert metrics["file"] == queue[0]
+    assert metrics["code"] == 0
+    assert metrics["annotations"] == 18
+    assert metrics["skipped"]["never"] == 2
+    assert metrics["skipped"]["unsupported_style"] == 1
+    assert metrics["events"] == {
+        "popup": 8,
+        "title": 1,
+        "speech": 6,
+        "highlightText": 4,
+        "anchored": 2,
+        "label": 2,
+    }
+    assert metrics["bytes_in"] == os.path.getsize(queue[0])
+    assert metrics["bytes_out"] == os.path.getsize("annotation.xml.test.ass")
+    assert metrics["elapsed"] > 0
+    assert lines[1]["file"] == empty_xml
+    assert lines[1]["code"] == 1
+
+
+def PythonOutput(code: str) -> list:
+    """在新的解释器里运行, 返回标准输出的每一行"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(base_path)
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout.splitlines()
+
+
+def test_cli_import(tmp_path):
+    """只是导入 cli 不应该带上网络, JSON, XML, NumPy 这些模块, 也不应该加载翻译文件"""
+    code = """
+import sys, time
+start = time.perf_counter()
+import Annotations2Sub.cli
+from Annotations2Sub import utils
+print(time.perf_counter() - start)
+print(utils.translate is None)
+print(" ".join(sys.modules))
+"""
+    outputs = [PythonOutput(code) for __ in range(3)]
+    # 实测 40~60 毫秒, 取最快的一次, 免得被机器一时的卡顿影响
+    assert min(float(output[0]) for output in outputs) < 0.25
+    output = outputs[0]
+    assert output[1] == "True"
+    modules = output[2].split(" ")
+    for module in (
+        "urllib.request",
+        "http.client",
+        "json",
+        "defusedxml",
+        "xml.etree.ElementTree",
+        "concurrent.futures",
+        "sqlite3",
+        "numpy",
+        "Annotations2Sub.Convert",
+    ):
+        assert module not in modules, module
+
+    # 转换一个本地文件也用不上线程池, 进程池, JSON, 缓存和 Invidious
+    code = f"""
+import sys
+from Annotations2Sub.cli import run
+run([{baseline1_file!r}, "-o", {str(tmp_path / "1.ass")!r}])
+print(" ".join(sys.modules))
+"""
+    modules = PythonOutput(code)[-1].split(" ")
+    assert os.path.getsize(tmp_path / "1.ass") > 0
+    for module in (
+        "urllib.request",
+        "http.client",
+        "json",
+        "queue",
+        "concurrent.futures",
+        "sqlite3",
+        "Annotations2Sub.cache",
+        "Annotations2Sub.invidious",
+    ):
+        assert module not in modules, module
+
+
+def test_cli_watch(tmp_path):
+    from Annotations2Sub import watch
+
+    source = tmp_path / "source"
+    output = tmp_path / "output"
+    source.mkdir()
+    output.mkdir()
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+
+    # 启动前已经转换过的不再转换
+    old = str(source / "old.xml")
+    with open(old, "wb") as f:
+        f.write(data)
+    with open(output / "old.xml.ass", "w", encoding="utf-8") as f:
+        f.write("old")
+
+    stop = threading.Event()
+    batches = []
+    original = watch.Watch
+
+    def Watch(watcher, callback):
+        def Callback(files):
+            batches.append([os.path.basename(file) for file in files])
+            callback(files)
+            if len(batches) == 2:
+                stop.set()
+
+        original(watcher, Callback, 0.01, stop)
+
+    m = pytest.MonkeyPatch()
+    m.setattr(watch, "Watch", Watch)
+    argv = ["--watch", str(source), "--watch-debounce", "0", "-O", str(output)]
+    # 还没转换的照常转换
+    with open(source / "1.xml", "wb") as f:
+        f.write(data)
+    with open(source / "2.xml", "wb") as f:
+        f.write(data)
+    thread = threading.Thread(target=run, args=(argv,), daemon=True)
+    thread.start()
+
+    while len(batches) == 0 and thread.is_alive():
+        thread.join(0.01)
+    with open(source / "1.xml", "wb") as f:
+        f.write(b"<document></document>")
+    thread.join(10)
+    m.undo()
+
+    assert not thread.is_alive()
+    assert batches == [["1.xml", "2.xml"], ["1.xml"]]
+    with open(output / "old.xml.ass", encoding="utf-8") as f:
+        assert f.read() == "old"
+    assert os.path.getsize(output / "2.xml.ass") > 0
+
+    assert run(["--watch", str(source), "-o", "1.ass"]) == 1
+    assert run(["--watch", os.path.join(str(source), "1.xml")]) == 1
+
+
+def test_cli_manifest(tmp_path):
+    source = str(tmp_path / "1.xml")
+    output = str(tmp_path / "1.xml.ass")
+    manifest = str(tmp_path / "manifest.json")
+    with open(baseline1_file, "rb") as f:
+        data = f.read()
+    with open(source, "wb") as f:
+        f.write(data)
+
+    def Converted(argv=[]) -> bool:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write("old")
+        assert run([source, "--manifest", manifest] + argv) == 0
+        with open(output, encoding="utf-8") as f:
+            return f.read() != "old"
+
+    os.remove(source)
+    assert run([source, "--manifest", manifest]) == 1
+    with open(source, "wb") as f:
+        f.write(data)
+    assert Converted()
+    assert not Converted()
+
+    # 只改了修改时间
+    os.utime(source, ns=(1, 1))
+    assert not Converted()
+    with open(manifest, encoding="utf-8") as f:
+        assert json.load(f)["files"][os.path.abspath(source)]["mtime"] == 1
+
+    with open(source, "wb") as f:
+        f.write(data.replace(b"</document>", b"</document>\n"))
+    assert Converted()
+    assert not Converted()
+
+    assert Converted(["-x", "1920"])
+    assert not Converted(["-x", "1920"])
+    # --no-overwrite-files 没写出文件, 输出还是旧的, 不能记下来
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("stale")
+    assert run([source, "--manifest", manifest, "-n"]) == 0
+    assert Converted()
+
+    # 输出到别的地方
+    directory = tmp_path / "output"
+    directory.mkdir()
+    assert (
+        run([source, "--manifest", manifest, "-x", "1920", "-O", str(directory)]) == 0
+    )
+    assert os.path.exists(directory / "1.xml.ass")
+    os.remove(output)
+    assert run([source, "--manifest", manifest, "-x", "1920"]) == 0
+    assert os.path.exists(output)
+
+
+def test_cli_shared_styles(tmp_path):
+    output = str(tmp_path / "1.ass")
+    manifest = str(tmp_path / "manifest.json")
+    assert run([baseline1_file, "-o", output, "--manifest", manifest]) == 0
+    with open(output, encoding="utf-8") as f:
+        inline = f.read()
+    # 选项变了要重新转换
+    assert (
+        run([baseline1_file, "-o", output, "--manifest", manifest, "--shared-styles"])
+        == 0
+    )
+    with open(output, encoding="utf-8") as f:
+        shared = f.read()
+    assert "Style: Text1," in shared
+    assert len(shared) < len(inline)
+
+
+def test_cli_watch_error(tmp_path):
+    from Annotations2Sub import watch
+
+    stop = threading.Event()
+    batches = []
+    original = watch.Watch
+
+    def Watch(watcher, callback):
+        original(watcher, callback, 0.01, stop)
+
+    def RunQueue(queue, args):
+        batches.append(queue)
+        if len(batches) == 1:
+            # 下一批
+            with open(tmp_path / "2.xml", "wb") as f:
+                f.write(b"2")
+            raise RuntimeError
+        stop.set()
+        return 0
+
+    with open(tmp_path / "1.xml", "wb") as f:
+        f.write(b"1")
+    m = pytest.MonkeyPatch()
+    m.setattr(watch, "Watch", Watch)
+    m.setattr(cli, "RunQueue", RunQueue)
+    # 出问题的话别一直卡住
+    timer = threading.Timer(10, stop.set)
+    timer.start()
+    assert run(["--watch", str(tmp_path), "--watch-debounce", "0"]) == 0
+    timer.cancel()
+    m.undo()
+    assert [[os.path.basename(file) for file in files] for files in batches] == [
+        ["1.xml"],
+        ["2.xml"],
+    ]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import defusedxml.ElementTree  # type: ignore
+import pytest
+
+from Annotations2Sub.Annotation import Parse
+from Annotations2Sub.Convert import StringToAss
+from tests import corpus
+
+
+def test_Generate():
+    data = corpus.Generate(200, seed=1)
+    assert data == corpus.Generate(200, seed=1)
+    assert data != corpus.Generate(200, seed=2)
+
+    annotations = Parse(defusedxml.ElementTree.fromstring(data))
+    assert len(annotations) == 200
+    assert {each.style for each in annotations} == set(corpus.STYLES)
+    StringToAss(data, True, 1920, 1080)
+
+
+def test_GenerateOptions():
+    data = corpus.Generate(
+        300,
+        {"speech": 1.0, "highlightText": 3.0},
+        {"text": 1.0, "branding": 1.0},
+        duration=60,
+        distribution="burst",
+        textLength=0,
+        malformed=0.5,
+    )
+    annotations = Parse(defusedxml.ElementTree.fromstring(data))
+    assert 0 < len(annotations) < 300
+    assert {each.style for each in annotations} == {"speech", "highlightText"}
+    assert {each.type for each in annotations} == {"text", "branding"}
+    assert all(each.text == "" for each in annotations)
+    assert all(each.timeStart <= 60 * 1000 for each in annotations)
+    StringToAss(data)
+
+
+def test_corpus_main(tmp_path):
+    path = str(tmp_path / "corpus.xml")
+    assert corpus.main(["--count", "10", "--styles", "title", "-o", path]) == 0
+    with open(path, "rb") as f:
+        assert f.read() == corpus.Generate(10, {"title": 1.0})
+    with pytest.raises(ValueError):
+        corpus.ParseWeights("unknown=1", corpus.STYLES)
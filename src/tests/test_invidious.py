@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+from Annotations2Sub.invidious import INSTANCES_URL, Instances, Probe
+
+instances_string = (
+    r'[["0",{"api":false}],["1",{"api":true,"type":"onion"}],'
+    r'["2",{"api":true,"type":"https"}],["3"]]'
+)
+
+
+def test_InstancesDomains(tmp_path):
+    urls = []
+
+    def get(url: str):
+        urls.append(url)
+        return instances_string
+
+    path = str(tmp_path / "invidious.json")
+    instances = Instances(path)
+    assert instances.Domains(get) == ["2", "3"]
+    assert instances.Domains(get) == ["2", "3"]
+    assert urls == [INSTANCES_URL]
+
+    # 换个进程也不用再下载
+    assert Instances(path).Domains(get) == ["2", "3"]
+    assert len(urls) == 1
+
+    # 过期了重新下载
+    assert Instances(path, ttl=0).Domains(get) == ["2", "3"]
+    assert len(urls) == 2
+
+
+def test_InstancesRank(tmp_path):
+    path = str(tmp_path / "invidious.json")
+    instances = Instances(path)
+    instances.Report("slow", 5.0)
+    instances.Report("fast", 0.1)
+    instances.Report("broken", 0.1)
+    instances.Report("broken", None)
+    assert instances.Rank(["broken", "new", "slow", "fast"]) == [
+        "fast",
+        "new",
+        "slow",
+        "broken",
+    ]
+    instances.Save()
+    assert Instances(path).Rank(["broken", "slow", "fast"]) == [
+        "fast",
+        "slow",
+        "broken",
+    ]
+
+
+def test_Probe():
+    event = threading.Event()
+
+    def request(domain: str):
+        if domain == "slow":
+            event.wait(10)
+            return "slow"
+        if domain == "broken":
+            raise ValueError
+        return domain
+
+    instances = Instances()
+    start = time.perf_counter()
+    assert Probe(["slow", "broken", "fast"], request, instances) == ("fast", "fast")
+    assert time.perf_counter() - start < 5
+    event.set()
+    assert instances.Rank(["broken", "fast"]) == ["fast", "broken"]
+
+    # 排在后面的实例等前面的失败了才问
+    assert Probe(["broken", "broken", "fast"], request, width=1) == ("fast", "fast")
+
+    with pytest.raises(LookupError):
+        Probe(["broken"], request)
+
+    def error(domain: str):
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        Probe(["1"], error)
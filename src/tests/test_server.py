@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import threading
+import urllib.request
+from urllib.error import HTTPError
+
+import pytest
+
+from Annotations2Sub.server import MakeServer
+
+base_path = os.path.dirname(__file__)
+baseline_path = os.path.join(base_path, "testCase", "Baseline")
+baseline1_file = os.path.join(baseline_path, "29-q7YnyUmY.xml.test")
+baseline3_file = os.path.join(baseline_path, "annotation.xml.test")
+
+
+def Fetch(video_id: str):
+    if video_id == "29-q7YnyUmY":
+        with open(baseline1_file, "rb") as f:
+            return f.read()
+    if video_id == "e8kKeUuytqA":
+        raise HTTPError("", 404, "Not Found", None, None)  # type: ignore
+    if video_id == "corruptedId":
+        raise OSError("file is not a database")
+    return None
+
+
+def Request(url: str, data=None):
+    try:
+        with urllib.request.urlopen(url, data) as r:
+            return r.status, r.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_Server(jobs):
+    server = MakeServer("127.0.0.1:0", Fetch, jobs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/convert"
+
+    with open(baseline3_file, "rb") as f:
+        data = f.read()
+    with open(baseline3_file.replace(".xml.test", ".ass.test"), "rb") as f:
+        expected = f.read()
+    assert Request(f"{base}?title=annotation.xml.test", data) == (200, expected)
+
+    with open(baseline1_file.replace(".xml.test", ".ass.test"), "rb") as f:
+        expected = f.read()
+    assert Request(f"{base}?video=29-q7YnyUmY&title=29-q7YnyUmY.xml.test") == (
+        200,
+        expected,
+    )
+    status, body = Request(f"{base}?video=29-q7YnyUmY&libass=1&x=1920&y=1080")
+    assert status == 200 and body != expected
+
+    assert Request(base, b"<")[0] == 400
+    assert Request(base, b"<a/>") == (400, b"not an annotation file\n")
+    assert Request(base, data.replace(b'x="', b'x="abc', 1)) == (
+        400,
+        b"malformed annotation content\n",
+    )
+    # 缺了 segment 或者 t 是客户端的问题, 不是 500
+    no_segment = data.replace(b"<segment>", b"<segment2>", 1)
+    no_segment = no_segment.replace(b"</segment>", b"</segment2>", 1)
+    for broken in (no_segment, data.replace(b' t="', b' t2="', 1)):
+        assert Request(base, broken) == (400, b"malformed annotation content\n")
+    assert Request(f"{base}?x=a", data)[0] == 400
+    assert Request(f"{base}?video=1")[0] == 400
+    assert Request(f"{base}?video=e8kKeUuytqA")[0] == 404
+    assert Request(f"{base}?video=29-q7YnyUm1")[0] == 404
+    assert Request(base.replace("/convert", "/"))[0] == 404
+    assert Request(f"{base}?video=corruptedId") == (
+        500,
+        b"fetching annotations failed\n",
+    )
+
+    def Broken(*args):
+        raise RuntimeError
+
+    server.Convert, Convert = Broken, server.Convert
+    assert Request(base, data) == (500, b"conversion failed\n")
+    server.Convert = Convert
+
+    server.max_body = 10
+    assert Request(base, data)[0] == 413
+
+    server.shutdown()
+    server.Close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="no Unix sockets")
+def test_UnixServer(tmp_path):
+    path = str(tmp_path / "server.sock")
+    server = MakeServer(f"unix:{path}", Fetch)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(b"GET /convert?video=29-q7YnyUmY HTTP/1.0\r\n\r\n")
+        response = b""
+        while True:
+            chunk = s.recv(65536)
+            if chunk == b"":
+                break
+            response += chunk
+    assert response.startswith(b"HTTP/1.1 200")
+    assert b"[Events]" in response
+
+    server.shutdown()
+    server.Close()
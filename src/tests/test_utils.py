@@ -2,10 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import gettext
+import http.server
+import threading
+import urllib.request
+from urllib.error import HTTPError, URLError
 
 import pytest
 
-from Annotations2Sub.utils import MakeSureStr, RedText, YellowText, internationalization
+from Annotations2Sub.utils import (
+    GetBytes,
+    GetUrl,
+    MakeSureStr,
+    RedText,
+    Timer,
+    YellowText,
+    internationalization,
+)
 
 
 def test_YellowText():
@@ -33,3 +45,70 @@ def test_internationalization2():
     m.setattr(gettext, "translation", f)
 
     internationalization()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        Handler.connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/file/redirected")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if not self.path.startswith("/file/"):
+            self.send_error(404)
+            return
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_GetBytes():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    m = pytest.MonkeyPatch()
+    m.setattr(urllib.request, "getproxies", lambda: {})
+
+    Handler.connections = 0
+    for i in range(10):
+        assert GetBytes(f"{base}/file/{i}") == f"/file/{i}".encode("utf-8")
+    assert Handler.connections == 1
+
+    assert GetUrl(f"{base}/redirect") == "/file/redirected"
+    with pytest.raises(HTTPError):
+        GetBytes(f"{base}/404")
+    with pytest.raises(URLError):
+        GetBytes("ftp://127.0.0.1/")
+
+    # 服务器不在了, 复用的连接重试一次后抛出 URLError
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(URLError):
+        GetBytes(f"{base}/file/0")
+
+    m.undo()
+
+
+def test_Timer():
+    stats = {}
+    with Timer(stats, "a"):
+        pass
+    with Timer(stats, "a"):
+        pass
+    assert list(stats) == ["a"]
+    assert stats["a"] >= 0
+    with Timer(None, "a"):
+        pass
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+from Annotations2Sub.watch import Watcher
+
+
+def Touch(path: str, data: bytes, mtime: int):
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_Watcher(tmp_path):
+    a = str(tmp_path / "a.xml")
+    b = str(tmp_path / "b.xml")
+    Touch(a, b"1", 1)
+    Touch(str(tmp_path / "a.xml.ass"), b"", 1)
+    os.mkdir(tmp_path / "c.xml")
+
+    watcher = Watcher(str(tmp_path), debounce=1.0)
+    assert watcher.Poll(0.0) == []
+    # 还没稳定下来
+    assert watcher.Poll(0.5) == []
+    assert watcher.Poll(1.0) == [a]
+    assert watcher.Poll(5.0) == []
+
+    # 一直在写的文件等写完了才交出去
+    Touch(b, b"1", 2)
+    assert watcher.Poll(10.0) == []
+    Touch(b, b"12", 3)
+    assert watcher.Poll(10.9) == []
+    Touch(a, b"2", 4)
+    assert watcher.Poll(11.5) == []
+    assert watcher.Poll(12.5) == [a, b]
+    assert watcher.Poll(20.0) == []
+
+    # 删掉再放回来算新文件
+    os.remove(a)
+    assert watcher.Poll(21.0) == []
+    Touch(a, b"2", 4)
+    assert watcher.Poll(22.0) == []
+    assert watcher.Poll(23.0) == [a]